@@ -32,15 +32,37 @@
 #
 ''' Class containing calls to CVP RESTful API.
 '''
+import hashlib
+import heapq
+import json
 import operator
 import os
+import tarfile
+import threading
 import time
+import uuid
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED
+from concurrent.futures import wait as wait_futures
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
 # This import is for proper file IO handling support for both Python 2 and 3
-from io import open
-from datetime import datetime
+from io import open, BytesIO
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from itertools import islice
 from re import split
 
-from cvprac.cvp_client_errors import CvpApiError
+from requests.exceptions import ChunkedEncodingError, Timeout
+from requests.exceptions import ConnectionError as RequestsConnectionError
+
+from cvprac.cvp_client_errors import CvpApiError, CvpRequestError
+from cvprac.cvp_logging import LogPayload
+from cvprac.cvp_records import ConfigletRecord, DeviceRecord
+from cvprac.cvp_resource import Resource, eq_filters, format_utc_time
+from cvprac.cvp_tags import TagIndex
+from cvprac.cvp_topology import TopologyGraph
 
 try:
     from urllib import quote_plus as qplus
@@ -55,6 +77,89 @@ OPERATOR_DICT = {
     '==': operator.eq
 }
 
+# Device complianceCode values and the conditions they indicate
+COMPLIANCE_CODES = {
+    '0000': ('Configuration is in sync', ()),
+    '0001': ('Config is out of sync', ('config',)),
+    '0002': ('Image is out of sync', ('image',)),
+    '0003': ('Config & image out of sync', ('config', 'image')),
+    '0004': ('Config, Image and Device time are in sync', ()),
+    '0005': ('Device is not reachable', ('unreachable',)),
+    '0006': ('The current EOS version on this device is not supported by'
+             ' CVP. Upgrade the device to manage.', ('unsupported',)),
+    '0007': ('Extensions are out of sync', ('extensions',)),
+    '0008': ('Config, Image and Extensions are out of sync',
+             ('config', 'image', 'extensions')),
+    '0009': ('Config and Extensions are out of sync',
+             ('config', 'extensions')),
+    '0010': ('Image and Extensions are out of sync',
+             ('image', 'extensions')),
+    '0011': ('Unauthorized User', ('unauthorized',)),
+    '0012': ('Config, Image, Extension and Device time are out of sync',
+             ('config', 'image', 'extensions', 'device_time')),
+    '0013': ('Config, Image and Device time are out of sync',
+             ('config', 'image', 'device_time')),
+    '0014': ('Config, Extensions and Device time are out of sync',
+             ('config', 'extensions', 'device_time')),
+    '0015': ('Image, Extensions and Device time are out of sync',
+             ('image', 'extensions', 'device_time')),
+    '0016': ('Config and Device time are out of sync',
+             ('config', 'device_time')),
+    '0017': ('Image and Device time are out of sync',
+             ('image', 'device_time')),
+    '0018': ('Extensions and Device time are out of sync',
+             ('extensions', 'device_time')),
+    '0019': ('Device time is out of sync', ('device_time',)),
+}
+COMPLIANCE_FLAGS = ('config', 'image', 'extensions', 'device_time',
+                    'unreachable', 'unsupported', 'unauthorized')
+
+# Inventory record fields and their path in the inventory Device resource
+INVENTORY_FIELDS = {
+    'serialNumber': ('key', 'deviceId'),
+    'hostname': ('hostname',),
+    'fqdn': ('fqdn',),
+    'domainName': ('domainName',),
+    'systemMacAddress': ('systemMacAddress',),
+    'modelName': ('modelName',),
+    'hardwareRevision': ('hardwareRevision',),
+    'softwareVersion': ('softwareVersion',),
+    'bootTime': ('bootTime',),
+    'streamingStatus': ('streamingStatus',),
+    'extendedAttributes': ('extendedAttributes',),
+}
+INVENTORY_DEFAULT_FIELDS = ('hostname', 'serialNumber', 'systemMacAddress',
+                            'modelName', 'softwareVersion', 'streamingStatus')
+
+# Built-in accounts that aaa_sync never deletes unless asked to
+AAA_PROTECTED_ACCOUNTS = frozenset(['cvpadmin'])
+
+
+def decode_compliance_code(code):
+    ''' Decode a device complianceCode into structured flags.
+
+        Args:
+            code (str): The complianceCode, e.g.: '0003'
+
+        Returns:
+            compliance (dict): A dict with the 'code', the 'description',
+                'in_sync' and a boolean for every flag in COMPLIANCE_FLAGS.
+                Unknown codes are reported as not in sync with no flag set.
+
+                Ex: {'code': '0003', 'description': 'Config & image out of sync',
+                     'in_sync': False, 'config': True, 'image': True,
+                     'extensions': False, 'device_time': False,
+                     'unreachable': False, 'unsupported': False,
+                     'unauthorized': False}
+    '''
+    description, flags = COMPLIANCE_CODES.get(
+        code, (f"Unknown compliance code {code}", None))
+    compliance = {'code': code, 'description': description,
+                  'in_sync': flags == ()}
+    for flag in COMPLIANCE_FLAGS:
+        compliance[flag] = flag in (flags or ())
+    return compliance
+
 
 def sanitize_warnings(data):
     ''' Sanitize the warnings returned after validation.
@@ -102,6 +207,369 @@ def sanitize_warnings(data):
     return data
 
 
+def _parse_utc_time(timestamp):
+    ''' Parse an RFC3339 UTC timestamp with or without fractional seconds
+        into a naive datetime.
+    '''
+    return datetime.strptime(timestamp.split('.')[0].rstrip('Z'),
+                             "%Y-%m-%dT%H:%M:%S")
+
+
+def rfc3339_key(timestamp):
+    ''' Return a key for comparing RFC3339 UTC timestamps with any number of
+        fractional second digits.
+
+        Args:
+            timestamp (str): The timestamp, e.g.: 2021-11-19T15:04:05.12Z
+
+        Returns:
+            key (tuple): A comparable tuple or None if timestamp is None.
+    '''
+    if timestamp is None:
+        return None
+    base, _, frac = timestamp.rstrip('Z').partition('.')
+    return (base, frac.ljust(9, '0'))
+
+
+@lru_cache(maxsize=None)
+def inventory_record(fields):
+    ''' Returns the namedtuple class used for inventory records with the
+        given fields.
+
+        Args:
+            fields (tuple): Field names from INVENTORY_FIELDS.
+    '''
+    return namedtuple('InventoryRecord', fields)
+
+
+class TopologyBatch():
+    ''' Collects the temp actions built by CvpApi topology methods so they
+        can be submitted together.  Instances are created by
+        CvpApi.topology_batch() and should not be instantiated directly.
+
+        While a batch is active every call to CvpApi._add_temp_action() adds
+        its actions to the batch instead of posting them, and every call to
+        CvpApi._save_topology_v2() is deferred.  When the batch is committed
+        the actions are posted in chunks of chunk_size per addTempAction
+        request and a single saveTopology request creates the tasks.
+
+        Attributes:
+            actions (list): Temp actions waiting to be posted.
+            response (dict): The saveTopology response once committed.
+            task_ids (list): The task IDs created by the commit.
+    '''
+    # pylint: disable=protected-access
+
+    def __init__(self, api, chunk_size=500):
+        ''' Initialize the batch.
+
+            Args:
+                api (obj): The CvpApi object the batch belongs to.
+                chunk_size (int): Maximum number of temp actions to send in
+                    a single addTempAction request. Default is 500.
+        '''
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+        self.api = api
+        self.chunk_size = chunk_size
+        self.actions = []
+        self.save_data = []
+        self.response = None
+        self.task_ids = []
+
+    def __len__(self):
+        return len(self.actions)
+
+    def add(self, actions):
+        ''' Add temp actions to the batch.
+
+            Args:
+                actions (list): A list of temp action dicts as built for the
+                    'data' key of an addTempAction request.
+        '''
+        self.actions.extend(actions)
+
+    def flush(self):
+        ''' Post all pending temp actions without saving the topology.
+            This is required before reading data that depends on the
+            pending actions, for example proposed configlets of a device
+            that is being moved.
+        '''
+        while self.actions:
+            chunk = self.actions[:self.chunk_size]
+            self.api.log.debug('topology_batch: posting %d temp actions',
+                               len(chunk))
+            try:
+                self.api._post_temp_action({'data': chunk})
+            except CvpApiError as error:
+                if 'Data already exists' not in str(error) or len(chunk) == 1:
+                    raise
+                # One action in the chunk is already in place. Post the
+                # actions individually so the remaining ones still apply,
+                # the same way the individual methods ignore this error.
+                self.api.log.debug('topology_batch: %s. Posting chunk'
+                                   ' actions individually', error)
+                for action in chunk:
+                    try:
+                        self.api._post_temp_action({'data': [action]})
+                    except CvpApiError as action_error:
+                        if 'Data already exists' not in str(action_error):
+                            raise
+            del self.actions[:self.chunk_size]
+
+    def commit(self):
+        ''' Post all pending temp actions and save the topology once.
+
+            Returns:
+                response (dict): A dict that contains a status and a list of
+                    task ids created (if any).
+
+                    Ex: {u'data': {u'status': u'success', u'taskIds': [u'32']}}
+        '''
+        self.flush()
+        self.response = self.api._save_topology_v2(self.save_data)
+        self.save_data = []
+        if self.response and 'data' in self.response:
+            self.task_ids = self.response['data'].get('taskIds', [])
+        return self.response
+
+
+class ChangeControlMonitor():
+    ''' Tracks the execution of many Change Controls together.  Instances
+        are created by CvpApi.change_control_monitor() and should not be
+        instantiated directly.
+
+        Every poll is a single GetAll request filtered on the Change
+        Controls that are still running, regardless of the number of stages
+        tracked, and Change Controls whose resource time did not change are
+        not compared again.  Alternatively the Change Controls can be
+        followed with a Resource API subscription.
+
+        Attributes:
+            state (dict): Per Change Control ID the 'status', 'error',
+                'time' and per stage ID the 'name', 'status', 'error',
+                'started' and 'finished' times.
+    '''
+    COMPLETED = 'CHANGE_CONTROL_STATUS_COMPLETED'
+    STAGE_RUNNING = 'STAGE_STATUS_RUNNING'
+    STAGE_COMPLETED = 'STAGE_STATUS_COMPLETED'
+
+    def __init__(self, api, cc_ids):
+        ''' Initialize the monitor.
+
+            Args:
+                api (obj): The CvpApi object used for the requests.
+                cc_ids (list): The IDs of the Change Controls to track.
+        '''
+        self.api = api
+        self.state = {cc_id: {'status': None, 'error': None, 'time': None,
+                              'stages': {}}
+                      for cc_id in cc_ids}
+
+    def done(self, cc_id):
+        ''' Returns True if the Change Control completed or failed.
+        '''
+        cc_state = self.state[cc_id]
+        return cc_state['status'] == self.COMPLETED or bool(cc_state['error'])
+
+    def update(self, value, resource_time=None):
+        ''' Apply the value of a ChangeControl resource and return the
+            state transitions it caused.
+
+            Args:
+                value (dict): The ChangeControl resource value.
+                resource_time (str): The time of the resource. If it equals
+                    the time already applied the value is skipped.
+
+            Returns:
+                transitions (list): A list of dicts with the 'cc_id',
+                    'stage_id' (None for the Change Control itself), 'name',
+                    'previous' and 'status' keys, the 'time' the transition
+                    was seen and the 'duration' in seconds of finished
+                    stages.
+        '''
+        cc_id = value.get('key', {}).get('id')
+        if cc_id not in self.state:
+            return []
+        cc_state = self.state[cc_id]
+        if resource_time is not None and resource_time == cc_state['time']:
+            return []
+        cc_state['time'] = resource_time
+        now = time.time()
+        transitions = []
+        change = value.get('change', {})
+        for stage_id, stage in change.get('stages', {}).get(
+                'values', {}).items():
+            stage_state = cc_state['stages'].setdefault(
+                stage_id, {'name': stage.get('name'), 'status': None,
+                           'error': None, 'started': None, 'finished': None})
+            status = stage.get('status')
+            error = stage.get('error') or None
+            if status == stage_state['status'] and \
+                    error == stage_state['error']:
+                continue
+            if status == self.STAGE_RUNNING and stage_state['started'] is None:
+                stage_state['started'] = now
+            duration = None
+            if status == self.STAGE_COMPLETED or error:
+                stage_state['finished'] = now
+                if stage_state['started'] is not None:
+                    duration = now - stage_state['started']
+            transitions.append({'cc_id': cc_id, 'stage_id': stage_id,
+                                'name': stage_state['name'],
+                                'previous': stage_state['status'],
+                                'status': status, 'error': error,
+                                'time': now, 'duration': duration})
+            stage_state['status'] = status
+            stage_state['error'] = error
+        status = value.get('status')
+        error = value.get('error') or None
+        if status != cc_state['status'] or error != cc_state['error']:
+            transitions.append({'cc_id': cc_id, 'stage_id': None,
+                                'name': change.get('name'),
+                                'previous': cc_state['status'],
+                                'status': status, 'error': error,
+                                'time': now, 'duration': None})
+            cc_state['status'] = status
+            cc_state['error'] = error
+        return transitions
+
+    def _running(self):
+        return [cc_id for cc_id in self.state if not self.done(cc_id)]
+
+    def poll(self):
+        ''' Get the tracked Change Controls that are still running with a
+            single request and return their state transitions.
+
+            Returns:
+                transitions (list): See update().
+        '''
+        transitions = []
+        running = self._running()
+        if not running:
+            return transitions
+        results = self.api.resource('changecontrol/v1/ChangeControl').get_all(
+            eq_filters({'key.id': running}))
+        for result in results or []:
+            transitions.extend(self.update(result.get('value', {}),
+                                           result.get('time')))
+        return transitions
+
+    def _follow(self, deadline, max_interval):
+        ''' Yield the transitions from a subscription to the tracked Change
+            Controls until they are finished or the deadline passed. Returns
+            False if subscriptions are not supported or the stream broke
+            before that, so the caller can continue by polling.
+        '''
+        if self.finished():
+            return True
+        read_timeout = 300
+        max_reconnects = 5
+        if deadline is not None:
+            # Without events nothing else interrupts the stream, so a quiet
+            # stream has to time out to let the deadline be enforced.
+            read_timeout = max(1, min(max_interval,
+                                      deadline - time.time()))
+            max_reconnects = 0
+        events = self.api.resource_subscribe(
+            'changecontrol/v1/ChangeControl',
+            partial_eq_filter=[{'key': {'id': cc_id}}
+                               for cc_id in self._running()],
+            timeout=read_timeout, max_reconnects=max_reconnects)
+        if events is None:
+            return False
+        try:
+            for event in events:
+                yield from self.update(event.get('value', {}))
+                if self.finished() or (deadline is not None and
+                                       time.time() >= deadline):
+                    return True
+        except (ChunkedEncodingError, RequestsConnectionError,
+                Timeout) as error:
+            self.api.log.debug('Change Control subscription ended: %s',
+                               error)
+            return False
+        finally:
+            events.close()
+        return self.finished()
+
+    def watch(self, interval=5, max_interval=30, timeout=None,
+              subscribe=False):
+        ''' Yield state transitions until every tracked Change Control
+            completed or failed.
+
+            Args:
+                interval (int): Initial number of seconds between polls.
+                    The interval doubles up to max_interval while nothing
+                    changes. Default is 5.
+                max_interval (int): Maximum number of seconds between
+                    polls. Default is 30.
+                timeout (int): Maximum number of seconds to watch.
+                    Default is None for no limit.
+                subscribe (bool): Follow a Resource API subscription instead
+                    of polling. Polling is used if subscriptions are not
+                    supported or the subscription stops, e.g. when it was
+                    quiet for max_interval seconds with a timeout set.
+                    Default is False.
+
+            Yields:
+                transition (dict): See update().
+        '''
+        start = time.time()
+        deadline = None if timeout is None else start + timeout
+        if subscribe:
+            stopped = yield from self._follow(deadline, max_interval)
+            if stopped:
+                return
+        delay = interval / 2
+        while True:
+            transitions = self.poll()
+            yield from transitions
+            if self.finished():
+                return
+            elapsed = time.time() - start
+            if timeout is not None and elapsed >= timeout:
+                return
+            delay = interval if transitions else min(delay * 2, max_interval)
+            if timeout is not None:
+                delay = min(delay, timeout - elapsed)
+            time.sleep(delay)
+
+    def finished(self):
+        ''' Returns True if every tracked Change Control completed or
+            failed.
+        '''
+        return all(self.done(cc_id) for cc_id in self.state)
+
+    def progress(self):
+        ''' Returns an aggregate view of the tracked Change Controls.
+
+            Returns:
+                progress (dict): The number of Change Controls that are
+                    'completed', 'failed' and 'running', the number of
+                    stages in total and completed and the completed stages
+                    'percent'.
+        '''
+        progress = {'change_controls': len(self.state), 'completed': 0,
+                    'failed': 0, 'running': 0, 'stages': 0,
+                    'stages_completed': 0, 'percent': 0.0}
+        for cc_id, cc_state in self.state.items():
+            if cc_state['error']:
+                progress['failed'] += 1
+            elif self.done(cc_id):
+                progress['completed'] += 1
+            else:
+                progress['running'] += 1
+            for stage in cc_state['stages'].values():
+                progress['stages'] += 1
+                if stage['status'] == self.STAGE_COMPLETED:
+                    progress['stages_completed'] += 1
+        if progress['stages']:
+            progress['percent'] = round(
+                100.0 * progress['stages_completed'] / progress['stages'], 1)
+        return progress
+
+
 class CvpApi():
     ''' CvpApi class contains calls to CVP RESTful API.  The RESTful API
         parameters are passed in as parameters to the method.  The results of
@@ -140,6 +608,56 @@ class CvpApi():
         self.clnt = clnt
         self.log = clnt.log
         self.request_timeout = request_timeout
+        self._local = threading.local()
+
+    @property
+    def _topology_batch(self):
+        ''' The TopologyBatch opened by topology_batch() in the calling
+            thread, or None.  Batches are per thread so that concurrent
+            callers sharing this CvpApi never capture each other's temp
+            actions.
+        '''
+        return getattr(self._local, 'topology_batch', None)
+
+    @_topology_batch.setter
+    def _topology_batch(self, batch):
+        self._local.topology_batch = batch
+
+    def _run_concurrently(self, func, items, max_workers=8):
+        ''' Call func for every item using a bounded pool of worker threads.
+            At most 2 * max_workers calls are queued at any time, so items
+            can be a generator over a very large collection.
+
+            Args:
+                func (callable): Function called with a single item.
+                items (iterable): The items to process.
+                max_workers (int): Maximum number of concurrent calls.
+                    Default is 8.
+
+            Yields:
+                (item, result, error) tuples in completion order.  error is
+                    None if the call succeeded, otherwise it is the exception
+                    raised by func and result is None.
+        '''
+        if max_workers < 1:
+            raise ValueError('max_workers must be a positive integer')
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {executor.submit(func, item): item
+                       for item in islice(items, max_workers * 2)}
+            while pending:
+                done, _ = wait_futures(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    for new_item in islice(items, 1):
+                        pending[executor.submit(func, new_item)] = new_item
+                    error = future.exception()
+                    if error is not None:
+                        self.log.debug('Concurrent call for %s failed: %s',
+                                       item, error)
+                        yield item, None, error
+                    else:
+                        yield item, future.result(), None
 
     def cvp_version_compare(self, opr, version, msg):
         ''' Check provided version with given operator against the current CVP
@@ -210,9 +728,8 @@ class CvpApi():
                 user_type (str): type of AAA (Local/TACACS/RADIUS)
         '''
         if status not in ['Enabled', 'Disabled']:
-            self.log.error(f"Invalid status {status}."
-                           " Status must be Enabled or Disabled."
-                           " Defaulting to Disabled")
+            self.log.error("Invalid status %s. Status must be Enabled or"
+                           " Disabled. Defaulting to Disabled", status)
             status = 'Disabled'
         data = {"roles": [role],
                 "user": {"contactNumber": "",
@@ -234,7 +751,8 @@ class CvpApi():
 
             Args:
                 username (str): local username on CVP
-                password (str): password of the user
+                password (str): password of the user or None to leave the
+                    password unchanged
                 role (str): role of the user
                 status (str): state of the user (Enabled/Disabled)
                 first_name (str): first name of the user
@@ -243,9 +761,8 @@ class CvpApi():
                 user_type (str): type of AAA (Local/TACACS/RADIUS)
         '''
         if status not in ['Enabled', 'Disabled']:
-            self.log.error(f"Invalid status {status}."
-                           f" Status must be Enabled or Disabled."
-                           f" Defaulting to Disabled")
+            self.log.error("Invalid status %s. Status must be Enabled or"
+                           " Disabled. Defaulting to Disabled", status)
             status = 'Disabled'
         data = {"roles": [role],
                 "user": {"contactNumber": "",
@@ -256,6 +773,8 @@ class CvpApi():
                          "userId": username,
                          "userStatus": status,
                          "userType": user_type}}
+        if password is None:
+            del data['user']['password']
         return self.clnt.post(f"/user/updateUser.do?userId={username}",
                               data=data, timeout=self.request_timeout)
 
@@ -293,7 +812,7 @@ class CvpApi():
                                 'currentStatus': 'Online',
                                 'addedByUser': 'cvp system'}]}
         '''
-        self.log.debug(f"get_users: query: {query}")
+        self.log.debug("get_users: query: %s", query)
         return self.clnt.get(f"/user/getUsers.do?"
                              f"queryparam={qplus(query)}&startIndex={start}&endIndex={end}",
                              timeout=self.request_timeout)
@@ -308,6 +827,15 @@ class CvpApi():
         return self.clnt.post('/user/deleteUsers.do', data=data,
                               timeout=self.request_timeout)
 
+    def delete_users(self, usernames):
+        ''' Remove specified users from CVP with a single request
+
+            Args:
+                usernames (list): list of usernames on CVP
+        '''
+        return self.clnt.post('/user/deleteUsers.do', data=usernames,
+                              timeout=self.request_timeout)
+
     def get_task_by_id(self, task_id):
         ''' Returns the current CVP Task status for the task with the specified
             TaskId.
@@ -319,12 +847,12 @@ class CvpApi():
                 task (dict): The CVP task for the associated Id.  Returns None
                     if the task_id was invalid.
         '''
-        self.log.debug(f"get_task_by_id: task_id: {task_id}")
+        self.log.debug("get_task_by_id: task_id: %s", task_id)
         try:
             task = self.clnt.get(f"/task/getTaskById.do?taskId={task_id}",
                                  timeout=self.request_timeout)
         except CvpApiError as error:
-            self.log.debug(f"Caught error: {error} attempting to get task.")
+            self.log.debug("Caught error: %s attempting to get task.", error)
             # Catch an invalid task_id error and return None
             return None
         return task
@@ -341,7 +869,7 @@ class CvpApi():
             Returns:
                 tasks (list): The list of tasks
         '''
-        self.log.debug(f"get_tasks_by_status: status: {status}")
+        self.log.debug("get_tasks_by_status: status: %s", status)
         data = self.clnt.get(
             f"/task/getTasks.do?queryparam={status}&startIndex={start}&endIndex={end}",
             timeout=self.request_timeout)
@@ -363,6 +891,77 @@ class CvpApi():
         return self.clnt.get(f"/task/getTasks.do?queryparam=&startIndex={start}&"
                              f"endIndex={end}", timeout=self.request_timeout)
 
+    def wait_for_tasks(self, task_ids, timeout=3600, interval=1,
+                       max_interval=30, callback=None, max_workers=8):
+        ''' Wait for many tasks to reach a final state. Every poll gets the
+            Pending tasks with one request, and only the tracked tasks that
+            are no longer pending are then fetched by ID, concurrently. The
+            poll interval doubles up to max_interval while no task
+            finishes and is reset whenever a task finishes.
+
+            Args:
+                task_ids (list): List of task IDs to wait for.
+                timeout (int): Maximum number of seconds to wait.
+                    Default is 3600.
+                interval (int): Initial number of seconds between polls.
+                    Default is 1.
+                max_interval (int): Maximum number of seconds between polls.
+                    Default is 30.
+                callback (function): Optional function called as
+                    callback(task) with the task dict of every task as it
+                    reaches a final state.
+                max_workers (int): Maximum number of concurrent task
+                    requests. Default is 8.
+
+            Returns:
+                response (dict): A dict with the 'completed', 'failed',
+                    'cancelled' and 'pending' sets of task IDs and a
+                    'seen_after' dict of task ID to the number of seconds
+                    from the start of the wait until a poll saw the task in
+                    its final state.  This is not the run time of the task,
+                    it is bounded by the poll interval.  Tasks still in
+                    'pending' did not finish before the timeout.
+        '''
+        self.log.debug("wait_for_tasks: task_ids: %s timeout: %s",
+                       LogPayload(task_ids), timeout)
+        final_states = {'Completed': 'completed', 'Failed': 'failed',
+                        'Cancelled': 'cancelled'}
+        remaining = {str(task_id) for task_id in task_ids}
+        response = {'completed': set(), 'failed': set(), 'cancelled': set(),
+                    'pending': remaining, 'seen_after': {}}
+        start = time.time()
+        delay = interval / 2
+        while remaining:
+            pending = {task['workOrderId']
+                       for task in self.get_tasks_by_status('Pending')}
+            finished = 0
+            # Tasks that left Pending are few, so they are fetched by ID
+            # instead of listing the whole history of every final status
+            candidates = sorted(remaining - pending)
+            for task_id, task, error in self._run_concurrently(
+                    self.get_task_by_id, candidates, max_workers):
+                if error is not None or not task:
+                    continue
+                key = final_states.get(task.get('workOrderUserDefinedStatus'))
+                if key is None:
+                    continue
+                remaining.discard(task_id)
+                response[key].add(task_id)
+                response['seen_after'][task_id] = time.time() - start
+                finished += 1
+                if callback is not None:
+                    callback(task)
+            if not remaining:
+                break
+            elapsed = time.time() - start
+            if elapsed >= timeout:
+                self.log.warning("wait_for_tasks: timed out with %s tasks"
+                                 " pending", len(remaining))
+                break
+            delay = interval if finished else min(delay * 2, max_interval)
+            time.sleep(min(delay, timeout - elapsed))
+        return response
+
     def get_logs_by_id(self, task_id, start=0, end=0):
         ''' Returns the log entries for the task with the specified TaskId.
 
@@ -377,7 +976,7 @@ class CvpApi():
                 task (dict): The CVP log for the associated Id.  Returns None
                     if the task_id was invalid.
         '''
-        self.log.debug(f"get_logs_by_id: task_id: {task_id}")
+        self.log.debug("get_logs_by_id: task_id: %s", task_id)
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion < 5.0:
@@ -392,13 +991,13 @@ class CvpApi():
             if 'stageId' in task_info:
                 stage_id = task_info['stageId']
             else:
-                self.log.debug(f"No stage ID found for task {task_id}")
+                self.log.debug("No stage ID found for task %s", task_id)
             if 'ccIdV2' in task_info:
                 cc_id = task_info['ccIdV2']
                 if cc_id == '':
-                    self.log.debug(f"No ccIdV2 for task {task_id}."
-                                   f" It was likely cancelled."
-                                   f" Using old /task/getLogsByID.do?")
+                    self.log.debug("No ccIdV2 for task %s. It was likely"
+                                   " cancelled. Using old"
+                                   " /task/getLogsByID.do?", task_id)
                     resp = self.clnt.get(
                         f"/task/getLogsById.do?id={task_id}&queryparam="
                         f"&startIndex={start}&endIndex={end}",
@@ -406,32 +1005,200 @@ class CvpApi():
                 else:
                     resp = self.get_audit_logs_by_id(cc_id, stage_id)
             else:
-                self.log.debug(f"No change ID found for task {task_id}")
+                self.log.debug("No change ID found for task %s", task_id)
                 resp = None
         return resp
 
-    def get_audit_logs_by_id(self, cc_id, stage_id=None, data_size=75):
+    def get_logs_by_ids(self, task_ids, page_size=75, max_workers=8):
+        ''' Returns the log entries for many tasks. The task details are
+            resolved with a single task listing, tasks sharing a
+            ChangeControl stage are fetched once and the logs are retrieved
+            concurrently. Unlike get_logs_by_id every audit log page is
+            retrieved.
+
+            Args:
+                task_ids (list): List of CVP task identifiers.
+                page_size (int): Number of audit log entries requested per
+                    page. Default is 75.
+                max_workers (int): Maximum number of concurrent requests.
+                    Default is 8.
+
+            Returns:
+                logs (dict): A dict of task ID to the list of log entries
+                    for the task. The value is None if the task was not
+                    found or its logs could not be retrieved.
+        '''
+        self.log.debug("get_logs_by_ids: task_ids: %s", LogPayload(task_ids))
+        if self.clnt.apiversion is None:
+            self.get_cvp_info()
+        task_ids = [str(task_id) for task_id in task_ids]
+        logs = dict.fromkeys(task_ids)
+        # Map each unique log source to the tasks that share it
+        sources = {}
+        if self.clnt.apiversion < 5.0:
+            for task_id in task_ids:
+                sources.setdefault(('task', task_id), []).append(task_id)
+        else:
+            wanted = set(task_ids)
+            for task in self.get_tasks()['data']:
+                task_id = task['workOrderId']
+                if task_id not in wanted:
+                    continue
+                if 'ccIdV2' not in task:
+                    self.log.debug("No change ID found for task %s", task_id)
+                    continue
+                if task['ccIdV2'] == '':
+                    key = ('task', task_id)
+                else:
+                    key = ('audit', task['ccIdV2'], task.get('stageId'))
+                sources.setdefault(key, []).append(task_id)
+
+        def fetch(key):
+            if key[0] == 'task':
+                resp = self.clnt.get(
+                    f"/task/getLogsById.do?id={key[1]}&queryparam="
+                    f"&startIndex=0&endIndex=0",
+                    timeout=self.request_timeout)
+                return resp.get('data', [])
+            return list(self.iter_audit_logs(key[1], key[2], page_size))
+
+        for key, entries, error in self._run_concurrently(fetch, sources,
+                                                          max_workers):
+            if error is not None:
+                self.log.error("Failed to get logs for %s: %s", key, error)
+                continue
+            for task_id in sources[key]:
+                logs[task_id] = entries
+        return logs
+
+    def get_audit_logs_by_id(self, cc_id, stage_id=None, data_size=75,
+                             start_time=0, end_time=0,
+                             last_retrieved_audit=None):
         ''' Returns the audit logs of a particular ChangeControl.
 
             Args:
                 cc_id (string): change control ID from ccIdV2 field
                 stage_id (string): stage ID from stageId field
                 data_size (int): data size
+                start_time (int): Start of the time window in milliseconds
+                    since epoch. Default is 0 for no start.
+                end_time (int): End of the time window in milliseconds
+                    since epoch. Default is 0 for no end.
+                last_retrieved_audit (dict): The last audit entry of the
+                    previous page to continue from. Default is None for the
+                    first page.
 
             Returns:
                 task (dict): The CVP log for the associated ccIdV2
         '''
         data = {"category": "ChangeControl",
-                "startTime": 0,
-                "endTime": 0,
+                "startTime": start_time,
+                "endTime": end_time,
                 "dataSize": data_size,
                 "objectKey": cc_id,
-                "lastRetrievedAudit": {}}
+                "lastRetrievedAudit": last_retrieved_audit or {}}
         if stage_id:
             data["tags"] = {"stageId": stage_id}
         return self.clnt.post('/cvpservice/audit/getLogs.do?', data=data,
                               timeout=self.request_timeout)
 
+    def iter_audit_logs(self, cc_id, stage_id=None, page_size=75,
+                        start_time=0, end_time=0):
+        ''' Yield every audit log entry of a ChangeControl one page at a
+            time by following the lastRetrievedAudit cursor.
+
+            Args:
+                cc_id (string): change control ID from ccIdV2 field
+                stage_id (string): stage ID from stageId field
+                page_size (int): Number of entries requested per page.
+                    Default is 75.
+                start_time (int): Start of the time window in milliseconds
+                    since epoch. Default is 0 for no start.
+                end_time (int): End of the time window in milliseconds
+                    since epoch. Default is 0 for no end.
+
+            Yields:
+                entry (dict): An audit log entry.
+        '''
+        self.log.debug("iter_audit_logs: cc_id: %s stage_id: %s", cc_id,
+                       stage_id)
+        cursor = None
+        while True:
+            resp = self.get_audit_logs_by_id(cc_id, stage_id, page_size,
+                                             start_time, end_time, cursor)
+            entries = resp.get('data', []) if resp else []
+            yield from entries
+            if len(entries) < page_size:
+                return
+            next_cursor = resp.get('lastRetrievedAudit') or entries[-1]
+            if next_cursor == cursor:
+                return
+            cursor = next_cursor
+
+    def export_audit_logs(self, targets, destination, page_size=75,
+                          start_time=0, end_time=0, max_workers=8):
+        ''' Fetch the audit logs of many ChangeControls or stages
+            concurrently and write them to disk as they are retrieved. Each
+            ChangeControl or stage is written to its own JSON lines file
+            named <cc_id>.jsonl or <cc_id>_<stage_id>.jsonl.
+
+            Args:
+                targets (iterable): ChangeControl IDs or (cc_id, stage_id)
+                    tuples. Targets that map to the same file are
+                    exported once.
+                destination (str): Directory to write the files to.
+                page_size (int): Number of entries requested per page.
+                    Default is 75.
+                start_time (int): Start of the time window in milliseconds
+                    since epoch. Default is 0 for no start.
+                end_time (int): End of the time window in milliseconds
+                    since epoch. Default is 0 for no end.
+                max_workers (int): Maximum number of concurrent exports.
+                    Default is 8.
+
+            Returns:
+                response (dict): A dict with the number of entries written
+                    per file name under 'written' and the error message per
+                    file name under 'failed'.
+
+                    Ex: {'written': {'cc1.jsonl': 1204},
+                         'failed': {'cc2_stage1.jsonl': 'error message'}}
+        '''
+        os.makedirs(destination, exist_ok=True)
+
+        def target_name(target):
+            if isinstance(target, str):
+                return f"{target}.jsonl"
+            if target[1]:
+                return f"{target[0]}_{target[1]}.jsonl"
+            return f"{target[0]}.jsonl"
+
+        def export(target):
+            cc_id, stage_id = (target, None) if isinstance(target, str) \
+                else target
+            count = 0
+            path = os.path.join(destination, target_name(target))
+            with open(path, 'w', encoding='utf-8') as log_fh:
+                for entry in self.iter_audit_logs(cc_id, stage_id, page_size,
+                                                  start_time, end_time):
+                    log_fh.write(json.dumps(entry) + '\n')
+                    count += 1
+            return count
+
+        # Keep the first of the targets with the same file, in order, so two
+        # workers never write the same file
+        unique = {}
+        for target in targets:
+            unique.setdefault(target_name(target), target)
+        response = {'written': {}, 'failed': {}}
+        for target, count, error in self._run_concurrently(
+                export, unique.values(), max_workers):
+            if error is not None:
+                response['failed'][target_name(target)] = str(error)
+            else:
+                response['written'][target_name(target)] = count
+        return response
+
     def add_note_to_task(self, task_id, note):
         ''' Add notes to the task.
 
@@ -439,7 +1206,7 @@ class CvpApi():
                 task_id (str): Task ID
                 note (str): Note to add to the task
         '''
-        self.log.debug(f"add_note_to_task: task_id: {task_id} note: {note}")
+        self.log.debug("add_note_to_task: task_id: %s note: %s", task_id, note)
         data = {'workOrderId': task_id, 'note': note}
         self.clnt.post('/task/addNoteToTask.do', data=data,
                        timeout=self.request_timeout)
@@ -456,7 +1223,7 @@ class CvpApi():
             Args:
                 task_id (str): Task ID
         '''
-        self.log.debug(f"execute_task: task_id: {task_id}")
+        self.log.debug("execute_task: task_id: %s", task_id)
         data = {'data': [task_id]}
         self.clnt.post('/task/executeTask.do', data=data, timeout=self.request_timeout)
 
@@ -466,18 +1233,21 @@ class CvpApi():
             Args:
                 task_id (str): Task ID
         '''
-        self.log.debug(f"cancel_task: task_id: {task_id}")
+        self.log.debug("cancel_task: task_id: %s", task_id)
         data = {'data': [task_id]}
         return self.clnt.post('/task/cancelTask.do', data=data,
                               timeout=self.request_timeout)
 
-    def get_configlets(self, start=0, end=0):
+    def get_configlets(self, start=0, end=0, as_records=False):
         ''' Returns a list of all defined configlets.
 
             Args:
                 start (int): Start index for the pagination. Default is 0.
                 end (int): End index for the pagination. If end index is 0
                     then all the records will be returned. Default is 0.
+                as_records (bool): Return the 'data' entries as
+                    ConfigletRecord objects instead of dicts.
+                    Default is False.
         '''
         if self.clnt.apiversion is None:
             self.get_cvp_info()
@@ -486,14 +1256,17 @@ class CvpApi():
                                    timeout=self.request_timeout)
         if self.clnt.apiversion == 1.0 or self.clnt.apiversion >= 4.0:
             self.log.debug('v1/v4+ Inventory API Call')
-            return configlets
-        self.log.debug('v2 Inventory API Call')
-        # New API getConfiglets does not return the actual configlet config
-        # Get the actual configlet config using getConfigletByName
-        if 'data' in configlets:
-            for configlet in configlets['data']:
-                full_cfglt_data = self.get_configlet_by_name(configlet['name'])
-                configlet['config'] = full_cfglt_data['config']
+        else:
+            self.log.debug('v2 Inventory API Call')
+            # New API getConfiglets does not return the actual configlet config
+            # Get the actual configlet config using getConfigletByName
+            if 'data' in configlets:
+                for configlet in configlets['data']:
+                    full_cfglt_data = self.get_configlet_by_name(configlet['name'])
+                    configlet['config'] = full_cfglt_data['config']
+        if as_records and 'data' in configlets:
+            configlets['data'] = [ConfigletRecord.from_dict(configlet)
+                                  for configlet in configlets['data']]
         return configlets
 
     def get_configlets_and_mappers(self):
@@ -523,7 +1296,7 @@ class CvpApi():
                 end (int): End index for the pagination. If end index is 0
                     then all the records will be returned. Default is 0.
         '''
-        self.log.debug(f"search_configlets: query: {query}")
+        self.log.debug("search_configlets: query: %s", query)
         return self.clnt.get(f"/configlet/searchConfiglets.do?"
                              f"queryparam={qplus(query)}&startIndex={start}&endIndex={end}",
                              timeout=self.request_timeout)
@@ -537,7 +1310,7 @@ class CvpApi():
             Returns:
                 configlet (dict): The configlet dict.
         '''
-        self.log.debug(f"get_configlets_by_name: name: {name}")
+        self.log.debug("get_configlets_by_name: name: %s", name)
         return self.clnt.get(f"/configlet/getConfigletByName.do?name={qplus(name)}",
                              timeout=self.request_timeout)
 
@@ -600,12 +1373,13 @@ class CvpApi():
                 history (dict): The configlet dict with the changes from
                     most recent to oldest.
         '''
-        self.log.debug(f"get_configlets_history: key: {key}")
+        self.log.debug("get_configlets_history: key: %s", key)
         return self.clnt.get(f"/configlet/getConfigletHistory.do?configletId="
                              f"{key}&queryparam=&startIndex={start}&endIndex={end}",
                              timeout=self.request_timeout)
 
-    def get_inventory(self, start=0, end=0, query='', provisioned=True):
+    def get_inventory(self, start=0, end=0, query='', provisioned=True,
+                      as_records=False):
         ''' Returns the a dict of the net elements known to CVP.
 
             Args:
@@ -616,6 +1390,9 @@ class CvpApi():
                 query (string): A value that can be used as a match to filter
                     returned inventory list. For example get all switches that
                     are running a specific version of EOS.
+                as_records (bool): Return DeviceRecord objects that store
+                    every field once and provide the legacy alias keys as
+                    read-only views instead of dicts. Default is False.
         '''
         self.log.debug('get_inventory: called')
         if self.clnt.apiversion is None:
@@ -625,11 +1402,22 @@ class CvpApi():
             data = self.clnt.get(f"/inventory/getInventory.do?"
                                  f"queryparam={qplus(query)}&startIndex={start}&endIndex={end}",
                                  timeout=self.request_timeout)
+            if as_records:
+                return [DeviceRecord.from_dict(dev, exact=True)
+                        for dev in data['netElementList']]
             return data['netElementList']
         self.log.debug('v2 Inventory API Call')
         data = self.clnt.get(f"/inventory/devices?provisioned={provisioned}",
                              timeout=self.request_timeout)
         containers = self.get_containers()
+        if as_records:
+            names = {container['key']: container['name']
+                     for container in containers['data']}
+            return [DeviceRecord.from_dict(
+                dev, containerName=names.get(dev['parentContainerKey'], ''),
+                taskIdList=dev.get('taskIdList', []),
+                tempAction=dev.get('tempAction'))
+                for dev in data]
         for dev in data:
             dev['key'] = dev['systemMacAddress']
             dev['deviceInfo'] = dev['deviceStatus'] = dev['status']
@@ -658,6 +1446,64 @@ class CvpApi():
                 dev['containerName'] = ''
         return data
 
+    def iter_inventory(self, fields=INVENTORY_DEFAULT_FIELDS,
+                       serial_numbers=None, hostnames=None,
+                       model_names=None, software_versions=None,
+                       streaming_status=None):
+        ''' Yield compact inventory records from the inventory Device
+            Resource API. The filters are applied by the server and every
+            record is yielded as soon as it is decoded from the response
+            stream, so the full device list is never held in memory.
+            Supported versions: CVP 2021.2.0 or newer and CVaaS.
+
+            Args:
+                fields (tuple): The names of the fields to return, from
+                    INVENTORY_FIELDS. Default is INVENTORY_DEFAULT_FIELDS.
+                serial_numbers (str|list): Serial numbers to match.
+                hostnames (str|list): Hostnames to match.
+                model_names (str|list): Model names to match.
+                software_versions (str|list): EOS versions to match.
+                streaming_status (str|list): Streaming statuses to match,
+                    e.g.: 'STREAMING_STATUS_ACTIVE'.
+
+            Yields:
+                record (namedtuple): An inventory record with the requested
+                    fields. Missing fields are None.
+                Ex: InventoryRecord(hostname='leaf1', serialNumber='SN1',
+                                    systemMacAddress='50:08:00:a7:ca:c3',
+                                    modelName='DCS-7050TX3-48C8',
+                                    softwareVersion='4.30.1F',
+                                    streamingStatus='STREAMING_STATUS_ACTIVE')
+
+            Raises:
+                ValueError: A ValueError is raised if a field is unknown.
+        '''
+        msg = 'Inventory Resource APIs are supported from 2021.2.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.2.0+
+        if not self.cvp_version_compare('>=', 6.0, msg):
+            return
+        fields = tuple(fields)
+        unknown = set(fields) - set(INVENTORY_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown inventory fields: {sorted(unknown)}")
+        record = inventory_record(fields)
+        paths = [INVENTORY_FIELDS[field] for field in fields]
+        filters = eq_filters({
+            INVENTORY_FIELDS['serialNumber']: serial_numbers,
+            INVENTORY_FIELDS['hostname']: hostnames,
+            INVENTORY_FIELDS['modelName']: model_names,
+            INVENTORY_FIELDS['softwareVersion']: software_versions,
+            INVENTORY_FIELDS['streamingStatus']: streaming_status})
+        for result in self.resource('inventory/v1/Device').iter_all(filters):
+            value = result.get('value', {})
+            items = []
+            for path in paths:
+                item = value
+                for name in path:
+                    item = item.get(name) if isinstance(item, dict) else None
+                items.append(item)
+            yield record._make(items)
+
     def add_devices_to_inventory(self, device_list, wait=False):
         ''' Add a list of devices to the specified parent container.
 
@@ -933,7 +1779,7 @@ class CvpApi():
                 device (dict): The net element device dict for the device if
                     otherwise returns an empty hash.
         '''
-        self.log.debug(f"get_device_by_name: fqdn: {fqdn}")
+        self.log.debug("get_device_by_name: fqdn: %s", fqdn)
         # data = self.get_inventory(start=0, end=0, query=fqdn)
         data = self.search_topology(fqdn)
         device = {}
@@ -959,7 +1805,7 @@ class CvpApi():
                 device (dict): The net element device dict for the device if
                     otherwise returns an empty hash.
         '''
-        self.log.debug(f"get_device_by_mac: MAC address: {dev_mac}")
+        self.log.debug("get_device_by_mac: MAC address: %s", dev_mac)
         # data = self.get_inventory(start=0, end=0, query=dev_mac)
         data = self.search_topology(dev_mac)
         device = {}
@@ -980,7 +1826,8 @@ class CvpApi():
                 device (dict): The net element device dict for the device if
                     otherwise returns an empty hash.
         '''
-        self.log.debug(f"get_device_by_serial: Serial Number: {device_serial}")
+        self.log.debug("get_device_by_serial: Serial Number: %s",
+                       device_serial)
         data = self.search_topology(device_serial)
         device = {}
         if 'netElementList' in data:
@@ -1001,7 +1848,7 @@ class CvpApi():
                 device (dict): The net element device dict for the device if
                     otherwise returns an empty hash.
         '''
-        self.log.debug(f"get_device_configuration: dev_mac: {dev_mac}")
+        self.log.debug("get_device_configuration: dev_mac: %s", dev_mac)
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion < 4.0:
@@ -1015,6 +1862,148 @@ class CvpApi():
             running_config = data['output']
         return running_config
 
+    def get_device_configuration_by_time(self, device_id, timestamp,
+                                         config_type='RUNNING_CONFIG'):
+        ''' Returns the configuration of a device at a point in time using
+            the compliancecheck GetConfig service.
+            Supported versions: CVP 2021.1.0 or newer and CVaaS.
+
+            Args:
+                device_id (str): Serial number of the device.
+                timestamp (str): rfc3339 time, e.g.: 2021-11-19T15:04:05.0Z
+                config_type (str): Either 'RUNNING_CONFIG' or
+                    'DESIGNED_CONFIG'. Default is 'RUNNING_CONFIG'.
+
+            Returns:
+                config (str): The configuration or an empty string if no
+                    configuration was found.
+        '''
+        self.log.debug("get_device_configuration_by_time: device_id: %s"
+                       " timestamp: %s", device_id, timestamp)
+        data = {'request': {'device_id': device_id,
+                            'timestamp': timestamp,
+                            'type': config_type}}
+        resp = self.clnt.post(
+            '/api/v3/services/compliancecheck.Compliance/GetConfig',
+            data=data, timeout=self.request_timeout)
+        if isinstance(resp, dict):
+            resp = resp.get('data', [resp])
+        for entry in resp:
+            if isinstance(entry, dict) and 'config' in entry:
+                return entry['config']
+        return ''
+
+    def export_device_configurations(self, destination, devices=None,
+                                     archive=None, timestamp=None,
+                                     hash_file=None, max_workers=8):
+        ''' Fetch the running configuration of many devices concurrently and
+            write each one to a directory or archive as soon as it arrives.
+            Only the configurations being fetched are held in memory.
+
+            Args:
+                destination (str): Directory to write <fqdn>.cfg files to or
+                    the path of the archive file to create.
+                devices (iterable): Device dicts as returned by
+                    get_inventory. Default is the full inventory.
+                archive (str): None to write files to the destination
+                    directory, or one of 'tar', 'tar.gz' or 'zip' to write an
+                    archive. Default is None.
+                timestamp (str): Optional rfc3339 time. When provided the
+                    configurations at that time are fetched with the
+                    compliancecheck GetConfig service using the device
+                    serial numbers.
+                hash_file (str): Optional path of a JSON file with the SHA-256
+                    hash of every configuration from the previous run.
+                    When writing to a directory, configurations whose hash
+                    did not change are skipped.  Archives are created anew
+                    on every run so they always contain every
+                    configuration.  The file is updated with the new hashes.
+                max_workers (int): Maximum number of concurrent requests.
+                    Default is 8.
+
+            Returns:
+                response (dict): A dict that contains the number of written
+                    and unchanged configurations and the failed devices.
+
+                    Ex: {'written': 798, 'unchanged': 0,
+                         'failed': {'leaf3.example.com': 'error message'}}
+        '''
+        if archive not in (None, 'tar', 'tar.gz', 'zip'):
+            raise ValueError(f"Invalid archive format {archive}."
+                             f" Must be one of None, tar, tar.gz or zip")
+        if self.clnt.apiversion is None:
+            self.get_cvp_info()
+        if devices is None:
+            devices = self.get_inventory()
+        hashes = {}
+        if hash_file is not None and os.path.exists(hash_file):
+            with open(hash_file, encoding='utf-8') as hash_fh:
+                hashes = json.load(hash_fh)
+
+        def fetch(device):
+            if timestamp is not None:
+                return self.get_device_configuration_by_time(
+                    device['serialNumber'], timestamp)
+            return self.get_device_configuration(device['systemMacAddress'])
+
+        if archive is None:
+            os.makedirs(destination, exist_ok=True)
+            archive_fh = None
+        elif archive == 'zip':
+            archive_fh = zipfile.ZipFile(destination, 'w',
+                                         zipfile.ZIP_DEFLATED)
+        else:
+            mode = 'w:gz' if archive == 'tar.gz' else 'w'
+            archive_fh = tarfile.open(destination, mode)
+        response = {'written': 0, 'unchanged': 0, 'failed': {}}
+        try:
+            for device, config, error in self._run_concurrently(
+                    fetch, devices, max_workers):
+                name = device.get('fqdn') or device.get('hostname') or \
+                    device.get('serialNumber')
+                if error is not None:
+                    response['failed'][name] = str(error)
+                    continue
+                content = config.encode('utf-8')
+                digest = hashlib.sha256(content).hexdigest()
+                if archive_fh is None and hashes.get(name) == digest:
+                    response['unchanged'] += 1
+                    continue
+                hashes[name] = digest
+                filename = name.replace(os.sep, '_') + '.cfg'
+                self._write_export_file(destination, archive_fh, filename,
+                                        content)
+                response['written'] += 1
+        finally:
+            if archive_fh is not None:
+                archive_fh.close()
+        if hash_file is not None:
+            with open(hash_file, 'w', encoding='utf-8') as hash_fh:
+                json.dump(hashes, hash_fh)
+        return response
+
+    @staticmethod
+    def _write_export_file(destination, archive_fh, filename, content):
+        ''' Write exported content to a file in a directory or an archive.
+
+            Args:
+                destination (str): Directory to write to when archive_fh is
+                    None.
+                archive_fh (obj): An open ZipFile or TarFile or None.
+                filename (str): Name of the file.
+                content (bytes): The file content.
+        '''
+        if archive_fh is None:
+            with open(os.path.join(destination, filename), 'wb') as out_fh:
+                out_fh.write(content)
+        elif isinstance(archive_fh, zipfile.ZipFile):
+            archive_fh.writestr(filename, content)
+        else:
+            info = tarfile.TarInfo(filename)
+            info.size = len(content)
+            info.mtime = time.time()
+            archive_fh.addfile(info, BytesIO(content))
+
     def get_device_image_info(self, dev_mac):
         ''' Return a dict of info about a device in CVP.
 
@@ -1026,7 +2015,7 @@ class CvpApi():
                 device_image_info (dict): Dict of image info for the device
                     if found. Otherwise returns None.
         '''
-        self.log.debug(f"Attempt to get net element data for {dev_mac}")
+        self.log.debug("Attempt to get net element data for %s", dev_mac)
         try:
             device_image_info = self.clnt.get(
                 f"/provisioning/getNetElementInfoById.do?netElementId={qplus(dev_mac)}",
@@ -1034,7 +2023,7 @@ class CvpApi():
         except CvpApiError as error:
             # Catch error when device for provided MAC is not found
             if 'Invalid Netelement id' in str(error):
-                self.log.debug(f"Device with MAC {dev_mac} not found")
+                self.log.debug("Device with MAC %s not found", dev_mac)
                 return None
             raise error
         return device_image_info
@@ -1074,8 +2063,9 @@ class CvpApi():
                         container['parentId'] = cont['Key']
                         break
                 else:
-                    self.log.debug(f"No container parentId found for"
-                                   f" parentName {full_cont_info['parentName']}")
+                    self.log.debug("No container parentId found for"
+                                   " parentName %s",
+                                   full_cont_info['parentName'])
                     container['parentId'] = None
             else:
                 container['parentName'] = None
@@ -1096,7 +2086,7 @@ class CvpApi():
             Returns:
                 container (dict): Container info in dictionary format or None
         '''
-        self.log.debug(f"Get info for container {name}")
+        self.log.debug("Get info for container %s", name)
         conts = self.clnt.get(f"/provisioning/searchTopology.do?queryParam={qplus(name)}"
                               f"&startIndex=0&endIndex=0")
         if conts['total'] > 0 and conts['containerList']:
@@ -1114,7 +2104,7 @@ class CvpApi():
             Returns:
                 container (dict): Container info in dictionary format or None
         '''
-        self.log.debug(f"Get info for container {key}")
+        self.log.debug("Get info for container %s", key)
         return self.clnt.get(f"/provisioning/getContainerInfoById.do?"
                              f"containerId={qplus(key)}")
 
@@ -1131,7 +2121,7 @@ class CvpApi():
             Returns:
                 configlets (list): The list of configlets applied to the device
         '''
-        self.log.debug(f"get_configlets_by_device: mac: {mac}")
+        self.log.debug("get_configlets_by_device: mac: %s", mac)
         data = self.get_configlets_by_netelement_id(mac, start, end)
         return data['configletList']
 
@@ -1169,7 +2159,8 @@ class CvpApi():
         if not form:
             form = []
 
-        self.log.debug(f"add_configlet_builder: name: {name} config: {config} form: {form}")
+        self.log.debug("add_configlet_builder: name: %s config: %s form: %s",
+                       name, LogPayload(config), LogPayload(form))
         data = {'name': name,
                 'data': {'formList': form,
                          'main_script': {'data': config}}}
@@ -1192,7 +2183,8 @@ class CvpApi():
             Returns:
                 key (str): The key for the configlet
         '''
-        self.log.debug(f"add_configlet: name: {name} config: {config}")
+        self.log.debug("add_configlet: name: %s config: %s", name,
+                       LogPayload(config))
         body = {'name': name, 'config': config}
         # Create the configlet
         self.clnt.post('/configlet/addConfiglet.do', data=body,
@@ -1210,7 +2202,7 @@ class CvpApi():
                 name (str): Configlet name
                 key (str): Configlet key
         '''
-        self.log.debug(f"delete_configlet: name: {name} key: {key}")
+        self.log.debug("delete_configlet: name: %s key: %s", name, key)
         body = [{'name': name, 'key': key}]
         # Delete the configlet
         self.clnt.post('/configlet/deleteConfiglet.do', data=body,
@@ -1228,7 +2220,8 @@ class CvpApi():
             Returns:
                 data (dict): Contains success or failure message
         '''
-        self.log.debug(f"update_configlet: config: {config} key: {key} name: {name}")
+        self.log.debug("update_configlet: config: %s key: %s name: %s",
+                       LogPayload(config), key, name)
 
         # Update the configlet
         body = {'config': config, 'key': key, 'name': name,
@@ -1279,8 +2272,9 @@ class CvpApi():
                 }
             }
         }
-        self.log.debug(f"update_configlet_builder: config: {config}"
-                       f" key: {key} name: {name} form: {form}")
+        self.log.debug("update_configlet_builder: config: %s key: %s name:"
+                       " %s form: %s", LogPayload(config), key, name,
+                       LogPayload(form))
         # Update the configlet builder
         url_string = f"/configlet/updateConfigletBuilder.do?isDraft={draft}&id={key}&action=save"
         return self.clnt.post(url_string, data=data, timeout=self.request_timeout)
@@ -1300,8 +2294,9 @@ class CvpApi():
             Returns:
                 data (dict): Contains success or failure message
         '''
-        self.log.debug(f"update_reconcile_configlet: dev_mac: {dev_mac}"
-                       f" config: {config} key: {key} name: {name}")
+        self.log.debug("update_reconcile_configlet: dev_mac: %s config: %s"
+                       " key: %s name: %s", dev_mac, LogPayload(config), key,
+                       name)
 
         url_str = f"/provisioning/updateReconcileConfiglet.do?netElementId={dev_mac}"
         body = {
@@ -1338,7 +2333,8 @@ class CvpApi():
                 response (dict): A dict that contains the result of the
                     validation operation
         '''
-        self.log.debug(f"validate_config_for_device: dev_mac: {dev_mac} config: {config}")
+        self.log.debug("validate_config_for_device: dev_mac: %s config: %s",
+                       dev_mac, LogPayload(config))
         body = {'netElementId': dev_mac, 'config': config}
         return sanitize_warnings(
             self.clnt.post(
@@ -1360,23 +2356,28 @@ class CvpApi():
                 response (boolean): A flag signifying if the config is valid or
                     not.
         '''
-        self.log.debug(f"validate_config: dev_mac: {dev_mac} config: {config}")
+        self.log.debug("validate_config: dev_mac: %s config: %s", dev_mac,
+                       LogPayload(config))
         result = self.validate_config_for_device(dev_mac, config)
         validated = True
         if 'warningCount' in result and result['warnings']:
             for warning in result['warnings']:
-                self.log.warning(f"Validation of config produced warning - {warning}")
+                self.log.warning("Validation of config produced warning - %s",
+                                 warning)
         if 'errorCount' in result:
-            self.log.error(f"Validation of config produced {result['errorCount']} errors")
+            self.log.error("Validation of config produced %s errors",
+                           result['errorCount'])
             if 'errors' in result:
                 for error in result['errors']:
-                    self.log.error(f"Validation of config produced error - {error}")
+                    self.log.error("Validation of config produced error - %s",
+                                   error)
             validated = False
         if 'result' in result:
             for item in result['result']:
                 if 'messages' in item:
                     for message in item['messages']:
-                        self.log.info(f"Validation of config returned message - {message}")
+                        self.log.info("Validation of config returned message"
+                                      " - %s", message)
         return validated
 
     def get_all_temp_actions(self, start=0, end=0):
@@ -1398,6 +2399,22 @@ class CvpApi():
 
     def _add_temp_action(self, data):
         ''' Adds temp action that requires a saveTopology call to take effect.
+            If a topology batch is active the actions are added to the batch
+            and posted when the batch is committed.
+
+            Args:
+                data (dict): a data dict with a specific format for the
+                    desired action.
+
+                    Base Ex: data = {'data': [{specific key/value pairs}]}
+        '''
+        if self._topology_batch is not None:
+            self._topology_batch.add(data['data'])
+            return
+        self._post_temp_action(data)
+
+    def _post_temp_action(self, data):
+        ''' Post temp actions to CVP with the addTempAction API.
 
             Args:
                 data (dict): a data dict with a specific format for the
@@ -1423,10 +2440,70 @@ class CvpApi():
                     task ids created (if any).
 
                     Ex: {u'data': {u'status': u'success', u'taskIds': []}}
+
+                    Returns None if a topology batch is active. The save
+                    happens when the batch is committed.
         '''
+        if self._topology_batch is not None:
+            self.log.debug('_save_topology_v2: deferred to topology batch')
+            self._topology_batch.save_data.extend(data)
+            return None
         url = '/provisioning/v2/saveTopology.do'
         return self.clnt.post(url, data=data, timeout=self.request_timeout)
 
+    @contextmanager
+    def topology_batch(self, chunk_size=500):
+        ''' Context manager that batches topology temp actions into a few
+            addTempAction requests followed by a single saveTopology.
+
+            Every topology method called inside the block (for example
+            apply_configlets_to_device, remove_configlets_from_device,
+            apply_configlets_to_container, move_device_to_container,
+            apply_image_to_element or reset_device) only builds its temp
+            action.  The methods return None instead of the saveTopology
+            response.  When the block exits without an exception the actions
+            are posted and the topology is saved once.  If the block raises
+            an exception nothing is sent to CVP.
+
+            Methods that read back state created by their own temp actions
+            (delete_container) must not be used inside a batch.  Each
+            method reads the currently applied configlets from CVP, so make
+            at most one configlet change per device or container per batch.
+            Nested calls join the outer batch.
+
+            Args:
+                chunk_size (int): Maximum number of temp actions to send in
+                    a single addTempAction request. Default is 500.
+
+            Yields:
+                batch (TopologyBatch): The batch.  After the block exits the
+                    saveTopology response is available in batch.response and
+                    the created task IDs in batch.task_ids.
+
+            Example:
+
+                >>> with clnt.api.topology_batch() as batch:
+                ...     for dev in devices:
+                ...         clnt.api.apply_configlets_to_device(
+                ...             'app', dev, new_configlets)
+                >>> batch.task_ids
+                ['32', '33', ...]
+        '''
+        if self._topology_batch is not None:
+            yield self._topology_batch
+            return
+        batch = TopologyBatch(self, chunk_size)
+        self._topology_batch = batch
+        try:
+            yield batch
+        except BaseException:
+            self._topology_batch = None
+            self.log.debug('topology_batch: discarding %d temp actions',
+                           len(batch))
+            raise
+        self._topology_batch = None
+        batch.commit()
+
     def apply_configlets_to_device(self, app_name, dev, new_configlets, # pylint: disable=too-many-locals
                                    create_task=True, reorder_configlets=False, validate=False):
         ''' Apply the configlets to the device.
@@ -1462,7 +2539,8 @@ class CvpApi():
 
                     Ex: {u'data': {u'status': u'success', u'taskIds': [u'32']}}
         '''
-        self.log.debug(f"apply_configlets_to_device: dev: {dev} names: {new_configlets}")
+        self.log.debug("apply_configlets_to_device: dev: %s names: %s",
+                       LogPayload(dev), LogPayload(new_configlets))
         # Get a list of the names and keys of the configlets
         cnames = []
         ckeys = []
@@ -1518,7 +2596,8 @@ class CvpApi():
                     }
                 }
             )
-        self.log.debug(f"apply_configlets_to_device: saveTopology data:\n{data['data']}")
+        self.log.debug("apply_configlets_to_device: saveTopology data:\n%s",
+                       LogPayload(data['data']))
         self._add_temp_action(data)
         if create_task:
             return self._save_topology_v2([])
@@ -1548,7 +2627,8 @@ class CvpApi():
 
                     Ex: {u'data': {u'status': u'success', u'taskIds': [u'35']}}
         '''
-        self.log.debug(f"remove_configlets_from_device: dev: {dev} names: {del_configlets}")
+        self.log.debug("remove_configlets_from_device: dev: %s names: %s",
+                       LogPayload(dev), LogPayload(del_configlets))
 
         # Get all the configlets assigned to the device.
         configlets = self.get_configlets_by_device_id(dev['systemMacAddress'])
@@ -1610,7 +2690,8 @@ class CvpApi():
                     }
                 }
             )
-        self.log.debug(f"remove_configlets_from_device: saveTopology data:\n{data['data']}")
+        self.log.debug("remove_configlets_from_device: saveTopology data:\n%s",
+                       LogPayload(data['data']))
         self._add_temp_action(data)
         if create_task:
             return self._save_topology_v2([])
@@ -1633,8 +2714,8 @@ class CvpApi():
 
                     Ex: {u'data': {u'status': u'success', u'taskIds': [u'32']}}
         '''
-        self.log.debug(f"apply_configlets_to_container: container: {container}"
-                       f" names: {new_configlets}")
+        self.log.debug("apply_configlets_to_container: container: %s names:"
+                       " %s", container, LogPayload(new_configlets))
         # Get all the configlets assigned to the device.
         configlets = self.get_configlets_by_container_id(container['key'])
 
@@ -1686,7 +2767,8 @@ class CvpApi():
                           'nodeTargetIpAddress': '',
                           'childTasks': [],
                           'parentTask': ''}]}
-        self.log.debug(f"apply_configlets_to_container: saveTopology data:\n{data['data']}")
+        self.log.debug("apply_configlets_to_container: saveTopology data:\n%s",
+                       LogPayload(data['data']))
         self._add_temp_action(data)
         if create_task:
             return self._save_topology_v2([])
@@ -1711,8 +2793,8 @@ class CvpApi():
 
                     Ex: {u'data': {u'status': u'success', u'taskIds': [u'35']}}
         '''
-        self.log.debug(f"remove_configlets_from_container: container: {container}"
-                       f" names: {del_configlets}")
+        self.log.debug("remove_configlets_from_container: container: %s"
+                       " names: %s", container, LogPayload(del_configlets))
 
         # Get all the configlets assigned to the device.
         configlets = self.get_configlets_by_container_id(container['key'])
@@ -1763,7 +2845,8 @@ class CvpApi():
                           'nodeTargetIpAddress': '',
                           'childTasks': [],
                           'parentTask': ''}]}
-        self.log.debug(f"remove_configlets_from_container: saveTopology data:\n{data['data']}")
+        self.log.debug("remove_configlets_from_container: saveTopology"
+                       " data:\n%s", LogPayload(data['data']))
         self._add_temp_action(data)
         if create_task:
             return self._save_topology_v2([])
@@ -1796,8 +2879,9 @@ class CvpApi():
                                      "configletId": "string"}, ...]
                         }
         '''
-        self.log.debug(f"validate_configlets_for_device: "
-                       f"MAC: {mac} - conf keys: {configlet_keys} - page_type: {page_type}")
+        self.log.debug("validate_configlets_for_device: MAC: %s - conf keys:"
+                       " %s - page_type: %s", mac, LogPayload(configlet_keys),
+                       page_type)
         data = {'configIdList': configlet_keys,
                 'netElementId': mac,
                 'pageType': page_type}
@@ -1805,6 +2889,131 @@ class CvpApi():
             '/provisioning/v2/validateAndCompareConfiglets.do',
             data=data, timeout=self.request_timeout)
 
+    def validate_configlets_for_devices(self, device_configlets,
+                                        report_file=None,
+                                        page_type='viewConfig',
+                                        max_workers=8):
+        ''' Validate and compare configlets for many devices concurrently and
+            aggregate the results into a compact report.
+
+            Args:
+                device_configlets (dict or iterable): Either a dict of device
+                    MAC address to list of configlet keys or an iterable of
+                    (MAC address, configlet keys) pairs.  A generator can be
+                    used for large fleets.
+                report_file (str): Optional path of a file to stream the per
+                    device results to as they arrive.  Each line is a JSON
+                    object with the device summary including its errors and
+                    sanitized warnings.  When provided the per device
+                    summaries are not kept in the returned report so memory
+                    use does not grow with the number of devices.
+                page_type (str): The pageType passed to
+                    validate_configlets_for_device.  Default is 'viewConfig'.
+                max_workers (int): Maximum number of concurrent validation
+                    requests.  Default is 8.
+
+            Returns:
+                report (dict): A dict that contains the aggregated results.
+
+                    Ex: {'total': 2,
+                         'failed': 0,
+                         'counts': {'mismatch': 3, 'reconcile': 0, 'new': 1,
+                                    'errors': 1, 'warnings': 2},
+                         'errors': {'configlet_1': {
+                                        '6': {'error': '% Invalid input',
+                                              'count': 1}}},
+                         'failures': {},
+                         'devices': {'50:08:00:a7:ca:c3': {
+                                        'mismatch': 3, 'reconcile': 0,
+                                        'new': 1, 'total': 60,
+                                        'errorCount': 1, 'warningCount': 2,
+                                        'errors': [...], 'warnings': [...]},
+                                     ...}}
+
+                    'failures' maps MAC addresses to the error raised by
+                    requests that failed.  'devices' is only present when
+                    report_file is not provided.
+        '''
+        if isinstance(device_configlets, dict):
+            device_configlets = device_configlets.items()
+        report = {'total': 0,
+                  'failed': 0,
+                  'counts': {'mismatch': 0, 'reconcile': 0, 'new': 0,
+                             'errors': 0, 'warnings': 0},
+                  'errors': {},
+                  'failures': {}}
+        if report_file is None:
+            report['devices'] = {}
+
+        def validate(pair):
+            mac, configlet_keys = pair
+            return self.validate_configlets_for_device(mac, configlet_keys,
+                                                       page_type=page_type)
+
+        with ExitStack() as stack:
+            report_fh = None
+            if report_file is not None:
+                report_fh = stack.enter_context(
+                    open(report_file, 'w', encoding='utf-8'))
+            for pair, result, error in self._run_concurrently(
+                    validate, device_configlets, max_workers):
+                mac = pair[0]
+                report['total'] += 1
+                if error is not None:
+                    report['failed'] += 1
+                    report['failures'][mac] = str(error)
+                    summary = {'device': mac, 'failure': str(error)}
+                else:
+                    summary = self._summarize_validation(mac, result, report)
+                if report_fh is not None:
+                    report_fh.write(json.dumps(summary) + '\n')
+                elif error is None:
+                    report['devices'][mac] = summary
+        return report
+
+    @staticmethod
+    def _summarize_validation(mac, result, report):
+        ''' Reduce a validateAndCompareConfiglets response to its counts,
+            errors and sanitized warnings and add them to the report totals.
+
+            Args:
+                mac (str): MAC address of the validated device.
+                result (dict): The validate_configlets_for_device response.
+                report (dict): The aggregated report to update.
+
+            Returns:
+                summary (dict): The per device summary.
+        '''
+        result = sanitize_warnings(result)
+        errors = result.get('errors') or []
+        warnings = [warning for warning in result.get('warnings') or []
+                    if warning]
+        summary = {'device': mac,
+                   'mismatch': result.get('mismatch', 0),
+                   'reconcile': result.get('reconcile', 0),
+                   'new': result.get('new', 0),
+                   'total': result.get('total', 0),
+                   'errorCount': len(errors),
+                   'warningCount': len(warnings),
+                   'errors': errors,
+                   'warnings': warnings}
+        counts = report['counts']
+        for key in ('mismatch', 'reconcile', 'new'):
+            counts[key] += summary[key]
+        counts['errors'] += len(errors)
+        counts['warnings'] += len(warnings)
+        for error in errors:
+            if not isinstance(error, dict):
+                error = {'error': str(error)}
+            configlet_errors = report['errors'].setdefault(
+                error.get('configletId', ''), {})
+            line = str(error.get('configletLineNo',
+                                 error.get('lineNo', ''))).strip()
+            entry = configlet_errors.setdefault(
+                line, {'error': error.get('error', ''), 'count': 0})
+            entry['count'] += 1
+        return summary
+
     def get_applied_devices(self, configlet_name, start=0, end=0):
         ''' Returns a list of devices to which the named configlet is applied.
 
@@ -1889,8 +3098,8 @@ class CvpApi():
 
                     Ex: {u'data': {u'status': u'success', u'taskIds': []}}
         '''
-        self.log.debug(f"add_container: container: {container_name}"
-                       f" parent: {parent_name} parent_key: {parent_key}")
+        self.log.debug("add_container: container: %s parent: %s parent_key:"
+                       " %s", container_name, parent_name, parent_key)
         return self._container_op(container_name, 'new_container', parent_name,
                                   parent_key, 'add')
 
@@ -1910,9 +3119,9 @@ class CvpApi():
 
                     Ex: {u'data': {u'status': u'success', u'taskIds': []}}
         '''
-        self.log.debug(f"delete_container: container: {container_name}"
-                       f" container_key: {container_key} parent: {parent_name}"
-                       f" parent_key: {parent_key}")
+        self.log.debug("delete_container: container: %s container_key: %s"
+                       " parent: %s parent_key: %s", container_name,
+                       container_key, parent_name, parent_key)
         resp = self._container_op(container_name, container_key, parent_name,
                                   parent_key, 'delete')
         # As of CVP version 2020.1 the addTempAction.do API endpoint stopped
@@ -1939,7 +3148,8 @@ class CvpApi():
             Returns:
                 response (dict): A dict that contains the parent container info
         '''
-        self.log.debug(f"get_parent_container_for_device: called for {dev_mac}")
+        self.log.debug("get_parent_container_for_device: called for %s",
+                       dev_mac)
         data = self.clnt.get(f"/provisioning/searchTopology.do?"
                              f"queryParam={dev_mac}&startIndex=0&endIndex=0",
                              timeout=self.request_timeout)
@@ -1966,8 +3176,8 @@ class CvpApi():
                     Ex: {u'data': {u'status': u'success', u'taskIds': []}}
         '''
         info = f"Device Add {device['fqdn']} to container {container['name']} by {app_name}"
-        self.log.debug(f"Attempting to move device {device['fqdn']} to"
-                       f" container {container['name']}")
+        self.log.debug("Attempting to move device %s to container %s",
+                       device['fqdn'], container['name'])
         if 'parentContainerId' in device:
             from_id = device['parentContainerId']
         else:
@@ -1990,12 +3200,13 @@ class CvpApi():
         # pylint: disable=invalid-name
         except CvpApiError as e:
             if 'Data already exists' in str(e):
-                self.log.debug(f"Device {device['fqdn']} already in container {container}")
+                self.log.debug("Device %s already in container %s",
+                               device['fqdn'], container)
         if create_task:
             return self._save_topology_v2([])
         return None
 
-    def search_topology(self, query, start=0, end=0):
+    def search_topology(self, query, start=0, end=0, as_records=False):
         ''' Search the topology for items matching the query parameter.
 
             Args:
@@ -2004,12 +3215,15 @@ class CvpApi():
                 start (int): Start index for the pagination.  Default is 0.
                 end (int): End index for the pagination.  If end index is 0
                     then all the records will be returned.  Default is 0.
+                as_records (bool): Return the netElementList entries as
+                    DeviceRecord objects instead of dicts. Default is False.
 
             Returns:
                 response (dict): A dict that contains the container and
                     netelement lists.
         '''
-        self.log.debug(f"search_topology: query: {query} start: {start} end: {end}")
+        self.log.debug("search_topology: query: %s start: %s end: %s", query,
+                       start, end)
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion <= 6.0:
@@ -2038,6 +3252,11 @@ class CvpApi():
                 device['bootupTimestamp'] = device.get('bootupTimeStamp', '')
                 # Key internalBuildId for V3 search topology is no longer in return data.
                 device['internalBuild'] = device.get('internalBuildId', '')
+            if as_records:
+                # Records with exactly the keys of the dicts above
+                data['netElementList'] = [
+                    DeviceRecord.from_dict(device, exact=True)
+                    for device in data['netElementList']]
         return data
 
     def filter_topology(self, node_id='root', fmt='topology',
@@ -2057,6 +3276,25 @@ class CvpApi():
                f"format={fmt}&startIndex={start}&endIndex={end}")
         return self.clnt.get(url, timeout=self.request_timeout)
 
+    def topology_graph(self, images=True, max_workers=8):
+        ''' Build a TopologyGraph of the containers and devices with their
+            configlet and image bundle mappings. Ancestor paths, subtree
+            membership, effective configlets and effective image bundles
+            are then resolved locally.
+
+            Args:
+                images (bool): Fetch the image bundles applied to the
+                    containers and devices, one request per container and
+                    per image bundle run concurrently. Default is True.
+                max_workers (int): Maximum number of concurrent image bundle
+                    requests. Default is 8.
+
+            Returns:
+                graph (obj): A cvprac.cvp_topology.TopologyGraph.
+                    Ex: graph.effective_configlets(mac, names=True)
+        '''
+        return TopologyGraph.from_api(self, images, max_workers)
+
     def check_compliance(self, node_key, node_type):
         ''' Check that a device is in compliance, that is the configlets
             applied to the device match the devices running configuration.
@@ -2071,7 +3309,8 @@ class CvpApi():
                 response (dict): A dict that contains the results of the
                     compliance check.
         '''
-        self.log.debug(f"check_compliance: node_key: {node_key} node_type: {node_type}")
+        self.log.debug("check_compliance: node_key: %s node_type: %s",
+                       node_key, node_type)
         data = {'nodeId': node_key, 'nodeType': node_type}
         resp = self.clnt.post('/provisioning/checkCompliance.do', data=data,
                               timeout=self.request_timeout)
@@ -2082,6 +3321,113 @@ class CvpApi():
                 resp['complianceIndication'] = 'NONE'
         return resp
 
+    def get_container_compliance(self, container_name='Tenant',
+                                 page_size=500):
+        ''' Yield the devices of a container subtree with their decoded
+            compliance using paged bulk requests.
+
+            Args:
+                container_name (str): Name of the container. Default is
+                    'Tenant' for the whole inventory.
+                page_size (int): Number of devices per request.
+                    Default is 500.
+
+            Yields:
+                device (dict): The net element dict with the
+                    decode_compliance_code result under the 'compliance'
+                    key.
+        '''
+        if container_name == 'Tenant':
+            container_key = 'root'
+        else:
+            container = self.get_container_by_name(container_name)
+            if container is None:
+                raise CvpApiError(f"Container {container_name} not found")
+            container_key = container['key']
+        start = 0
+        while True:
+            self.log.debug("get_container_compliance: %s start: %s",
+                           container_name, start)
+            resp = self.clnt.get(
+                f"/ztp/getAllNetElementList.do?nodeId={container_key}"
+                f"&queryParam=&nodeName={qplus(container_name)}"
+                f"&startIndex={start}&endIndex={start + page_size}"
+                f"&contextQueryParam=&ignoreAdd=false&useCache=true",
+                timeout=self.request_timeout)
+            devices = resp.get('netElementList', [])
+            for device in devices:
+                device['compliance'] = decode_compliance_code(
+                    device.get('complianceCode'))
+                yield device
+            start += len(devices)
+            if len(devices) < page_size or \
+                    ('total' in resp and start >= resp['total']):
+                return
+
+    def compliance_sweep(self, container_name='Tenant', page_size=500,
+                         recheck=False, max_workers=8):
+        ''' Report the compliance of every device in a container subtree
+            from a few paged bulk requests. Optionally run check_compliance
+            concurrently for the devices that are out of sync only and
+            report their refreshed state.
+
+            Args:
+                container_name (str): Name of the container. Default is
+                    'Tenant' for the whole inventory.
+                page_size (int): Number of devices per request.
+                    Default is 500.
+                recheck (bool or callable): If True run check_compliance for
+                    every device with a config, image, extensions or device
+                    time flag set. A callable is called with the decoded
+                    compliance dict and returns True to recheck the device.
+                    Default is False.
+                max_workers (int): Maximum number of concurrent
+                    check_compliance requests. Default is 8.
+
+            Returns:
+                response (dict): A dict with the devices keyed by system MAC
+                    address with their 'fqdn', 'serialNumber' and
+                    'compliance', the 'summary' counts of 'total', 'in_sync'
+                    and of every flag, the number of devices 'rechecked' and
+                    the error message of every failed recheck under
+                    'recheck_failed'.
+        '''
+        def out_of_sync(compliance):
+            return any(compliance[flag] for flag in
+                       ('config', 'image', 'extensions', 'device_time'))
+        needs_recheck = None
+        if callable(recheck):
+            needs_recheck = recheck
+        elif recheck:
+            needs_recheck = out_of_sync
+        devices = {}
+        stale = []
+        for device in self.get_container_compliance(container_name,
+                                                    page_size):
+            key = device.get('systemMacAddress') or device.get('key')
+            devices[key] = {'fqdn': device.get('fqdn'),
+                            'serialNumber': device.get('serialNumber'),
+                            'compliance': device['compliance']}
+            if needs_recheck and needs_recheck(device['compliance']):
+                stale.append(key)
+        response = {'devices': devices, 'rechecked': len(stale),
+                    'recheck_failed': {}}
+        for key, resp, error in self._run_concurrently(
+                lambda key: self.check_compliance(key, 'netelement'), stale,
+                max_workers):
+            if error is not None:
+                response['recheck_failed'][key] = str(error)
+            elif resp and resp.get('complianceCode'):
+                devices[key]['compliance'] = decode_compliance_code(
+                    resp['complianceCode'])
+        summary = dict.fromkeys(('total', 'in_sync') + COMPLIANCE_FLAGS, 0)
+        for device in devices.values():
+            summary['total'] += 1
+            for flag in ('in_sync',) + COMPLIANCE_FLAGS:
+                summary[flag] += device['compliance'][flag]
+        response['summary'] = summary
+        return response
+
     def get_event_by_id(self, e_id):
         ''' Return information on the requested event ID.
 
@@ -2091,6 +3437,163 @@ class CvpApi():
         return self.clnt.get(f"/event/getEventById.do?eventId={e_id}",
                              timeout=self.request_timeout)
 
+    def get_events(self, start=None, end=None, severity=None,
+                   event_type=None):
+        ''' Get events with a single request using Resource APIs. The
+            severity and event type filters are applied by the server.
+            Supported versions: CVP 2021.2.0 or newer and CVaaS.
+
+            Args:
+                start (datetime|str): Start of the time range as a datetime
+                    (naive datetimes are UTC) or an RFC3339 timestamp.
+                    Default is None for the current events only.
+                end (datetime|str): End of the time range. Default is None.
+                severity (str|list): One or more severities to match,
+                    e.g.: 'EVENT_SEVERITY_CRITICAL'. Default is None.
+                event_type (str|list): One or more event types to match,
+                    e.g.: 'DEVICE_INTF_ERR_SMART'. Default is None.
+
+            Returns:
+                events (list): The event values.
+                Ex: [{'key': {'key': '6098ae39e4c8a9d7',
+                              'timestamp': '2021-12-14T21:02:21.830306071Z'},
+                      'severity': 'EVENT_SEVERITY_ERROR', ...}]
+        '''
+        msg = 'Event Resource APIs are supported from 2021.2.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.2.0+
+        if not self.cvp_version_compare('>=', 6.0, msg):
+            return None
+        filters = eq_filters({'severity': severity, 'eventType': event_type})
+        results = self.resource('event/v1/Event').get_all(filters, start, end)
+        return [result.get('value', {}) for result in results]
+
+    def iter_events(self, start, end, severity=None, event_type=None,
+                    windows=8, target_events=5000, min_window=1,
+                    max_workers=8):
+        ''' Yield the events of a time range in time order while fetching
+            sub-windows of the range concurrently using Resource APIs.
+
+            The range is split into windows sub-windows that are fetched
+            with get_events. Events are yielded as soon as every earlier
+            sub-window has been received, so only the sub-windows that
+            completed out of order are buffered. A sub-window whose request
+            times out is split in half and fetched again. Once a sub-window
+            has been received, sub-windows that have not started yet and
+            are expected to hold more than target_events events at the
+            observed event rate are split further.
+            Supported versions: CVP 2021.2.0 or newer and CVaaS.
+
+            Args:
+                start (datetime|str): Start of the time range as a datetime
+                    (naive datetimes are UTC) or an RFC3339 timestamp.
+                end (datetime|str): End of the time range.
+                severity (str|list): See get_events. Default is None.
+                event_type (str|list): See get_events. Default is None.
+                windows (int): Initial number of sub-windows. Default is 8.
+                target_events (int): Expected maximum number of events per
+                    sub-window. Default is 5000.
+                min_window (int): Minimum sub-window length in seconds.
+                    A timeout on a sub-window that cannot be split further
+                    is raised. Default is 1.
+                max_workers (int): Maximum number of concurrent requests.
+                    Default is 8.
+
+            Yields:
+                event (dict): The event values ordered by key.timestamp.
+
+            Ex: for event in clnt.api.iter_events(
+                        datetime.utcnow() - timedelta(days=7),
+                        datetime.utcnow(),
+                        severity='EVENT_SEVERITY_CRITICAL'):
+                    print(event['key']['timestamp'], event['title'])
+        '''
+        msg = 'Event Resource APIs are supported from 2021.2.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.2.0+
+        if not self.cvp_version_compare('>=', 6.0, msg):
+            return
+        if windows < 1:
+            raise ValueError('windows must be a positive integer')
+        if isinstance(start, str):
+            start = _parse_utc_time(start)
+        if isinstance(end, str):
+            end = _parse_utc_time(end)
+        if start.tzinfo is not None:
+            start = start.astimezone(dt_timezone.utc).replace(tzinfo=None)
+        if end.tzinfo is not None:
+            end = end.astimezone(dt_timezone.utc).replace(tzinfo=None)
+        min_width = timedelta(seconds=min_window)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {}
+        slots = []
+
+        def submit(w_start, w_end):
+            slot = {'start': w_start, 'end': w_end, 'events': None,
+                    'future': None}
+            slot['future'] = executor.submit(
+                self.get_events, w_start, w_end, severity, event_type)
+            futures[slot['future']] = slot
+            return slot
+
+        def split_window(slot, parts):
+            width = slot['end'] - slot['start']
+            bounds = [slot['start'] + width * idx / parts
+                      for idx in range(parts)] + [slot['end']]
+            index = next(idx for idx, item in enumerate(slots)
+                         if item is slot)
+            slots[index:index + 1] = [submit(bounds[idx], bounds[idx + 1])
+                                      for idx in range(parts)]
+
+        width = (end - start) / windows
+        for idx in range(windows):
+            slots.append(submit(start + width * idx,
+                                end if idx == windows - 1
+                                else start + width * (idx + 1)))
+        try:
+            while slots:
+                while slots and slots[0]['events'] is not None:
+                    yield from slots.pop(0)['events']
+                if not slots:
+                    break
+                done, _ = wait_futures(list(futures),
+                                       return_when=FIRST_COMPLETED)
+                for future in done:
+                    slot = futures.pop(future)
+                    try:
+                        events = future.result()
+                    except Timeout:
+                        if (slot['end'] - slot['start']) / 2 < min_width:
+                            raise
+                        self.log.debug("iter_events: %s - %s timed out,"
+                                       " splitting", slot['start'],
+                                       slot['end'])
+                        split_window(slot, 2)
+                        continue
+                    # Time bounds are inclusive so an event on the boundary
+                    # of two sub-windows is only kept in the later one.
+                    end_key = rfc3339_key(format_utc_time(slot['end']))
+                    slot['events'] = sorted(
+                        (event for event in events
+                         if slot['end'] == end or rfc3339_key(
+                             event['key']['timestamp']) < end_key),
+                        key=lambda event: rfc3339_key(
+                            event['key']['timestamp']))
+                    seconds = (slot['end'] - slot['start']).total_seconds()
+                    if not seconds:
+                        continue
+                    rate = len(events) / seconds
+                    for queued in list(futures.values()):
+                        q_width = queued['end'] - queued['start']
+                        parts = min(int(rate * q_width.total_seconds() //
+                                        target_events) + 1,
+                                    int(q_width / min_width))
+                        if parts > 1 and queued['future'].cancel():
+                            del futures[queued['future']]
+                            split_window(queued, parts)
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
     def get_default_snapshot_template(self):
         ''' Return the default snapshot template.
 
@@ -2206,18 +3709,38 @@ class CvpApi():
                 image bundle (dict): Dict of info specific to the image bundle
                     requested or None if the name requested doesn't exist.
         '''
-        self.log.debug(f"Attempt to get image bundle {name}")
+        self.log.debug("Attempt to get image bundle %s", name)
         try:
             image = self.clnt.get(f"/image/getImageBundleByName.do?name={qplus(name)}",
                                   timeout=self.request_timeout)
         except CvpApiError as error:
             # Catch an invalid task_id error and return None
             if 'Entity does not exist' in str(error):
-                self.log.debug(f"Bundle with name {name} does not exist")
+                self.log.debug("Bundle with name %s does not exist", name)
                 return None
             raise error
         return image
 
+    def get_image_bundle_applied_devices(self, bundle_id, start=0, end=0):
+        ''' Return the devices an image bundle is applied to.
+
+            Args:
+                bundle_id (str): The key of the image bundle.
+                start (int): Start index for the pagination.  Default is 0.
+                end (int): End index for the pagination.  If end index is 0
+                    then all the records will be returned.  Default is 0.
+
+            Returns:
+                devices (dict): The 'total' key contains the number of
+                    devices, the 'data' key contains a list of devices and
+                    their info.
+        '''
+        self.log.debug("Get devices image bundle %s is applied to", bundle_id)
+        return self.clnt.get(f"/image/v2/getImageBundleAppliedDevices.do?"
+                             f"imageBundleId={qplus(bundle_id)}&queryparam=&"
+                             f"startIndex={start}&endIndex={end}",
+                             timeout=self.request_timeout)
+
     def delete_image_bundle(self, image_key, image_name):
         ''' Delete image bundle
 
@@ -2321,22 +3844,23 @@ class CvpApi():
 
                     Ex: {u'data': {u'status': u'success', u'taskIds': [u'32']}}
         '''
-        self.log.debug(f"Attempt to apply {image['name']} to {id_type} {name}")
+        self.log.debug("Attempt to apply %s to %s %s", image['name'], id_type,
+                       name)
         info = f"Apply image: {image['name']} to {id_type} {name}"
         node_id = ''
         if 'imageBundleKeys' in image:
             if image['imageBundleKeys']:
                 node_id = image['imageBundleKeys'][0]
-            self.log.info(f"Provided image is an image object."
-                          f" Using first value from imageBundleKeys - {node_id}")
+            self.log.info("Provided image is an image object. Using first"
+                          " value from imageBundleKeys - %s", node_id)
         if 'id' in image:
             node_id = image['id']
-            self.log.info(f"Provided image is an image bundle object."
-                          f" Found v1 API id field - {node_id}")
+            self.log.info("Provided image is an image bundle object. Found"
+                          " v1 API id field - %s", node_id)
         elif 'key' in image:
             node_id = image['key']
-            self.log.info(f"Provided image is an image bundle object."
-                          f" Found v2 API key field - {node_id}")
+            self.log.info("Provided image is an image bundle object. Found"
+                          " v2 API key field - %s", node_id)
         data = {'data': [{'info': info,
                           'infoPreview': info,
                           'note': '',
@@ -2403,22 +3927,22 @@ class CvpApi():
 
                     Ex: {u'data': {u'status': u'success', u'taskIds': [u'32']}}
         '''
-        self.log.debug(f"Attempt to remove {image['name']} from {name}")
+        self.log.debug("Attempt to remove %s from %s", image['name'], name)
         info = f"Remove image: {image['name']} from {name}"
         node_id = ''
         if 'imageBundleKeys' in image:
             if image['imageBundleKeys']:
                 node_id = image['imageBundleKeys'][0]
-            self.log.info(f"Provided image is an image object."
-                          f" Using first value from imageBundleKeys - {node_id}")
+            self.log.info("Provided image is an image object. Using first"
+                          " value from imageBundleKeys - %s", node_id)
         if 'id' in image:
             node_id = image['id']
-            self.log.info(f"Provided image is an image bundle object."
-                          f" Found v1 API id field - {node_id}")
+            self.log.info("Provided image is an image bundle object. Found"
+                          " v1 API id field - %s", node_id)
         elif 'key' in image:
             node_id = image['key']
-            self.log.info(f"Provided image is an image bundle object."
-                          f" Found v2 API key field - {node_id}")
+            self.log.info("Provided image is an image bundle object. Found"
+                          " v2 API key field - %s", node_id)
         data = {'data': [{'info': info,
                           'infoPreview': info,
                           'note': '',
@@ -2450,7 +3974,7 @@ class CvpApi():
             Returns:
                 change controls (list): The list of change controls
         '''
-        self.log.debug(f"get_change_controls: query: {query}")
+        self.log.debug("get_change_controls: query: %s", query)
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion >= 3.0:
@@ -2480,7 +4004,7 @@ class CvpApi():
             Returns:
                 tasks (list): The list of available tasks
         '''
-        self.log.debug(f"change_control_available_tasks: query: {query}")
+        self.log.debug("change_control_available_tasks: query: %s", query)
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion >= 3.0:
@@ -2600,8 +4124,9 @@ class CvpApi():
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion < 3.0:
-            self.log.debug(f"Wrong method for API version {self.clnt.apiversion}."
-                           f" Use create_change_control method")
+            self.log.debug("Wrong method for API version %s. Use"
+                           " create_change_control method",
+                           self.clnt.apiversion)
             self.log.warning('create_change_control_v3:'
                              ' Use old change control APIs for old versions')
             return None
@@ -2659,7 +4184,8 @@ class CvpApi():
 
                 Ex: {"data": "success"}
         '''
-        self.log.debug(f"add_notes_to_change_control: cc_id {cc_id}, notes {notes}")
+        self.log.debug("add_notes_to_change_control: cc_id %s, notes %s",
+                       cc_id, notes)
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion >= 3.0:
@@ -2714,8 +4240,9 @@ class CvpApi():
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion < 3.0:
-            self.log.debug(f"Approval methods not valid for API version {self.clnt.apiversion}."
-                           f" Functionality did not exist")
+            self.log.debug("Approval methods not valid for API version %s."
+                           " Functionality did not exist",
+                           self.clnt.apiversion)
             return None
 
         self.log.debug('v3 Approve change control API Call')
@@ -2734,8 +4261,9 @@ class CvpApi():
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion < 3.0:
-            self.log.debug(f"Approval methods not valid for API version {self.clnt.apiversion}."
-                           f" Functionality did not exist")
+            self.log.debug("Approval methods not valid for API version %s."
+                           " Functionality did not exist",
+                           self.clnt.apiversion)
             return None
 
         self.log.debug('v3 Delete Approval for change control API Call')
@@ -2848,7 +4376,7 @@ class CvpApi():
                      'timeZone': '',
                      'type': 'Custom'}
         '''
-        self.log.debug(f"get_change_control_info: {cc_id}")
+        self.log.debug("get_change_control_info: %s", cc_id)
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion >= 3.0:
@@ -2892,13 +4420,14 @@ class CvpApi():
                                          },
                               u'state': u'Completed'}}]
         '''
-        self.log.debug(f"get_change_control_status: {cc_id}")
+        self.log.debug("get_change_control_status: %s", cc_id)
         if self.clnt.apiversion is None:
             self.get_cvp_info()
         if self.clnt.apiversion < 3.0:
-            self.log.debug(f"get_change_control_status method not supported"
-                           f" for API version {self.clnt.apiversion}. Use old"
-                           f" get_change_control_info method")
+            self.log.debug("get_change_control_status method not supported"
+                           " for API version %s. Use old"
+                           " get_change_control_info method",
+                           self.clnt.apiversion)
             return None
 
         self.log.debug(
@@ -2951,7 +4480,8 @@ class CvpApi():
             self._add_temp_action(data)
         except CvpApiError as error:
             if 'Data already exists' in str(error):
-                self.log.debug(f"Device {device['fqdn']} already in container Undefined")
+                self.log.debug("Device %s already in container Undefined",
+                               device['fqdn'])
         if create_task:
             return self._save_topology_v2([])
         return None
@@ -2985,7 +4515,9 @@ class CvpApi():
                                       create_task=False)
 
         # Get proposed configlets device will inherit from container it is
-        # being moved to.
+        # being moved to. The move must be posted to CVP first when batching.
+        if self._topology_batch is not None:
+            self._topology_batch.flush()
         prop_conf = self.clnt.get(f"/provisioning/getTempConfigsByNetElementId."
                                   f"do?netElementId={device['key']}")
         new_configlets = prop_conf['proposedConfiglets']
@@ -3071,10 +4603,64 @@ class CvpApi():
                     }
                 ]
             }
-            self.log.debug(f"v6 {tag_url}")
+            self.log.debug("v6 %s", tag_url)
+            return self.clnt.post(tag_url, data=payload)
+        return None
+
+    def get_all_tag_assignments(self, element_type='ELEMENT_TYPE_UNSPECIFIED',
+                                workspace_id=''):
+        ''' Get all device and/or interface tag assignments from the mainline workspace
+            or another workspace
+            Args:
+               element_type (str): Can be ELEMENT_TYPE_DEVICE, ELEMENT_TYPE_INTERFACE and
+                  ELEMENT_TYPE_UNSPECIFIED
+                  set to ELEMENT_TYPE_UNSPECIFIED by default which fetches all assignments
+               workspace_id (str): The ID of the workspace, by default it is set to an empty string
+                  which will use the mainline workspace
+            Returns:
+               response (dict): A dict that contains a list of tag assignments
+                    Ex.: {'data': [{'result': {'value': {'key': {'workspaceId': '',
+                          'elementType': 'ELEMENT_TYPE_DEVICE', 'label': 'string',
+                          'value': 'string', 'deviceId': 'string', 'interfaceId': ''}},
+                          'time': 'rfc3339 time', 'type': 'INITIAL'}}]}
+        '''
+        msg = 'Tag.V2 Resource APIs are supported from 2021.2.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.2.0+
+        if self.cvp_version_compare('>=', 6.0, msg):
+            tag_url = '/api/resources/tag/v2/TagAssignment/all'
+            payload = {
+                "partialEqFilter": [
+                    {
+                        "key": {
+                            "elementType": element_type,
+                            "workspaceId": workspace_id
+                        }
+                    }
+                ]
+            }
+            self.log.debug("v6 %s", tag_url)
             return self.clnt.post(tag_url, data=payload)
         return None
 
+    def tag_index(self, workspace_id=None,
+                  element_type='ELEMENT_TYPE_UNSPECIFIED'):
+        ''' Build a TagIndex of the mainline tag assignments with the tag
+            assignment edits of a workspace overlaid. The index answers tag
+            queries locally and can be updated with subscription events.
+            Supported versions: CVP 2021.2.0 or newer and CVaaS.
+
+            Args:
+               workspace_id (str): Optional ID of the workspace whose edits
+                  are overlaid. Default is None for mainline only.
+               element_type (str): Can be ELEMENT_TYPE_DEVICE, ELEMENT_TYPE_INTERFACE and
+                  ELEMENT_TYPE_UNSPECIFIED. Default is ELEMENT_TYPE_UNSPECIFIED.
+
+            Returns:
+               index (obj): A cvprac.cvp_tags.TagIndex.
+                    Ex: index.devices('role', 'spine') returns {'SN1', 'SN2'}
+        '''
+        return TagIndex.from_api(self, workspace_id, element_type)
+
     def get_tag_edits(self, workspace_id):
         ''' Show all tags edits in a workspace
 
@@ -3100,7 +4686,7 @@ class CvpApi():
                     }
                 ]
             }
-            self.log.debug('v6 ' + tag_url + ' ' + str(payload))
+            self.log.debug("v6 %s %s", tag_url, LogPayload(payload))
             return self.clnt.post(tag_url, data=payload)
         return None
 
@@ -3129,7 +4715,7 @@ class CvpApi():
                     }
                 ]
             }
-            self.log.debug('v6 ' + tag_url + ' ' + str(payload))
+            self.log.debug("v6 %s %s", tag_url, LogPayload(payload))
             return self.clnt.post(tag_url, data=payload)
         return None
 
@@ -3166,7 +4752,7 @@ class CvpApi():
                 },
                 "remove": remove
             }
-            self.log.debug(f"v6 {tag_url} " + str(payload))
+            self.log.debug("v6 %s %s", tag_url, LogPayload(payload))
             return self.clnt.post(tag_url, data=payload)
         return None
 
@@ -3211,10 +4797,179 @@ class CvpApi():
                 },
                 "remove": remove
             }
-            self.log.debug(f"v6 {tag_url} " + str(payload))
+            self.log.debug("v6 %s %s", tag_url, LogPayload(payload))
             return self.clnt.post(tag_url, data=payload)
         return None
 
+    def tag_config_bulk(self, element_type, workspace_id, tags, remove=False,
+                        chunk_size=500, max_workers=4):
+        ''' Create/Delete many device or interface tags with the TagConfig
+            batch endpoint. The tags are sent in chunks of chunk_size per
+            request and the chunks are sent concurrently.
+            Tag creation with the tag.v2 resource API has to be done within a workspace.
+
+            Args:
+               element_type (str): Can be ELEMENT_TYPE_DEVICE or ELEMENT_TYPE_INTERFACE to
+                    create device and interface tag respectively.
+               workspace_id(str): The ID of the workspace.
+                    This should be generated by the create_workspace() API call.
+               tags (list): A list of (label, value) tuples or dicts with the
+                    'label' and 'value' keys.
+                    Ex: [('topology_hint_pod', 'pod1'),
+                         {'label': 'topology_hint_rack', 'value': 'rack1'}]
+               remove (Boolean): When set to True it will remove the device/interface tags.
+                    When set to False (default) it will create the device/interface tags.
+               chunk_size (int): Number of tags per request. Default is 500.
+               max_workers (int): Maximum number of concurrent requests.
+                    Default is 4.
+
+            Returns:
+                response (dict): A dict with the list of keys that were set
+                    under 'succeeded' and a list of dicts with the 'key' and
+                    'error' of every tag that was not set under 'failed'.
+        '''
+        msg = 'Tag.V2 Resource APIs are supported from 2021.2.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.2.0+
+        if self.cvp_version_compare('>=', 6.0, msg):
+            values = []
+            for tag in tags:
+                label, value = (tag['label'], tag['value']) \
+                    if isinstance(tag, dict) else tag
+                values.append({"key": {"elementType": element_type,
+                                       "workspaceId": workspace_id,
+                                       "label": label,
+                                       "value": value},
+                               "remove": remove})
+            return self._resource_set_some('/api/resources/tag/v2/TagConfig',
+                                           values, chunk_size, max_workers)
+        return None
+
+    def tag_assignment_config_bulk(self, element_type, workspace_id,
+                                   assignments, remove=False, chunk_size=500,
+                                   max_workers=4):
+        ''' Assign/Unassign many device or interface tags with the
+            TagAssignmentConfig batch endpoint. The assignments are sent in
+            chunks of chunk_size per request and the chunks are sent
+            concurrently.
+            Tag assignment with the tag.v2 resource API has to be done within a workspace.
+
+            Args:
+               element_type (str): can be ELEMENT_TYPE_DEVICE or ELEMENT_TYPE_INTERFACE to
+                    create device and interface tag respectively
+               workspace_id(str): the ID of the workspace. This should be generated by
+                    the create_workspace() API call.
+               assignments (list): A list of (label, value, device_id,
+                    interface_id) tuples or dicts with the 'label', 'value',
+                    'device_id' and 'interface_id' keys. interface_id should
+                    be an empty string for device tags.
+                    Ex: [('topology_hint_rack', 'rack1', 'SN1', ''),
+                         ('lldp', 'on', 'SN1', 'Ethernet1')]
+               remove (Boolean): When set to True it will remove the device/interface
+                    tag assignments.
+                    When set to False (default) it will create the device/interface tag
+                    assignments.
+               chunk_size (int): Number of assignments per request.
+                    Default is 500.
+               max_workers (int): Maximum number of concurrent requests.
+                    Default is 4.
+
+            Returns:
+                response (dict): A dict with the list of keys that were set
+                    under 'succeeded' and a list of dicts with the 'key' and
+                    'error' of every assignment that was not set under
+                    'failed'.
+        '''
+        msg = 'Tag.V2 Resource APIs are supported from 2021.2.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.2.0+
+        if self.cvp_version_compare('>=', 6.0, msg):
+            values = []
+            for assignment in assignments:
+                if isinstance(assignment, dict):
+                    assignment = (assignment['label'], assignment['value'],
+                                  assignment['device_id'],
+                                  assignment['interface_id'])
+                label, value, device_id, interface_id = assignment
+                values.append({"key": {"elementType": element_type,
+                                       "workspaceId": workspace_id,
+                                       "label": label,
+                                       "value": value,
+                                       "deviceId": device_id,
+                                       "interfaceId": interface_id},
+                               "remove": remove})
+            return self._resource_set_some(
+                '/api/resources/tag/v2/TagAssignmentConfig', values,
+                chunk_size, max_workers)
+        return None
+
+    def _resource_set_some(self, url, values, chunk_size=500, max_workers=4):
+        ''' Set many resource values with the Resource API SetSome batch
+            endpoint in concurrent chunks.
+
+            Args:
+                url (str): The resource URL without the /some suffix.
+                    Ex: /api/resources/tag/v2/TagConfig
+                values (list): The resource values to set.
+                chunk_size (int): Number of values per request.
+                    Default is 500.
+                max_workers (int): Maximum number of concurrent requests.
+                    Default is 4.
+
+            Returns:
+                response (dict): A dict with the list of keys that were set
+                    under 'succeeded' and a list of dicts with the 'key' and
+                    'error' of every value that was not set under 'failed'.
+                    If a whole request fails every value of the chunk is
+                    reported as failed with the request error.
+        '''
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+        chunks = [values[idx:idx + chunk_size]
+                  for idx in range(0, len(values), chunk_size)]
+
+        def set_chunk(index):
+            self.log.debug("v6 %s/some chunk %s: %s values", url, index,
+                           len(chunks[index]))
+            return self.clnt.post(f"{url}/some",
+                                  data={'values': chunks[index]},
+                                  timeout=self.request_timeout)
+
+        response = {'succeeded': [], 'failed': []}
+        for index, resp, error in self._run_concurrently(
+                set_chunk, range(len(chunks)), max_workers):
+            if error is not None:
+                response['failed'].extend(
+                    {'key': value['key'], 'error': str(error)}
+                    for value in chunks[index])
+                continue
+            if isinstance(resp, dict) and 'data' in resp:
+                results = resp['data']
+            else:
+                results = [resp] if resp else []
+            for result in results:
+                result = result.get('result', result)
+                if result.get('error'):
+                    response['failed'].append({'key': result.get('key'),
+                                               'error': result['error']})
+                else:
+                    response['succeeded'].append(result.get('key'))
+        return response
+
+    def resource(self, path):
+        ''' Returns a Resource for building GetOne, GetAll, GetSome, Set
+            and SetSome requests for a Resource API model.
+            Supported versions: CVP 2021.2.0 or newer and CVaaS.
+
+            Args:
+                path (str): The path of the model below /api/resources.
+
+            Returns:
+                resource (obj): A Resource.
+
+                Ex: clnt.api.resource('tag/v2/Tag').get_all(
+                        eq_filters({'key.elementType': 'ELEMENT_TYPE_DEVICE'}))
+        '''
+        return Resource(self, path)
+
     def get_all_workspaces(self):
         ''' Get state information for all workspaces
 
@@ -3226,7 +4981,7 @@ class CvpApi():
         if self.cvp_version_compare('>=', 6.0, msg):
             workspace_url = '/api/resources/workspace/v1/Workspace/all'
             payload = {}
-            self.log.debug(f"v6 {workspace_url}")
+            self.log.debug("v6 %s", workspace_url)
             return self.clnt.post(workspace_url, data=payload)
         return None
 
@@ -3240,7 +4995,7 @@ class CvpApi():
         # For on-prem check the version as it is only supported from 2021.2.0+
         if self.cvp_version_compare('>=', 6.0, msg):
             workspace_url = f"/api/resources/workspace/v1/Workspace?key.workspaceId={workspace_id}"
-            self.log.debug(f"v6 {workspace_url}")
+            self.log.debug("v6 %s", workspace_url)
             return self.clnt.get(workspace_url)
         return None
 
@@ -3287,7 +5042,7 @@ class CvpApi():
                     "requestId": request_id
                 }
             }
-            self.log.debug('v6 ' + str(workspace_url) + ' ' + str(payload))
+            self.log.debug("v6 %s %s", workspace_url, LogPayload(payload))
             return self.clnt.post(workspace_url, data=payload)
         return None
 
@@ -3308,10 +5063,258 @@ class CvpApi():
         if self.cvp_version_compare('>=', 6.0, msg):
             params = f"key.workspaceId={workspace_id}&key.buildId={build_id}"
             workspace_url = '/api/resources/workspace/v1/WorkspaceBuild?' + params
-            self.log.debug(f"v6 {workspace_url + params}")
+            self.log.debug("v6 %s", workspace_url + params)
             return self.clnt.get(workspace_url, timeout=self.request_timeout)
         return None
 
+    def workspace_pipeline(self, workspace_id, display_name, description='',
+                           tags=None, tag_assignments=None, submit=True,
+                           timeout=900, interval=1, max_interval=10,
+                           subscribe=False):
+        ''' Drive a workspace from creation to submission: create it, stage
+            tag edits in bulk, start a build, wait for the build, and submit
+            it if the build succeeded.
+            Supported versions: CVP 2021.2.0 or newer and CVaaS.
+
+            Args:
+                workspace_id (str): The (unique) name of the workspace.
+                display_name (str): The display name of the workspace.
+                description (str): The description of the workspace.
+                tags (list): Optional (element_type, label, value) tuples of
+                    tags to create.
+                tag_assignments (list): Optional (element_type, label, value,
+                    device_id, interface_id) tuples of tags to assign.
+                submit (bool): Submit the workspace if the build succeeds.
+                    Default is True.
+                timeout (int): Maximum number of seconds to wait for each of
+                    the build and the submit. Default is 900.
+                interval (int): Initial number of seconds between polls. The
+                    interval doubles up to max_interval while the state does
+                    not change. Default is 1.
+                max_interval (int): Maximum number of seconds between polls.
+                    Default is 10.
+                subscribe (bool): Wait for the build with a Resource API
+                    subscription instead of polling. Default is False.
+
+            Returns:
+                response (dict): A dict with the overall 'state' (one of
+                    'submitted', 'submit_failed', 'built', 'build_failed' or
+                    'timeout'), the 'build' ID, state and per device results
+                    and the 'submit' status, message and created Change
+                    Control IDs.
+
+                    Ex: {'workspace_id': 'ws1', 'state': 'submitted',
+                         'build': {'id': 'b-...', 'state': 'BUILD_STATE_SUCCESS',
+                                   'devices': {'SN1': {'state': 'BUILD_STATE_SUCCESS',
+                                                       'errors': [],
+                                                       'warnings': []}}},
+                         'submit': {'id': 's-...',
+                                    'status': 'RESPONSE_STATUS_SUCCESS',
+                                    'message': '', 'cc_ids': ['cc1']}}
+
+            Raises:
+                CvpApiError: A CvpApiError is raised if a tag edit failed.
+        '''
+        msg = 'Workspace Resource APIs are supported from 2021.2.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.2.0+
+        if not self.cvp_version_compare('>=', 6.0, msg):
+            return None
+        response = {'workspace_id': workspace_id, 'state': None,
+                    'build': None, 'submit': None}
+        self.workspace_config(workspace_id, display_name, description)
+        failed = []
+        for bulk_func, edits in ((self.tag_config_bulk, tags),
+                                 (self.tag_assignment_config_bulk,
+                                  tag_assignments)):
+            by_type = {}
+            for edit in edits or []:
+                by_type.setdefault(edit[0], []).append(edit[1:])
+            for element_type, values in by_type.items():
+                failed.extend(bulk_func(element_type, workspace_id,
+                                        values)['failed'])
+        if failed:
+            raise CvpApiError(f"Workspace {workspace_id}: {len(failed)} tag"
+                              f" edits failed: {failed[:5]}")
+
+        build_id = f"b-{uuid.uuid4()}"
+        self.workspace_config(workspace_id, display_name, description,
+                              request='REQUEST_START_BUILD',
+                              request_id=build_id)
+        build, finished = self._wait_for_workspace_build(
+            workspace_id, build_id, timeout, interval, max_interval,
+            subscribe)
+        response['build'] = self._summarize_build(build_id, build)
+        if not finished:
+            response['state'] = 'timeout'
+            return response
+        if response['build']['state'] != 'BUILD_STATE_SUCCESS':
+            response['state'] = 'build_failed'
+            return response
+        if not submit:
+            response['state'] = 'built'
+            return response
+
+        submit_id = f"s-{uuid.uuid4()}"
+        self.workspace_config(workspace_id, display_name, description,
+                              request='REQUEST_SUBMIT',
+                              request_id=submit_id)
+
+        def submit_status():
+            resp = self.get_workspace(workspace_id) or {}
+            value = resp.get('value', {})
+            status = value.get('responses', {}).get('values', {}).get(
+                submit_id, {})
+            return value, status.get('status')
+
+        value, status = self._poll_until(
+            submit_status,
+            lambda status: status not in (None,
+                                          'RESPONSE_STATUS_UNSPECIFIED'),
+            timeout, interval, max_interval)
+        response['submit'] = {
+            'id': submit_id, 'status': status,
+            'message': value.get('responses', {}).get('values', {}).get(
+                submit_id, {}).get('message', ''),
+            'cc_ids': value.get('ccIds', {}).get('values', [])}
+        if status == 'RESPONSE_STATUS_SUCCESS':
+            response['state'] = 'submitted'
+        elif status in (None, 'RESPONSE_STATUS_UNSPECIFIED'):
+            response['state'] = 'timeout'
+        else:
+            response['state'] = 'submit_failed'
+        return response
+
+    def workspace_pipelines(self, pipelines, max_workers=4):
+        ''' Run several independent workspace pipelines concurrently.
+
+            Args:
+                pipelines (list): A list of dicts of workspace_pipeline
+                    keyword arguments. Each dict must have the
+                    'workspace_id' and 'display_name' keys.
+                max_workers (int): Maximum number of concurrent pipelines.
+                    Default is 4.
+
+            Returns:
+                response (dict): A dict of workspace ID to the
+                    workspace_pipeline response, or to {'state': 'error',
+                    'error': message} if the pipeline raised an error.
+        '''
+        response = {}
+        for kwargs, result, error in self._run_concurrently(
+                lambda kwargs: self.workspace_pipeline(**kwargs), pipelines,
+                max_workers):
+            if error is not None:
+                result = {'workspace_id': kwargs['workspace_id'],
+                          'state': 'error', 'error': str(error)}
+            response[kwargs['workspace_id']] = result
+        return response
+
+    def _wait_for_workspace_build(self, workspace_id, build_id, timeout,
+                                  interval, max_interval, subscribe):
+        ''' Wait for a workspace build to finish.
+
+            Returns:
+                (value, finished) tuple with the last WorkspaceBuild value
+                    and whether the build finished before the timeout.
+        '''
+        def done(state):
+            return state not in (None, 'BUILD_STATE_UNSPECIFIED',
+                                 'BUILD_STATE_IN_PROGRESS')
+
+        deadline = time.time() + timeout
+        if subscribe:
+            value = {}
+            # Without events nothing else interrupts the stream, so a quiet
+            # stream has to time out to let the deadline be enforced. Any
+            # break of the stream falls back to polling.
+            events = self.resource_subscribe(
+                'workspace/v1/WorkspaceBuild',
+                [{'key': {'workspaceId': workspace_id,
+                          'buildId': build_id}}],
+                timeout=max(1, min(max_interval, timeout)),
+                max_reconnects=0)
+            if events is not None:
+                try:
+                    for event in events:
+                        value = event.get('value', value)
+                        if done(value.get('state')):
+                            return value, True
+                        if time.time() >= deadline:
+                            return value, False
+                except (ChunkedEncodingError, RequestsConnectionError,
+                        Timeout) as error:
+                    self.log.debug('Workspace build subscription ended: %s',
+                                   error)
+                finally:
+                    events.close()
+                if time.time() >= deadline:
+                    return value, False
+
+        def build_state():
+            try:
+                resp = self.workspace_build_status(workspace_id, build_id)
+            except CvpApiError as error:
+                # The build resource is created shortly after the request
+                if 'resource not found' not in str(error):
+                    raise
+                resp = None
+            value = (resp or {}).get('value', {})
+            return value, value.get('state')
+
+        value, state = self._poll_until(build_state, done,
+                                        max(0, deadline - time.time()),
+                                        interval, max_interval)
+        return value, done(state)
+
+    @staticmethod
+    def _poll_until(fetch, done, timeout, interval, max_interval):
+        ''' Call fetch until done returns True for its state or the timeout
+            expires. The interval doubles up to max_interval while the state
+            does not change and is reset when it changes.
+
+            Args:
+                fetch (callable): Returns a (value, state) tuple.
+                done (callable): Returns True for a final state.
+
+            Returns:
+                The last (value, state) tuple.
+        '''
+        start = time.time()
+        delay = interval / 2
+        last_state = None
+        while True:
+            value, state = fetch()
+            elapsed = time.time() - start
+            if done(state) or elapsed >= timeout:
+                return value, state
+            delay = interval if state != last_state else \
+                min(delay * 2, max_interval)
+            last_state = state
+            time.sleep(min(delay, timeout - elapsed))
+
+    @staticmethod
+    def _summarize_build(build_id, value):
+        ''' Reduce a WorkspaceBuild value to the build state and the state,
+            errors and warnings of each device.
+        '''
+        devices = {}
+        for device_id, result in value.get('buildResults', {}).get(
+                'values', {}).items():
+            summary = {'state': result.get('state'), 'errors': [],
+                       'warnings': []}
+            for section in result.values():
+                if not isinstance(section, dict):
+                    continue
+                for kind in ('errors', 'warnings'):
+                    entries = section.get(kind, {})
+                    if isinstance(entries, dict):
+                        entries = entries.get('values', [])
+                    if isinstance(entries, list):
+                        summary[kind].extend(entries)
+            devices[device_id] = summary
+        return {'id': build_id, 'state': value.get('state'),
+                'devices': devices}
+
     def change_control_get_one(self, cc_id, cc_time=None):
         ''' Get the configuration and status of a change control using Resource APIs.
             Supported versions: CVP 2021.2.0 or newer and CVaaS.
@@ -3342,7 +5345,7 @@ class CvpApi():
             else:
                 params = f"key.id={cc_id}&time={cc_time}"
             cc_url = '/api/resources/changecontrol/v1/ChangeControl?' + params
-            self.log.debug(f"v6 {cc_url}")
+            self.log.debug("v6 %s", cc_url)
             try:
                 response = self.clnt.get(cc_url, timeout=self.request_timeout)
             except Exception as error:
@@ -3363,10 +5366,68 @@ class CvpApi():
         # For on-prem check the version as it is only supported from 2021.2.0+
         if self.cvp_version_compare('>=', 6.0, msg):
             cc_url = '/api/resources/changecontrol/v1/ChangeControl/all'
-            self.log.debug(f"v6 {cc_url}")
+            self.log.debug("v6 %s", cc_url)
             return self.clnt.get(cc_url, timeout=self.request_timeout)
         return None
 
+    def resource_subscribe(self, resource, partial_eq_filter=None,
+                           timeout=300, max_reconnects=5):
+        ''' Subscribe to a Resource API model and receive the changes as they
+            happen instead of polling. The subscription is re-established
+            automatically, on another CVP node if needed, and resumes after
+            the last event received.
+            Supported versions: CVP 2021.2.0 or newer and CVaaS.
+
+            Args:
+                resource (str): The resource path after /api/resources/.
+                    Ex: changecontrol/v1/ChangeControl
+                partial_eq_filter (list): Optional list of partial
+                    resources to filter the events on.
+                    Ex: [{'key': {'id': 'cc1'}}]
+                timeout (int): Number of seconds to wait between bytes sent
+                    from the server before reconnecting. Default is 300.
+                max_reconnects (int): Maximum number of consecutive reconnect
+                    attempts. Default is 5.
+
+            Returns:
+                events (generator): A generator of event dicts with the
+                    'type' (INITIAL, UPDATED, DELETED or
+                    INITIAL_SYNC_COMPLETE), 'time' and 'value' keys.
+
+                    Ex: for event in clnt.api.resource_subscribe(
+                            'changecontrol/v1/ChangeControl'):
+                            print(event['type'], event['value']['key'])
+        '''
+        msg = 'Resource API subscriptions are supported from 2021.2.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.2.0+
+        if self.cvp_version_compare('>=', 6.0, msg):
+            url = f"/api/resources/{resource.strip('/')}/subscribe"
+            data = None
+            if partial_eq_filter:
+                data = {'partialEqFilter': partial_eq_filter}
+            self.log.debug("v6 %s", url)
+            return self.clnt.subscribe(url, data=data, timeout=timeout,
+                                       max_reconnects=max_reconnects)
+        return None
+
+    def change_control_monitor(self, cc_ids):
+        ''' Returns a ChangeControlMonitor that tracks the execution of many
+            Change Controls with one request per poll.
+            Supported versions: CVP 2021.2.0 or newer and CVaaS.
+
+            Args:
+                cc_ids (list): The IDs of the Change Controls to track.
+
+            Returns:
+                monitor (obj): A ChangeControlMonitor.
+
+                Ex: monitor = clnt.api.change_control_monitor(['cc1', 'cc2'])
+                    for transition in monitor.watch():
+                        print(transition['cc_id'], transition['stage_id'],
+                              transition['status'], monitor.progress())
+        '''
+        return ChangeControlMonitor(self, cc_ids)
+
     def change_control_approval_get_one(self, cc_id, cc_time=None):
         ''' Get the state of a specific Change Control's approve config using Resource APIs.
             Supported versions: CVP 2021.2.0 or newer and CVaaS.
@@ -3412,7 +5473,7 @@ class CvpApi():
         # For on-prem check the version as it is only supported from 2021.2.0+
         if self.cvp_version_compare('>=', 6.0, msg):
             cc_url = '/api/resources/changecontrol/v1/ApproveConfig/all'
-            self.log.debug(f"v6 {cc_url}")
+            self.log.debug("v6 %s", cc_url)
             return self.clnt.get(cc_url, timeout=self.request_timeout)
         return None
 
@@ -3462,7 +5523,7 @@ class CvpApi():
         if self.cvp_version_compare('>=', 6.0, msg):
             params = f"key.id={cc_id}"
             cc_url = '/api/resources/changecontrol/v1/ChangeControlConfig?' + params
-            self.log.debug(f"v6 {cc_url}")
+            self.log.debug("v6 %s", cc_url)
             return self.clnt.delete(cc_url, timeout=self.request_timeout)
         return None
 
@@ -3597,7 +5658,7 @@ class CvpApi():
         if self.cvp_version_compare('>=', 6.0, msg):
             payload = custom_cc
             cc_url = '/api/resources/changecontrol/v1/ChangeControlConfig'
-            self.log.debug('v6 ' + str(cc_url) + ' ' + str(payload))
+            self.log.debug("v6 %s %s", cc_url, LogPayload(payload))
             return self.clnt.post(cc_url, data=payload)
         return None
 
@@ -3669,10 +5730,181 @@ class CvpApi():
                 }
             }
             cc_url = '/api/resources/changecontrol/v1/ChangeControlConfig'
-            self.log.debug('v6 ' + str(cc_url) + ' ' + str(payload))
+            self.log.debug("v6 %s %s", cc_url, LogPayload(payload))
             return self.clnt.post(cc_url, data=payload, timeout=self.request_timeout)
         return None
 
+    @staticmethod
+    def plan_change_control_stages(tasks, max_parallel=None, max_per_group=1,
+                                   timeout=3000):
+        ''' Build a Change Control stage hierarchy that runs the tasks in
+            as few waves as possible. The waves run in series and the tasks
+            of a wave run in parallel. A wave holds at most max_parallel
+            tasks and at most max_per_group tasks with the same group key,
+            so e.g. both members of an MLAG pair are never upgraded at the
+            same time. The groups with the most remaining tasks are
+            scheduled first which gives the minimum number of waves.
+
+            Args:
+                tasks (list): Task IDs or (task_id, group) tuples where
+                    group is any hashable key such as a container name,
+                    MLAG domain or pod. Tasks without a group are not
+                    limited by max_per_group.
+                    Ex: ['10', ('11', 'pod1'), ('12', 'pod1')]
+                max_parallel (int): Maximum number of tasks per wave.
+                    Default is None for no limit.
+                max_per_group (int): Maximum number of tasks of the same
+                    group per wave. Default is 1.
+                timeout (int): Timeout of each task action. Default is 3000.
+
+            Returns:
+                stages (dict): The stages dict for the 'root' stage to use
+                    as the 'stages' of a Change Control.
+                    Ex: {'values': {'root': {'name': 'root', 'rows': {
+                            'values': [{'values': ['wave1']},
+                                       {'values': ['wave2']}]}},
+                         'wave1': {'name': 'wave1', 'rows': {'values': [
+                            {'values': ['task-10', 'task-11']}]}},
+                         ...}}
+        '''
+        if max_parallel is not None and max_parallel < 1:
+            raise ValueError('max_parallel must be a positive integer')
+        if max_per_group < 1:
+            raise ValueError('max_per_group must be a positive integer')
+        groups = {}
+        for task in tasks:
+            if isinstance(task, (tuple, list)):
+                task_id, group = task
+            else:
+                task_id, group = task, None
+            task_id = str(task_id)
+            # Ungrouped tasks are each given their own group
+            key = ('group', group) if group is not None else ('task', task_id)
+            groups.setdefault(key, []).append(task_id)
+        # Max heap on the number of remaining tasks, then on input order
+        heap = [(-len(ids), order, ids)
+                for order, ids in enumerate(groups.values())]
+        heapq.heapify(heap)
+        values = {'root': {'name': 'root', 'rows': {'values': []}}}
+        while heap:
+            wave = []
+            used = []
+            while heap and (max_parallel is None or len(wave) < max_parallel):
+                count, order, ids = heapq.heappop(heap)
+                take = min(max_per_group, -count)
+                if max_parallel is not None:
+                    take = min(take, max_parallel - len(wave))
+                wave.extend(ids[:take])
+                del ids[:take]
+                if ids:
+                    used.append((-len(ids), order, ids))
+            for entry in used:
+                heapq.heappush(heap, entry)
+            wave_id = f"wave{len(values['root']['rows']['values']) + 1}"
+            values['root']['rows']['values'].append({'values': [wave_id]})
+            values[wave_id] = {'name': wave_id, 'rows': {'values': [
+                {'values': [f"task-{task_id}" for task_id in wave]}]}}
+            for task_id in wave:
+                values[f"task-{task_id}"] = {
+                    'action': {'args': {'values': {'TaskID': task_id}},
+                               'name': 'task',
+                               'timeout': timeout},
+                    'name': f"task-{task_id}"}
+        return {'values': values}
+
+    @staticmethod
+    def validate_change_control_stages(stages, root_stage_id='root'):
+        ''' Check a Change Control stage hierarchy before submitting it.
+
+            Args:
+                stages (dict): The 'stages' dict of a Change Control.
+                root_stage_id (str): The ID of the root stage.
+                    Default is 'root'.
+
+            Raises:
+                CvpRequestError: A CvpRequestError is raised if the root stage
+                    or a referenced stage does not exist, if a stage is
+                    referenced more than once or is part of a cycle, if a
+                    stage is not reachable from the root or if a TaskID is
+                    used by more than one stage.
+        '''
+        values = stages['values']
+        if root_stage_id not in values:
+            raise CvpRequestError(f"Root stage {root_stage_id} not found")
+        seen = set()
+        task_ids = set()
+        pending = [root_stage_id]
+        seen.add(root_stage_id)
+        while pending:
+            stage_id = pending.pop()
+            stage = values[stage_id]
+            task_id = stage.get('action', {}).get('args', {}).get(
+                'values', {}).get('TaskID')
+            if task_id is not None:
+                if task_id in task_ids:
+                    raise CvpRequestError(f"TaskID {task_id} is used by more"
+                                          f" than one stage")
+                task_ids.add(task_id)
+            for row in stage.get('rows', {}).get('values', []):
+                for child in row['values']:
+                    if child not in values:
+                        raise CvpRequestError(
+                            f"Stage {stage_id} references unknown stage"
+                            f" {child}")
+                    # The stages must form a tree so a stage seen twice is
+                    # either shared between parents or part of a cycle.
+                    if child in seen:
+                        raise CvpRequestError(
+                            f"Stage {child} is referenced more than once"
+                            f" or is part of a cycle")
+                    seen.add(child)
+                    pending.append(child)
+        unreachable = set(values) - seen
+        if unreachable:
+            raise CvpRequestError(f"Stages not reachable from"
+                                  f" {root_stage_id}: {sorted(unreachable)}")
+
+    def change_control_create_planned(self, cc_id, name, tasks,
+                                      max_parallel=None, max_per_group=1,
+                                      notes=''):
+        ''' Create a Change Control that runs the tasks in the fewest
+            waves allowed by max_parallel and max_per_group using Resource
+            APIs. See plan_change_control_stages for the wave planning.
+            Supported versions: CVP 2021.2.0 or newer and CVaaS.
+
+            Args:
+                cc_id (string): The ID for the new change control.
+                name (string): The name for the new change control.
+                tasks (list): Task IDs as strings or (task_id, group) tuples.
+                    Ex: [('10', 'mlag1'), ('11', 'mlag1'), '12']
+                max_parallel (int): Maximum number of tasks per wave.
+                    Default is None for no limit.
+                max_per_group (int): Maximum number of tasks of the same
+                    group per wave. Default is 1.
+                notes (string): An optional note.
+
+            Returns:
+                response (dict): A dict that contains...
+                Ex: {'value': {'key': {'id':cc_id,
+                      'time': '...'}
+
+            Raises:
+                CvpRequestError: A CvpRequestError is raised if the planned
+                    stages are not valid.
+        '''
+        stages = self.plan_change_control_stages(tasks, max_parallel,
+                                                 max_per_group)
+        self.validate_change_control_stages(stages)
+        waves = len(stages['values']['root']['rows']['values'])
+        self.log.debug("change_control_create_planned: %s waves: %s", cc_id,
+                       waves)
+        payload = {'key': {'id': cc_id},
+                   'change': {'name': name,
+                              'rootStageId': 'root',
+                              'notes': notes,
+                              'stages': stages}}
+        return self.change_control_create_with_custom_stages(payload)
+
     def change_control_start(self, cc_id, notes=""):
         ''' Start a Change Control using Resource APIs.
             Supported versions: CVP 2021.2.0 or newer and CVaaS.
@@ -3697,10 +5929,236 @@ class CvpApi():
                 }
             }
             cc_url = '/api/resources/changecontrol/v1/ChangeControlConfig'
-            self.log.debug('v6 ' + str(cc_url) + ' ' + str(payload))
+            self.log.debug("v6 %s %s", cc_url, LogPayload(payload))
             return self.clnt.post(cc_url, data=payload, timeout=self.request_timeout)
         return None
 
+    @staticmethod
+    def plan_upgrade_waves(devices, constraints=(), max_parallel=None):
+        ''' Split devices into as few waves as possible where each wave
+            respects every grouping constraint. Devices in the groups with
+            the most remaining devices are placed first.
+
+            Args:
+                devices (list): Device keys in the preferred upgrade order.
+                constraints (list): (group_of, limit) tuples where group_of
+                    is a dict or a callable that returns the group of a
+                    device key (None for no group) and limit is the maximum
+                    number of devices of the same group per wave.
+                    Ex: [(mlag_domains, 1), (pods, 2)]
+                max_parallel (int): Maximum number of devices per wave.
+                    Default is None for no limit.
+
+            Returns:
+                waves (list): A list of lists of device keys.
+        '''
+        if max_parallel is not None and max_parallel < 1:
+            raise ValueError('max_parallel must be a positive integer')
+        groups_of = []
+        for group_of, limit in constraints:
+            if limit < 1:
+                raise ValueError('constraint limits must be positive integers')
+            if not callable(group_of):
+                group_of = group_of.get
+            groups_of.append((group_of, limit))
+        device_groups = {}
+        remaining = {}
+        for device in devices:
+            groups = [(index, group_of(device))
+                      for index, (group_of, _) in enumerate(groups_of)]
+            groups = [group for group in groups if group[1] is not None]
+            device_groups[device] = groups
+            for group in groups:
+                remaining[group] = remaining.get(group, 0) + 1
+        pending = list(devices)
+        waves = []
+        while pending:
+            # Most constrained devices first, then input order
+            pending.sort(key=lambda dev: -max(
+                [remaining[group] for group in device_groups[dev]] or [0]))
+            wave = []
+            used = {}
+            left = []
+            for device in pending:
+                groups = device_groups[device]
+                if (max_parallel is not None and len(wave) >= max_parallel) \
+                        or any(used.get(group, 0) >= groups_of[group[0]][1]
+                               for group in groups):
+                    left.append(device)
+                    continue
+                wave.append(device)
+                for group in groups:
+                    used[group] = used.get(group, 0) + 1
+                    remaining[group] -= 1
+            waves.append(wave)
+            pending = left
+        return waves
+
+    def upgrade_devices(self, image, devices, cc_id=None, name=None,
+                        mlag_domain=None, pod=None, max_per_pod=1,
+                        max_parallel=None, health_checks=True, approve=False,
+                        start=False, wait=False, timeout=None, callback=None,
+                        notes='', task_timeout=3000):
+        ''' Upgrade devices to an image bundle in the fewest safe waves with
+            a single Change Control using Resource APIs.
+
+            The image bundle is applied to all devices with one batched
+            topology save. The created tasks are arranged in waves that run
+            in series. MLAG peers are never in the same wave and a wave
+            holds at most max_per_pod devices of the same pod and at most
+            max_parallel devices. When health_checks is set every device
+            with an MLAG domain runs an MLAG health check before and after
+            its upgrade task.
+            Supported versions: CVP 2021.2.0 or newer and CVaaS.
+
+            Args:
+                image (dict): The image bundle info.
+                devices (list): Device info dicts as returned by
+                    get_inventory, in the preferred upgrade order.
+                cc_id (string): The ID for the new change control.
+                    Default is None for a generated ID.
+                name (string): The name for the new change control.
+                    Default is None to use 'Upgrade to <image name>'.
+                mlag_domain (str|callable|dict): The device info key, a
+                    callable taking the device info or a dict keyed by
+                    serial number that gives the MLAG domain of a device.
+                    Default is None for no MLAG grouping.
+                pod (str|callable|dict): Same as mlag_domain for the pod
+                    of a device. Default is None for no pod grouping.
+                max_per_pod (int): Maximum number of devices of the same
+                    pod per wave. Default is 1.
+                max_parallel (int): Maximum number of devices per wave.
+                    Default is None for no limit.
+                health_checks (bool): Add pre and post MLAG health check
+                    actions for MLAG devices. Default is True.
+                approve (bool): Approve the Change Control. Default is False.
+                start (bool): Start the Change Control. Requires approve.
+                    Default is False.
+                wait (bool): Monitor the started Change Control until it
+                    completed or failed. Default is False.
+                timeout (int): Maximum number of seconds to wait.
+                    Default is None for no limit.
+                callback (callable): Called with every state transition
+                    seen while waiting. See ChangeControlMonitor.update().
+                notes (string): An optional note.
+                task_timeout (int): Timeout of each task action.
+                    Default is 3000.
+
+            Returns:
+                response (dict): A dict with the 'cc_id', the 'waves' as
+                    lists of serial numbers, the 'tasks' as a dict of serial
+                    number to task ID, the serial numbers 'skipped' because
+                    no task was created, the Change Control 'response' and
+                    the 'monitor' (a ChangeControlMonitor) when started.
+                    Returns None if no task was created.
+                Ex: {'cc_id': 'upgrade-4.30.1F-1700000000',
+                     'waves': [['SN1', 'SN3'], ['SN2']],
+                     'tasks': {'SN1': '10', 'SN2': '11', 'SN3': '12'},
+                     'skipped': [], 'response': {...}, 'monitor': None}
+
+            Raises:
+                CvpRequestError: A CvpRequestError is raised if start is set
+                    without approve or if the stages are not valid.
+        '''
+        if start and not approve:
+            raise CvpRequestError('A Change Control must be approved before'
+                                  ' it can be started')
+        msg = 'Change Control Resource APIs are supported from 2021.2.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.2.0+
+        if not self.cvp_version_compare('>=', 6.0, msg):
+            return None
+        by_serial = {device['serialNumber']: device for device in devices}
+
+        def group_of(key):
+            if key is None:
+                return lambda serial: None
+            if callable(key):
+                return lambda serial: key(by_serial[serial])
+            if isinstance(key, dict):
+                return key.get
+            return lambda serial: by_serial[serial].get(key)
+
+        mlag_of = group_of(mlag_domain)
+        with self.topology_batch() as batch:
+            for device in devices:
+                self.apply_image_to_device(image, device)
+        task_ids = set(batch.task_ids)
+        by_mac = {device['systemMacAddress']: serial
+                  for serial, device in by_serial.items()}
+        tasks = {}
+        for task in self.get_tasks_by_status('Pending'):
+            task_id = str(task.get('workOrderId'))
+            if task_id not in task_ids:
+                continue
+            mac = task.get('workOrderDetails', {}).get('netElementId')
+            serial = by_mac.get(mac)
+            if serial is not None:
+                tasks[serial] = task_id
+        skipped = [serial for serial in by_serial if serial not in tasks]
+        if not tasks:
+            self.log.warning('upgrade_devices: no task was created')
+            return None
+        waves = self.plan_upgrade_waves(
+            [serial for serial in by_serial if serial in tasks],
+            [(mlag_of, 1), (group_of(pod), max_per_pod)], max_parallel)
+        values = {'root': {'name': 'root', 'rows': {'values': []}}}
+        for number, wave in enumerate(waves, 1):
+            wave_id = f"wave{number}"
+            values['root']['rows']['values'].append({'values': [wave_id]})
+            values[wave_id] = {'name': wave_id, 'rows': {'values': [
+                {'values': [f"upgrade-{serial}" for serial in wave]}]}}
+            for serial in wave:
+                task_id = tasks[serial]
+                rows = [f"task-{task_id}"]
+                values[rows[0]] = {
+                    'action': {'args': {'values': {'TaskID': task_id}},
+                               'name': 'task',
+                               'timeout': task_timeout},
+                    'name': f"task-{task_id}"}
+                if health_checks and mlag_of(serial) is not None:
+                    for check in ('pre', 'post'):
+                        check_id = f"{check}-check-{serial}"
+                        values[check_id] = {
+                            'action': {'args': {'values': {
+                                'DeviceID': serial}},
+                                'name': 'mlaghealthcheck',
+                                'timeout': 0},
+                            'name': check_id}
+                    rows = [f"pre-check-{serial}", rows[0],
+                            f"post-check-{serial}"]
+                values[f"upgrade-{serial}"] = {
+                    'name': f"upgrade-{serial}",
+                    'rows': {'values': [{'values': [row]} for row in rows]}}
+        stages = {'values': values}
+        self.validate_change_control_stages(stages)
+        if cc_id is None:
+            cc_id = f"upgrade-{image['name']}-{int(time.time())}"
+        if name is None:
+            name = f"Upgrade to {image['name']}"
+        self.log.debug("upgrade_devices: %s devices: %s waves: %s", cc_id,
+                       len(tasks), len(waves))
+        payload = {'key': {'id': cc_id},
+                   'change': {'name': name,
+                              'rootStageId': 'root',
+                              'notes': notes,
+                              'stages': stages}}
+        response = {'cc_id': cc_id, 'waves': waves, 'tasks': tasks,
+                    'skipped': skipped,
+                    'response': self.change_control_create_with_custom_stages(
+                        payload),
+                    'monitor': None}
+        if approve:
+            self.change_control_approve(cc_id, notes)
+        if start:
+            self.change_control_start(cc_id, notes)
+            monitor = self.change_control_monitor([cc_id])
+            response['monitor'] = monitor
+            if wait:
+                for transition in monitor.watch(timeout=timeout):
+                    if callback is not None:
+                        callback(transition)
+        return response
+
     def change_control_stop(self, cc_id, notes=""):
         ''' Stop a Change Control using Resource APIs.
             Supported versions: CVP 2021.2.0 or newer and CVaaS.
@@ -3726,7 +6184,7 @@ class CvpApi():
                 }
             }
             cc_url = '/api/resources/changecontrol/v1/ChangeControlConfig'
-            self.log.debug('v6 ' + str(cc_url) + ' ' + str(payload))
+            self.log.debug("v6 %s %s", cc_url, LogPayload(payload))
             return self.clnt.post(cc_url, data=payload, timeout=self.request_timeout)
         return None
 
@@ -3758,7 +6216,7 @@ class CvpApi():
                 }
             }
             cc_url = '/api/resources/changecontrol/v1/ChangeControlConfig'
-            self.log.debug('v8 ' + str(cc_url) + ' ' + str(payload))
+            self.log.debug("v8 %s %s", cc_url, LogPayload(payload))
             return self.clnt.post(cc_url, data=payload, timeout=self.request_timeout)
         return None
 
@@ -3785,20 +6243,119 @@ class CvpApi():
             msg = 'Decommissioning via Resource APIs are supported from 2021.3.0 or newer.'
             # For on-prem check the version as it is only supported from 2021.3.0+
             if self.cvp_version_compare('>=', 7.0, msg):
-                payload = {
-                    "key": {
-                        "request_id": request_id
-                    },
-                    "device_id": device_id
-                }
-                url = '/api/resources/inventory/v1/DeviceDecommissioningConfig'
-                self.log.debug('v7 ' + str(url) + ' ' + str(payload))
-                return self.clnt.post(url, data=payload, timeout=self.request_timeout)
+                return self._post_decommissioning(device_id, request_id)
         else:
             self.log.warning("Device with %s serial number does not exist (or is not registered)"
                              " to decommission", device_id)
         return None
 
+    def _post_decommissioning(self, device_id, request_id):
+        ''' Post a DeviceDecommissioningConfig request for a device.
+        '''
+        payload = {
+            "key": {
+                "request_id": request_id
+            },
+            "device_id": device_id
+        }
+        url = '/api/resources/inventory/v1/DeviceDecommissioningConfig'
+        self.log.debug("v7 %s %s", url, LogPayload(payload))
+        return self.clnt.post(url, data=payload, timeout=self.request_timeout)
+
+    def device_decommissioning_bulk(self, device_ids, wait=True, timeout=1800,
+                                    interval=5, max_interval=30,
+                                    max_workers=8):
+        ''' Decommission many devices using Resource APIs. The inventory is
+            fetched once, the requests are submitted concurrently with
+            generated request IDs and all of them are tracked with a single
+            device_decommissioning_status_get_all request per poll.
+            Supported versions: CVP 2021.3.0 or newer and CVaaS.
+            Args:
+                device_ids (list): Serial Numbers of the devices. Duplicates
+                    are decommissioned once.
+                wait (bool): Wait for the decommissioning to finish.
+                    Default is True.
+                timeout (int): Maximum number of seconds to wait.
+                    Default is 1800.
+                interval (int): Initial number of seconds between polls. The
+                    interval doubles up to max_interval while no status
+                    changes. Default is 5.
+                max_interval (int): Maximum number of seconds between polls.
+                    Default is 30.
+                max_workers (int): Maximum number of concurrent requests.
+                    Default is 8.
+            Returns:
+                response (dict): A dict of device ID to a dict with the
+                    'request_id', the 'status', the 'message' and the
+                    'duration' in seconds until a final status was seen.
+                    The status is NOT_FOUND for devices not in the inventory,
+                    SUBMIT_FAILED if the request failed and otherwise the
+                    last DECOMMISSIONING_STATUS_* value.
+                Ex: {'SN1': {'request_id': '4a4ba5a2-...',
+                             'status': 'DECOMMISSIONING_STATUS_SUCCESS',
+                             'message': 'Device decommissioned successfully',
+                             'duration': 95.2}}
+        '''
+        msg = 'Decommissioning via Resource APIs are supported from 2021.3.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.3.0+
+        if not self.cvp_version_compare('>=', 7.0, msg):
+            return None
+        inventory = {device['serialNumber']
+                     for device in self.get_inventory(provisioned=False)}
+        response = {}
+        submit = {}
+        # Keep the first occurrence of duplicate IDs so each device is only
+        # submitted and tracked once
+        for device_id in dict.fromkeys(device_ids):
+            if device_id in inventory:
+                submit[str(uuid.uuid4())] = device_id
+                response[device_id] = {'status': None, 'message': '',
+                                       'duration': None}
+            else:
+                self.log.warning("Device with %s serial number does not exist"
+                                 " (or is not registered) to decommission",
+                                 device_id)
+                response[device_id] = {'request_id': None,
+                                       'status': 'NOT_FOUND', 'message': '',
+                                       'duration': None}
+        start = time.time()
+        for request_id, _, error in self._run_concurrently(
+                lambda req: self._post_decommissioning(submit[req], req),
+                list(submit), max_workers):
+            device = response[submit[request_id]]
+            device['request_id'] = request_id
+            if error is not None:
+                device.update(status='SUBMIT_FAILED', message=str(error))
+        tracked = {request_id: device_id
+                   for request_id, device_id in submit.items()
+                   if response[device_id]['status'] is None}
+        if not wait or not tracked:
+            return response
+        final = ('DECOMMISSIONING_STATUS_SUCCESS',
+                 'DECOMMISSIONING_STATUS_FAILURE')
+
+        def poll():
+            resp = self.device_decommissioning_status_get_all() or {}
+            for entry in resp.get('data', []):
+                value = entry.get('result', entry).get('value', {})
+                device_id = tracked.get(value.get('key', {}).get('requestId'))
+                if device_id is None:
+                    continue
+                device = response[device_id]
+                if device['status'] in final:
+                    continue
+                device['status'] = value.get('status')
+                device['message'] = value.get('statusMessage', '')
+                if device['status'] in final:
+                    device['duration'] = time.time() - start
+            return None, tuple(response[device_id]['status']
+                               for device_id in tracked.values())
+
+        self._poll_until(poll, lambda states: all(state in final
+                                                  for state in states),
+                         timeout, interval, max_interval)
+        return response
+
     def device_decommissioning_status_get_one(self, request_id):
         ''' Get the decommission status of a device using Resource APIs.
             Supported versions: CVP 2021.3.0 or newer and CVaaS.
@@ -3816,7 +6373,7 @@ class CvpApi():
         if self.cvp_version_compare('>=', 7.0, msg):
             params = f"key.requestId={request_id}"
             url = '/api/resources/inventory/v1/DeviceDecommissioning?' + params
-            self.log.debug('v7 ' + str(url))
+            self.log.debug("v7 %s", url)
             return self.clnt.get(url, timeout=self.request_timeout)
         return None
 
@@ -3848,7 +6405,7 @@ class CvpApi():
                 ]
             }
             url = '/api/resources/inventory/v1/DeviceDecommissioning/all'
-            self.log.debug('v7 ' + str(url))
+            self.log.debug("v7 %s", url)
             return self.clnt.post(url, data=payload, timeout=self.request_timeout)
         return None
 
@@ -3932,7 +6489,7 @@ class CvpApi():
         msg = 'Service Account Resource APIs are supported from 2021.3.0+.'
         if self.cvp_version_compare('>=', 12.0, msg):
             url = '/api/resources/serviceaccount/v1/Token/all'
-            self.log.debug(f"v12 {url}")
+            self.log.debug("v12 %s", url)
             # Pull list of tokens out of data key of return for new resource APIs
             resp = self.clnt.get(url)
             tokens = []
@@ -3941,7 +6498,7 @@ class CvpApi():
             return tokens
         if self.cvp_version_compare('>=', 7.0, msg):
             url = '/api/v3/services/arista.serviceaccount.v1.TokenService/GetAll'
-            self.log.debug(f"v7 {url}")
+            self.log.debug("v7 %s", url)
             return self.clnt.post(url)
         return None
 
@@ -3961,12 +6518,12 @@ class CvpApi():
         if self.cvp_version_compare('>=', 12.0, msg):
             endpoint = '/api/resources/serviceaccount/v1/Token'
             query_param = f"?key.id={token_id}"
-            self.log.debug(f'v12 {endpoint + query_param}')
+            self.log.debug("v12 %s", endpoint + query_param)
             return self.clnt.get(endpoint + query_param)
         if self.cvp_version_compare('>=', 7.0, msg):
             endpoint = '/api/v3/services/arista.serviceaccount.v1.TokenService/GetOne'
             payload = {"key": {"id": token_id}}
-            self.log.debug(f'v7 {endpoint} {payload}')
+            self.log.debug("v7 %s %s", endpoint, LogPayload(payload))
             return self.clnt.post(endpoint, data=payload)
         return None
 
@@ -3983,12 +6540,12 @@ class CvpApi():
         msg = 'Service Account Resource APIs are supported from 2021.3.0+.'
         if self.cvp_version_compare('>=', 12.0, msg):
             endpoint = f'/api/resources/serviceaccount/v1/TokenConfig?key.id={token_id}'
-            self.log.debug(f'v12 {endpoint}')
+            self.log.debug("v12 %s", endpoint)
             return self.clnt.delete(endpoint)
         if self.cvp_version_compare('>=', 7.0, msg):
             endpoint = '/api/v3/services/arista.serviceaccount.v1.TokenConfigService/Delete'
             payload = {"key": {"id": token_id}}
-            self.log.debug(f'v7 {endpoint} {payload}')
+            self.log.debug("v7 %s %s", endpoint, LogPayload(payload))
             return self.clnt.post(endpoint, data=payload)
         return None
 
@@ -4019,7 +6576,7 @@ class CvpApi():
                 'token': ''
             }
             endpoint = '/api/resources/serviceaccount/v1/TokenConfig'
-            self.log.debug(f'v12 {endpoint} {payload}')
+            self.log.debug("v12 %s %s", endpoint, LogPayload(payload))
             return self.clnt.post(endpoint, data=payload)
         if self.cvp_version_compare('>=', 7.0, msg):
             payload = {
@@ -4030,7 +6587,7 @@ class CvpApi():
                 }
             }
             endpoint = '/api/v3/services/arista.serviceaccount.v1.TokenConfigService/Set'
-            self.log.debug(f'v7 {endpoint} {payload}')
+            self.log.debug("v7 %s %s", endpoint, LogPayload(payload))
             return self.clnt.post(endpoint, data=payload)
         return None
 
@@ -4046,7 +6603,7 @@ class CvpApi():
         msg = 'Service Account Resource APIs are supported from 2021.3.0+.'
         if self.cvp_version_compare('>=', 12.0, msg):
             endpoint = '/api/resources/serviceaccount/v1/Account/all'
-            self.log.debug(f"v12 {endpoint}")
+            self.log.debug("v12 %s", endpoint)
             # Pull list of accounts out of data key of return for new resource APIs
             resp = self.clnt.get(endpoint)
             svc_accounts = []
@@ -4055,7 +6612,7 @@ class CvpApi():
             return svc_accounts
         if self.cvp_version_compare('>=', 7.0, msg):
             endpoint = '/api/v3/services/arista.serviceaccount.v1.AccountService/GetAll'
-            self.log.debug(f"v7 {endpoint}")
+            self.log.debug("v7 %s", endpoint)
             return self.clnt.post(endpoint)
         return None
 
@@ -4074,30 +6631,34 @@ class CvpApi():
         if self.cvp_version_compare('>=', 12.0, msg):
             endpoint = '/api/resources/serviceaccount/v1/Account'
             query_param = f"?key.name={username}"
-            self.log.debug(f"v12 {endpoint + query_param}")
+            self.log.debug("v12 %s", endpoint + query_param)
             return self.clnt.get(endpoint + query_param)
         if self.cvp_version_compare('>=', 7.0, msg):
             endpoint = '/api/v3/services/arista.serviceaccount.v1.AccountService/GetOne'
             payload = {"key": {"name": username}}
-            self.log.debug(f"v7 {endpoint} {payload}")
+            self.log.debug("v7 %s %s", endpoint, LogPayload(payload))
             return self.clnt.post(endpoint, data=payload)
         return None
 
-    def _get_valid_role_ids(self, roles):
+    def _get_valid_role_ids(self, roles, all_roles=None):
         ''' Helper function to validate and retrieve role IDs based on provided roles.
             Args:
                 roles (list): The list of role names.
+                all_roles (dict): Optional get_roles response to use instead
+                    of requesting the roles.
             Returns:
                 role_ids (list): The list of role IDs.
         '''
         role_ids = []
-        all_roles = self.get_roles()
+        if all_roles is None:
+            all_roles = self.get_roles()
         for role in all_roles['roles']:
             if role['key'] in roles or role['name'] in roles:
                 role_ids.append(role['key'])
         if len(roles) != len(role_ids):
-            self.log.warning(f"Not all provided roles {roles} are valid. "
-                             f"Only using the found valid roles {role_ids}")
+            self.log.warning("Not all provided roles %s are valid. Only"
+                             " using the found valid roles %s",
+                             LogPayload(roles), LogPayload(role_ids))
         return role_ids
 
     def svc_account_set(self, username, description, roles, status):
@@ -4122,9 +6683,15 @@ class CvpApi():
                       ['network-admin', 'role_1658850344592739349']}},
                       'time': '2022-07-26T18:19:55.392173445Z'}]
         '''
-        msg = 'Service Account Resource APIs are supported from 2021.3.0+.'
         # Retrieve valid role IDs
         role_ids = self._get_valid_role_ids(roles)
+        return self._svc_account_set(username, description, role_ids, status)
+
+    def _svc_account_set(self, username, description, role_ids, status):
+        ''' Create or update a service account with already validated role
+            IDs. See svc_account_set.
+        '''
+        msg = 'Service Account Resource APIs are supported from 2021.3.0+.'
         if self.cvp_version_compare('>=', 12.0, msg):
             payload = {
                 'description': description,
@@ -4133,7 +6700,7 @@ class CvpApi():
                 'status': status
             }
             endpoint = '/api/resources/serviceaccount/v1/AccountConfig'
-            self.log.debug(f"v12 {endpoint} {payload}")
+            self.log.debug("v12 %s %s", endpoint, LogPayload(payload))
             return self.clnt.post(endpoint, data=payload)
         if self.cvp_version_compare('>=', 7.0, msg):
             payload = {'value': {'description': description,
@@ -4141,7 +6708,7 @@ class CvpApi():
                                  'key': {'name': username},
                                  'status': status}}
             endpoint = '/api/v3/services/arista.serviceaccount.v1.AccountConfigService/Set'
-            self.log.debug(f"v7 {endpoint} {payload}")
+            self.log.debug("v7 %s %s", endpoint, LogPayload(payload))
             return self.clnt.post(endpoint, data=payload)
         return None
 
@@ -4158,12 +6725,12 @@ class CvpApi():
         msg = 'Service Account Resource APIs are supported from 2021.3.0+.'
         if self.cvp_version_compare('>=', 12.0, msg):
             endpoint = f'/api/resources/serviceaccount/v1/AccountConfig?key.name={username}'
-            self.log.debug(f"v7 {endpoint}")
+            self.log.debug("v7 %s", endpoint)
             return self.clnt.delete(endpoint)
         if self.cvp_version_compare('>=', 7.0, msg):
             payload = {"key": {"name": username}}
             endpoint = '/api/v3/services/arista.serviceaccount.v1.AccountConfigService/Delete'
-            self.log.debug(f"v12 {endpoint} {payload}")
+            self.log.debug("v12 %s %s", endpoint, LogPayload(payload))
             return self.clnt.post(endpoint, data=payload)
         return None
 
@@ -4179,21 +6746,240 @@ class CvpApi():
                 'time': '2022-07-26T18:30:28.022504853Z','type': 'INITIAL'},
                 {'value': {'key': {'id': '2f6325d9c'},...]
         '''
+        results = self.svc_account_tokens_cleanup(expired=True, dry_run=True)
+        expired_tokens = []
+        for token_id, result in results.items():
+            self.svc_account_token_delete(token_id)
+            expired_tokens.append(result['token'])
+        return expired_tokens
+
+    def svc_account_tokens_cleanup(self, expired=False, unused_since=None,
+                                   created_by=None, user=None, predicate=None,
+                                   dry_run=False, max_workers=8):
+        ''' Delete the service account tokens that match all the given
+            selectors concurrently using Resource APIs.
+            Supported versions: CVP 2021.3.0 or newer and CVaaS.
+            Args:
+                expired (bool): Select tokens that are past their validity.
+                unused_since (datetime): Select tokens that were never used or
+                    last used before this UTC time.
+                created_by (string): Select tokens created by this user.
+                user (string): Select tokens of this service account.
+                predicate (callable): Select tokens for which
+                    predicate(token) returns True. token is the token value
+                    dict, e.g. {'key': {'id': '...'}, 'user': 'ansible', ...}
+                dry_run (bool): Only report the tokens that would be deleted.
+                    Default is False.
+                max_workers (int): Maximum number of concurrent deletes.
+                    Default is 8.
+            Returns:
+                response (dict): A dict of token ID to a dict with the raw
+                    'token' entry as returned by svc_account_token_get_all,
+                    the 'status' ('deleted', 'dry_run' or 'failed') and the
+                    'error' message of failed deletes.
+                Ex: {'091f48a2808': {'token': {'value': {...}, ...},
+                                     'status': 'deleted', 'error': None}}
+            Raises:
+                ValueError: A ValueError is raised if no selector is given.
+        '''
+        if not (expired or unused_since or created_by or user or predicate):
+            raise ValueError('At least one token selector must be provided')
         msg = 'Service Account Resource APIs are supported from 2021.3.0+.'
-        valid_until_format = "valid_until"
-        resource_api_schema = False
+        # The Resource API schema uses camel case keys
         if self.cvp_version_compare('>=', 12.0, msg):
-            resource_api_schema = True
-            valid_until_format = "validUntil"
-        tokens = self.svc_account_token_get_all()
-        expired_tokens = []
-        for tok in tokens:
-            if resource_api_schema:
-                token_data = tok['result']['value']
+            keys = {'valid_until': 'validUntil', 'last_used': 'lastUsed',
+                    'created_by': 'createdBy'}
+        else:
+            keys = {'valid_until': 'valid_until', 'last_used': 'last_used',
+                    'created_by': 'created_by'}
+        now = datetime.utcnow()
+        selected = {}
+        for tok in self.svc_account_token_get_all() or []:
+            token_data = tok['result']['value'] if 'result' in tok \
+                else tok['value']
+            if expired and not (token_data.get(keys['valid_until']) and
+                                _parse_utc_time(
+                                    token_data[keys['valid_until']]) < now):
+                continue
+            if unused_since is not None:
+                last_used = token_data.get(keys['last_used'])
+                if last_used and _parse_utc_time(last_used) >= unused_since:
+                    continue
+            if created_by is not None and \
+                    token_data.get(keys['created_by']) != created_by:
+                continue
+            if user is not None and token_data.get('user') != user:
+                continue
+            if predicate is not None and not predicate(token_data):
+                continue
+            selected[token_data['key']['id']] = tok
+
+        response = {token_id: {'token': tok, 'status': 'dry_run',
+                               'error': None}
+                    for token_id, tok in selected.items()}
+        if dry_run:
+            return response
+        for token_id, _, error in self._run_concurrently(
+                self.svc_account_token_delete, selected, max_workers):
+            if error is not None:
+                response[token_id].update(status='failed', error=str(error))
             else:
-                token_data = tok['value']
-            if (datetime.strptime(token_data[valid_until_format], "%Y-%m-%dT%H:%M:%SZ") <
-                datetime.utcnow()):
-                self.svc_account_token_delete(token_data['key']['id'])
-                expired_tokens.append(tok)
-        return expired_tokens
+                response[token_id]['status'] = 'deleted'
+        return response
+
+    def aaa_sync(self, users=None, service_accounts=None, delete=False,
+                 dry_run=False, max_workers=8,
+                 protected=AAA_PROTECTED_ACCOUNTS):
+        ''' Bring local users and service accounts to a desired state.
+            Users, roles and service accounts are each loaded once, the
+            desired state is compared against them and only the required
+            adds, updates and deletes are applied concurrently.
+
+            Args:
+                users (list): Optional list of desired user dicts with the
+                    'username', 'role', 'status', 'first_name', 'last_name',
+                    'email' and 'user_type' keys and an optional 'password'
+                    key, i.e. the add_user arguments. None to leave users
+                    untouched. Passwords can not be read back so a change
+                    of only the password is not detected; without a
+                    'password' key updates leave the password unchanged.
+                service_accounts (list): Optional list of desired service
+                    account dicts with the 'username', 'description',
+                    'roles' and 'status' keys, i.e. the svc_account_set
+                    arguments. None to leave service accounts untouched.
+                delete (bool): Delete the local users and the service
+                    accounts that are not in the desired lists, except the
+                    protected ones and the user of the current session.
+                    TACACS and RADIUS users are never deleted. Default is
+                    False.
+                dry_run (bool): Only compute the changes. Default is False.
+                max_workers (int): Maximum number of concurrent requests.
+                    Default is 8.
+                protected (set): Names of the users and service accounts
+                    that are never deleted. Default is
+                    AAA_PROTECTED_ACCOUNTS with the built-in accounts.
+
+            Returns:
+                response (dict): A dict with the names to 'add', 'update'
+                    and 'delete' for the 'users' and 'service_accounts' and
+                    a list of dicts with the 'type', 'name', 'action' and
+                    'error' of the changes that failed under 'failed'. A
+                    service account with an unknown role fails on its own
+                    without affecting the other changes.
+
+                    Ex: {'users': {'add': ['bob'], 'update': [], 'delete': []},
+                         'service_accounts': {'add': [], 'update': ['ci'],
+                                              'delete': []},
+                         'failed': []}
+        '''
+        all_roles = self.get_roles()
+        role_names = {}
+        for role in all_roles['roles']:
+            role_names[role['key']] = role['name']
+            role_names[role['name']] = role['name']
+        response = {'users': {'add': [], 'update': [], 'delete': []},
+                    'service_accounts': {'add': [], 'update': [],
+                                         'delete': []},
+                    'failed': []}
+        actions = []
+
+        def set_account(name, description, roles, status):
+            unknown = [role for role in roles if role not in role_names]
+            if unknown:
+                raise CvpApiError(f"Unknown roles {unknown} for service"
+                                  f" account {name}")
+            return self._svc_account_set(
+                name, description, self._get_valid_role_ids(roles, all_roles),
+                status)
+
+        if users is not None:
+            current = self.get_users()
+            current_roles = current.get('roles', {})
+            current_users = {user['userId']: user
+                             for user in current.get('users', [])}
+            for user in users:
+                name = user['username']
+                fields = (user['role'], user['status'], user['first_name'],
+                          user['last_name'], user['email'], user['user_type'])
+                existing = current_users.get(name)
+                if existing is None:
+                    actions.append(('users', 'add', name, self.add_user,
+                                    (name, user.get('password', '')) + fields))
+                    continue
+                wanted = (user['first_name'], user['last_name'],
+                          user['email'], user['status'], user['user_type'],
+                          [role_names.get(user['role'], user['role'])])
+                have = (existing.get('firstName'), existing.get('lastName'),
+                        existing.get('email'), existing.get('userStatus'),
+                        existing.get('userType'),
+                        [role_names.get(role, role)
+                         for role in current_roles.get(name, [])])
+                if wanted != have:
+                    # Without a password the current one is kept
+                    actions.append(('users', 'update', name,
+                                    self.update_user,
+                                    (name, user.get('password')) + fields))
+            if delete:
+                session_user = (self.clnt.authdata or {}).get('userId')
+                desired = {user['username'] for user in users}
+                # Remote users are managed by the TACACS or RADIUS server
+                stale = [name for name, user in current_users.items()
+                         if user.get('userType') == 'Local'
+                         and name not in desired and name not in protected
+                         and name != session_user]
+                if stale:
+                    # A single request deletes all the users
+                    response['users']['delete'] = stale
+                    actions.append(('users', 'delete', stale,
+                                    self.delete_users, (stale,)))
+
+        if service_accounts is not None:
+            statuses = {0: 'ACCOUNT_STATUS_UNSPECIFIED',
+                        1: 'ACCOUNT_STATUS_ENABLED',
+                        2: 'ACCOUNT_STATUS_DISABLED'}
+            current_accounts = {}
+            for account in self.svc_account_get_all() or []:
+                value = account['result']['value'] if 'result' in account \
+                    else account['value']
+                current_accounts[value['key']['name']] = value
+            for account in service_accounts:
+                name = account['username']
+                # Roles are resolved when the change is applied so an
+                # unknown role only fails this account
+                args = (name, account['description'], account['roles'],
+                        account['status'])
+                existing = current_accounts.get(name)
+                if existing is None:
+                    actions.append(('service_accounts', 'add', name,
+                                    set_account, args))
+                    continue
+                wanted = (account['description'],
+                          statuses.get(account['status'], account['status']),
+                          {role_names.get(role, role)
+                           for role in account['roles']})
+                have = (existing.get('description', ''),
+                        existing.get('status'),
+                        {role_names.get(role, role) for role in
+                         existing.get('groups', {}).get('values', [])})
+                if wanted != have:
+                    actions.append(('service_accounts', 'update', name,
+                                    set_account, args))
+            if delete:
+                desired = {account['username'] for account in service_accounts}
+                for name in current_accounts:
+                    if name not in desired and name not in protected:
+                        actions.append(('service_accounts', 'delete', name,
+                                        self.svc_account_delete, (name,)))
+
+        for kind, action, name, _, _ in actions:
+            if not isinstance(name, list):
+                response[kind][action].append(name)
+        if dry_run or not actions:
+            return response
+        for (kind, action, name, _, _), _, error in self._run_concurrently(
+                lambda entry: entry[3](*entry[4]), actions, max_workers):
+            if error is not None:
+                response['failed'].append({'type': kind, 'name': name,
+                                           'action': action,
+                                           'error': str(error)})
+        return response
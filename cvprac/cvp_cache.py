@@ -0,0 +1,257 @@
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+''' Read-through cache for CVP GET responses
+
+A ResponseCache keeps the responses of GET requests whose URL matches one
+of its rules for the number of seconds given by the rule.  The least
+recently used entries are evicted once max_entries responses are cached.
+POST and DELETE requests are never cached.  Each of them, except the
+read-only POST requests such as Resource API GetAll queries, drops the
+cached responses of the resource family of its URL and of the related
+families, so a job reads its own writes.  A response fetched while its
+family was invalidated is returned but not cached.  A resource family is
+the first path segment of a URL, e.g. 'configlet' for
+/configlet/getConfigletByName.do, or the service of a Resource API or
+service API URL, e.g. 'resources/tag' for /api/resources/tag/v2/Tag/all.
+
+Example:
+    >>> cache = clnt.enable_cache()
+    >>> clnt.api.get_containers()
+    >>> clnt.api.get_containers()
+    >>> cache.stats()
+    {'hits': 1, 'misses': 1, 'evictions': 0, 'invalidations': 0,
+     'entries': 1}
+'''
+import re
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+# (URL regex, TTL in seconds) rules for the reads that are commonly
+# repeated within one job. The first matching rule applies.
+DEFAULT_CACHE_RULES = (
+    (r'^/cvpInfo/getCvpInfo\.do', 300),
+    (r'^/inventory/add/searchContainers\.do', 30),
+    (r'^/inventory/containers', 30),
+    (r'^/image/getImageBundles\.do', 60),
+    (r'^/role/getRoles\.do', 60),
+    (r'^/provisioning/(v3/)?searchTopology\.do', 10),
+    (r'^/configlet/getConfigletByName\.do', 10),
+)
+
+# POST requests that only read or validate and so do not invalidate
+# cached responses.
+DEFAULT_READ_ONLY_POSTS = (
+    r'^/api/resources/.+/all(\?|$)',
+    r'^/api/v3/services/[^/]+/Get\w*(\?|$)',
+    r'^/provisioning/(v2/)?validateAndCompareConfiglets\.do',
+    r'^/configlet/validateConfig\.do',
+    r'^/provisioning/checkCompliance\.do',
+    r'^/cvpservice/audit/getLogs\.do',
+)
+
+# Families whose cached responses change when another family is written.
+# Saving the topology for example changes the inventory, the configlet
+# mappings and the applied image bundles.
+DEFAULT_RELATED_FAMILIES = {
+    'provisioning': ('inventory', 'configlet', 'image', 'ztp'),
+    'configlet': ('provisioning',),
+    'inventory': ('provisioning', 'ztp'),
+    'image': ('provisioning',),
+    'task': ('provisioning', 'inventory'),
+    'user': ('role',),
+    'role': ('user',),
+}
+
+
+def resource_family(url):
+    ''' Returns the resource family of a request URL.
+
+        Args:
+            url (str): Portion of request URL that comes after the host.
+
+        Returns:
+            family (str): E.g. 'configlet' for /configlet/getConfiglets.do,
+                'resources/tag' for /api/resources/tag/v2/Tag and
+                'services/ccapi' for /api/v3/services/ccapi.ChangeControl/Get
+    '''
+    parts = [part for part in url.split('?', 1)[0].split('/') if part]
+    if len(parts) >= 3 and parts[:2] == ['api', 'resources']:
+        return f"resources/{parts[2]}"
+    if len(parts) >= 4 and parts[0] == 'api' and parts[2] == 'services':
+        return f"services/{parts[3].split('.')[0]}"
+    return parts[0] if parts else ''
+
+
+class ResponseCache():
+    ''' A thread safe, size bounded LRU cache of GET responses with per
+        endpoint TTLs.
+
+        Attributes:
+            hits (int): Number of GET requests answered from the cache.
+            misses (int): Number of cacheable GET requests sent to CVP.
+            evictions (int): Number of entries evicted to stay within
+                max_entries.
+            invalidations (int): Number of entries dropped by writes.
+    '''
+
+    def __init__(self, rules=DEFAULT_CACHE_RULES, max_entries=1024,
+                 related=None, read_only_posts=DEFAULT_READ_ONLY_POSTS):
+        ''' Initialize the cache.
+
+            Args:
+                rules (list): (URL regex, TTL in seconds) tuples matched
+                    against the request URL. The first matching rule
+                    applies and URLs that match no rule are not cached.
+                    Default is DEFAULT_CACHE_RULES.
+                max_entries (int): Maximum number of cached responses.
+                    Default is 1024.
+                related (dict): Per resource family the other families a
+                    write also invalidates. Default is None for
+                    DEFAULT_RELATED_FAMILIES.
+                read_only_posts (list): URL regexes of the POST requests
+                    that do not invalidate cached responses. Default is
+                    DEFAULT_READ_ONLY_POSTS.
+        '''
+        if max_entries < 1:
+            raise ValueError('max_entries must be a positive integer')
+        self.rules = [(re.compile(pattern), ttl) for pattern, ttl in rules]
+        self.max_entries = max_entries
+        self.related = DEFAULT_RELATED_FAMILIES if related is None \
+            else related
+        self.read_only_posts = [re.compile(pattern)
+                                for pattern in read_only_posts]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        # Bumped on every invalidation of a family and on clear() so a
+        # response fetched meanwhile is not cached
+        self._generations = {}
+        self._clear_generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ttl(self, url):
+        ''' Returns the TTL in seconds for a URL or 0 if it is not cached.
+        '''
+        for pattern, ttl in self.rules:
+            if pattern.search(url):
+                return ttl
+        return 0
+
+    def read_only(self, url):
+        ''' Returns True if a POST request to the URL does not change any
+            data and so does not invalidate cached responses.
+        '''
+        return any(pattern.search(url) for pattern in self.read_only_posts)
+
+    def _generation(self, family):
+        return self._clear_generation, self._generations.get(family, 0)
+
+    def get(self, url, fetch):
+        ''' Returns the cached response of a GET request or calls fetch and
+            caches its response. A copy is returned so callers can modify
+            the response without changing the cached one.
+
+            Args:
+                url (str): The request URL.
+                fetch (callable): Called without arguments to send the
+                    request on a miss.
+
+            Returns:
+                response: The response.
+        '''
+        ttl = self.ttl(url)
+        if ttl <= 0:
+            return fetch()
+        family = resource_family(url)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(url)
+                self.hits += 1
+                return deepcopy(entry[2])
+            self.misses += 1
+            generation = self._generation(family)
+        response = fetch()
+        with self._lock:
+            if self._generation(family) != generation:
+                # A write invalidated the family during the fetch so the
+                # response may predate it
+                return response
+            self._entries[url] = (time.monotonic() + ttl, family,
+                                  deepcopy(response))
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return response
+
+    def invalidate(self, url):
+        ''' Drop the cached responses of the resource family of a URL and
+            of its related families.
+
+            Args:
+                url (str): The URL of a POST or DELETE request.
+        '''
+        family = resource_family(url)
+        families = {family}.union(self.related.get(family, ()))
+        with self._lock:
+            for name in families:
+                self._generations[name] = self._generations.get(name, 0) + 1
+            stale = [key for key, entry in self._entries.items()
+                     if entry[1] in families]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        ''' Drop all cached responses.
+        '''
+        with self._lock:
+            self._clear_generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        ''' Returns the cache counters and the number of cached entries.
+        '''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations,
+                    'entries': len(self._entries)}
@@ -39,7 +39,8 @@ which can be used for building applications that work with Arista CVP.
 
 When the class is instantiated the logging is configured.  Either syslog,
 file logging, both, or none can be enabled.  If neither syslog nor filename is
-specified then no logging will be performed.
+specified then no logging will be performed.  With log_queue the syslog and
+file handlers run in a background thread so requests never wait on log I/O.
 
 This class supports creating a connection to a CVP node and then issuing
 subsequent GET and POST requests to CVP.  A GET or POST request will be
@@ -97,12 +98,15 @@ import os
 import re
 import json
 import logging
+import threading
 from logging.handlers import SysLogHandler
 from itertools import cycle
 from packaging.version import parse
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ( # pylint: disable=redefined-builtin
+    ChunkedEncodingError,
     ConnectionError,
     HTTPError,
     Timeout,
@@ -111,7 +115,10 @@ from requests.exceptions import ( # pylint: disable=redefined-builtin
     JSONDecodeError
 )
 
-from cvprac.cvp_api import CvpApi
+from cvprac.cvp_api import CvpApi, rfc3339_key
+from cvprac.cvp_cache import DEFAULT_CACHE_RULES, DEFAULT_READ_ONLY_POSTS, \
+    ResponseCache
+from cvprac.cvp_logging import queue_handlers
 from cvprac.cvp_client_errors import CvpApiError, CvpLoginError, \
     CvpRequestError, CvpSessionLogOutError
 
@@ -124,9 +131,12 @@ class CvpClient():
     # CVP node.
     NUM_RETRY_REQUESTS = 3
     LATEST_API_VERSION = 14.0
+    # Maximum number of connections kept open to a CVP node. Bulk API
+    # methods issue requests from several threads sharing one session.
+    MAX_POOL_SIZE = 32
 
     def __init__(self, logger='cvprac', syslog=False, filename=None,
-                 log_level='INFO'):
+                 log_level='INFO', log_queue=False):
         ''' Initialize the client and configure logging.  Either syslog, file
             logging, both, or none can be enabled.  If neither syslog
             nor filename is specified then no logging will be performed.
@@ -138,6 +148,10 @@ class CvpClient():
                 filename (str): Log to the file specified by filename. Default
                     is None.
                 log_level (str): Log level to use for logger. Default is INFO.
+                log_queue (bool): If True the syslog and file handlers are
+                    run by a background thread so logging calls do not wait
+                    for the I/O. Call stop_logging() before exiting to flush
+                    the pending records. Default is False.
         '''
         self.apiversion = None
         self.authdata = None
@@ -160,6 +174,13 @@ class CvpClient():
         self.version = None
         self._last_used_node = None
         self.proxies = None
+        self.cache = None
+        # Serializes session re-creation when requests are made from
+        # multiple threads. The generation is bumped on every new session
+        # so a thread that saw a stale session can tell whether another
+        # thread already replaced it.
+        self._session_lock = threading.RLock()
+        self._session_gen = 0
 
         # Save proper headers
         self.headers = {'Accept': 'application/json',
@@ -167,12 +188,21 @@ class CvpClient():
 
         self.log = logging.getLogger(logger)
         self.set_log_level(log_level)
+        self.log_listener = None
+        self._log_queue_handler = None
+        handlers = []
         if syslog:
             # Enables sending logging messages to the local syslog server.
-            self.log.addHandler(SysLogHandler())
+            handlers.append(SysLogHandler())
         if filename:
             # Enables sending logging messages to a file.
-            self.log.addHandler(logging.FileHandler(filename))
+            handlers.append(logging.FileHandler(filename))
+        if handlers and log_queue:
+            self._log_queue_handler, self.log_listener = \
+                queue_handlers(handlers)
+            handlers = [self._log_queue_handler]
+        for handler in handlers:
+            self.log.addHandler(handler)
         if syslog is False and filename is None:
             # Not logging so use the null handler
             self.log.addHandler(logging.NullHandler())
@@ -190,6 +220,20 @@ class CvpClient():
         '''
         return self._last_used_node
 
+    def stop_logging(self):
+        ''' Stop the background logging thread started with log_queue,
+            write the records it has not written yet and close the syslog
+            and file handlers.
+        '''
+        if self.log_listener is None:
+            return
+        self.log.removeHandler(self._log_queue_handler)
+        self.log_listener.stop()
+        for handler in self.log_listener.handlers:
+            handler.close()
+        self.log_listener = None
+        self._log_queue_handler = None
+
     def set_log_level(self, log_level='INFO'):
         ''' Set log level for logger. Defaults to INFO if no level passed in or
             if an invalid level is passed in.
@@ -352,6 +396,9 @@ class CvpClient():
         # pylint: disable=too-many-arguments
         if not isinstance(nodes, list):
             raise TypeError('nodes argument must be a list')
+        if self.cache is not None:
+            # Responses of another cluster or user must not be reused
+            self.cache.clear()
 
         for idx, _ in enumerate(nodes):
             if (os.environ.get('CURRENT_NODE_IP') and
@@ -400,50 +447,64 @@ class CvpClient():
         if not self.session:
             raise CvpLoginError(self.error_msg)
 
-    def _create_session(self, all_nodes=False):
+    def _create_session(self, all_nodes=False, session_gen=None):
         ''' Login to CVP and get a session ID and user information.
             If the all_nodes parameter is True then try creating a session
             with each CVP node.  If False, then try creating a session with
-            each node except the one currently connected to.
+            each node except the one currently connected to.  If session_gen
+            is given and another thread has created a new session since that
+            generation was read then the new session is kept as is.
         '''
         num_nodes = self.node_cnt
         if not all_nodes and num_nodes > 1:
             num_nodes -= 1
 
-        self.error_msg = '\n'
-        for _ in range(0, num_nodes):
-            host = next(self.node_pool)
-            self.url_prefix = f"https://{host}:{self.port or 443}/web"
-            self.url_prefix_short = f"https://{host}:{self.port or 443}"
-            error = self._reset_session()
-            if error is None:
-                break
-            self.error_msg += f"{host}: {error}\n"
-
-    def _reset_session(self):
+        with self._session_lock:
+            if session_gen is not None and session_gen != self._session_gen:
+                return
+            self.error_msg = '\n'
+            for _ in range(0, num_nodes):
+                host = next(self.node_pool)
+                self.url_prefix = f"https://{host}:{self.port or 443}/web"
+                self.url_prefix_short = f"https://{host}:{self.port or 443}"
+                error = self._reset_session()
+                if error is None:
+                    break
+                self.error_msg += f"{host}: {error}\n"
+
+    def _reset_session(self, session_gen=None):
         ''' Get a new request session and try logging into the current
             CVP node. If the login succeeded None will be returned and
             self.session will be valid. If the login failed then an
             exception error will be returned and self.session will
-            be set to None.
+            be set to None. If session_gen is given and another thread has
+            created a new session since that generation was read then
+            nothing is done and None is returned.
         '''
-        self.session = requests.Session()
-        if self.proxies:
-            self.session.proxies.update(self.proxies)
-        return_error = None
-        try:
-            self._login()
-        except (ConnectionError, CvpApiError, CvpRequestError,
-                CvpSessionLogOutError, HTTPError, ReadTimeout, Timeout,
-                TooManyRedirects) as error:
-            self.log.error(error)
-            # Use outer scope var for return to handle
-            # Python 3 UnboundLocalError
-            return_error = error
-            # Any error that occurs during login is a good reason not to use
-            # this CVP node.
-            self.session = None
-        return return_error
+        with self._session_lock:
+            if session_gen is not None and session_gen != self._session_gen:
+                return None
+            self._session_gen += 1
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=self.MAX_POOL_SIZE)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+            if self.proxies:
+                self.session.proxies.update(self.proxies)
+            return_error = None
+            try:
+                self._login()
+            except (ConnectionError, CvpApiError, CvpRequestError,
+                    CvpSessionLogOutError, HTTPError, ReadTimeout, Timeout,
+                    TooManyRedirects) as error:
+                self.log.error(error)
+                # Use outer scope var for return to handle
+                # Python 3 UnboundLocalError
+                return_error = error
+                # Any error that occurs during login is a good reason not to
+                # use this CVP node.
+                self.session = None
+            return return_error
 
     def _is_good_response(self, response, prefix):
         ''' Check for errors in a response from a GET or POST request.
@@ -584,14 +645,19 @@ class CvpClient():
         self._is_good_response(response, f"Authenticate: {url}")
 
         self.cookies = response.cookies
-        self.headers['APP_SESSION_ID'] = response.json()['sessionId']
+        # Rebind a new dict so concurrent requests never see it half updated
+        headers = dict(self.headers)
+        headers['APP_SESSION_ID'] = response.json()['sessionId']
+        self.headers = headers
 
     def _set_headers_api_token(self):
         ''' Sets headers with API token instead of making a call to login API.
         '''
         # If using an API token there is no need to run a Login API.
         # Simply add the token into the headers or cookies
-        self.headers['Authorization'] = f"Bearer {self.api_token}"
+        headers = dict(self.headers)
+        headers['Authorization'] = f"Bearer {self.api_token}"
+        self.headers = headers
         # Alternative to adding token to headers it can be added to
         # cookies as shown below.
         # self.cookies = {'access_token': self.api_token}
@@ -606,11 +672,33 @@ class CvpClient():
         # Verify that the generic request was successful
         self._is_good_response(response, f"Authenticate: {url}")
 
+    def enable_cache(self, rules=DEFAULT_CACHE_RULES, max_entries=1024,
+                     related=None, read_only_posts=DEFAULT_READ_ONLY_POSTS):
+        ''' Cache the responses of GET requests.  See ResponseCache for the
+            arguments.  DELETE requests and POST requests that are not
+            read-only drop the cached responses of the resource family they
+            write to.
+
+            Returns:
+                cache (ResponseCache): The cache. Its stats() method returns
+                    the hit and miss counters.
+        '''
+        self.cache = ResponseCache(rules, max_entries, related,
+                                   read_only_posts)
+        return self.cache
+
+    def disable_cache(self):
+        ''' Stop caching GET responses and drop the cached ones.
+        '''
+        self.cache = None
+
     def logout(self):
         '''
 
         :return:
         '''
+        if self.cache is not None:
+            self.cache.clear()
         response = self.post('/login/logout.do')
         if response['data'] == 'success':
             self.log.info('User logged out.')
@@ -620,7 +708,7 @@ class CvpClient():
             self.log.error(err)
 
     def _make_request(self, req_type, url, timeout, data=None,
-                      files=None):
+                      files=None, stream=False):
         ''' Make a GET, POST or DELETE request to CVP.  If the request call raises a
             timeout or CvpSessionLogOutError then the request will be retried
             on the same CVP node.  Otherwise the request will be tried on the
@@ -635,9 +723,12 @@ class CvpClient():
                     the request. Default is None.
                 files (dict): Dict of file name to files for upload. Currently
                     only used for adding images to CVP. Default is None.
+                stream (bool): If True the response object is returned
+                    without reading the body so it can be consumed
+                    incrementally. Default is False.
 
             Returns:
-                The JSON response.
+                The JSON response or the response object if stream is True.
 
             Raises:
                 ConnectionError: A ConnectionError is raised if there was a
@@ -677,6 +768,7 @@ class CvpClient():
         # Retry the request for the number of nodes.
         response = None
         for node_num in range(self.node_cnt):
+            session_gen = self._session_gen
             # Set full URL based on current node
             if '/api/' in url or '/cvpservice/' in url:
                 full_url = self.url_prefix_short + url
@@ -687,7 +779,7 @@ class CvpClient():
                 full_url = self.url_prefix + url
             try:
                 response = self._send_request(req_type, full_url, timeout,
-                                              data, files)
+                                              data, files, stream)
             except CvpApiError as error:
                 # If this is not an Unauthorized CvpApiError raise the error
                 # 'Unauthorized' is for 2018.x
@@ -698,8 +790,9 @@ class CvpClient():
                 # If this is the final CVP node raise error
                 if node_num + 1 == self.node_cnt:
                     raise error
-                # Create a new session to retry on another CVP node.
-                self._create_session()
+                # Create a new session to retry on another CVP node unless
+                # another thread already did.
+                self._create_session(session_gen=session_gen)
                 # Verify that we can connect to at least one node
                 # otherwise raise the last error
                 if not self.session:
@@ -710,8 +803,9 @@ class CvpClient():
                 # If this is the final CVP node raise error
                 if node_num + 1 == self.node_cnt:
                     raise error
-                # Create a new session to retry on another CVP node.
-                self._create_session()
+                # Create a new session to retry on another CVP node unless
+                # another thread already did.
+                self._create_session(session_gen=session_gen)
                 # Verify that we can connect to at least one node
                 # otherwise raise the last error
                 if not self.session:
@@ -724,6 +818,9 @@ class CvpClient():
                            req_type, url)
             return None
 
+        if stream:
+            return response
+
         # Added check for response.content being 'null' because of the
         # service account APIs being a special case /services/ API that
         # returns a null string for no objects instead of an empty string.
@@ -761,7 +858,7 @@ class CvpClient():
             raise error
 
     def _send_request(self, req_type, full_url, timeout, data=None,
-                      files=None):
+                      files=None, stream=False):
         ''' Make a GET, POST or DELETE request to CVP.  If the request call
             raises a timeout or CvpSessionLogOutError then the request will be
             retried on the same CVP node.  Otherwise the request will be tried
@@ -777,9 +874,12 @@ class CvpClient():
                     the request. Default is None.
                 files (dict): Dict of file name to files for upload. Currently
                     only used for adding images to CVP. Default is None.
+                stream (bool): If True the body of a successful response is
+                    not read or checked unless it is an HTML page. Default is
+                    False.
 
             Returns:
-                The JSON response.
+                The response object.
 
             Raises:
                 ConnectionError: A ConnectionError is raised if there was a
@@ -809,13 +909,15 @@ class CvpClient():
         # For get or post requests apply both the connect and read timeout.
         timeout = (self.connect_timeout, timeout)
         for req_try in range(self.NUM_RETRY_REQUESTS):
+            session_gen = self._session_gen
             try:
                 if req_type == 'GET':
                     response = self.session.get(full_url,
                                                 cookies=self.cookies,
                                                 headers=self.headers,
                                                 timeout=timeout,
-                                                verify=self.cert)
+                                                verify=self.cert,
+                                                stream=stream)
                 elif req_type == 'POST':
                     if files is None:
                         response = self.session.post(full_url,
@@ -823,7 +925,8 @@ class CvpClient():
                                                      data=json.dumps(data),
                                                      headers=self.headers,
                                                      timeout=timeout,
-                                                     verify=self.cert)
+                                                     verify=self.cert,
+                                                     stream=stream)
                     else:
                         fhs = {}
                         fhs['Accept'] = self.headers['Accept']
@@ -860,7 +963,13 @@ class CvpClient():
                 continue
 
             try:
-                self._is_good_response(response, f"{req_type}: {full_url} ")
+                # The body of a streamed response is consumed by the caller
+                # so it is only read and checked here if it is an error or
+                # an HTML page, e.g. the login page of an expired session.
+                if not stream or not response.ok or \
+                        'html' in response.headers.get('Content-Type', ''):
+                    self._is_good_response(response,
+                                           f"{req_type}: {full_url} ")
             except CvpSessionLogOutError as error:
                 self.log.debug(error)
                 # Retry the request to the same node if there was a CVP session
@@ -869,7 +978,7 @@ class CvpClient():
                 # be retried on the same node.
                 if req_try + 1 == self.NUM_RETRY_REQUESTS:
                     raise error
-                self._reset_session()
+                self._reset_session(session_gen)
                 if not self.session:
                     raise error
                 continue
@@ -887,7 +996,7 @@ class CvpClient():
                     # will be retried on the same node.
                     if req_try + 1 == self.NUM_RETRY_REQUESTS:
                         raise error
-                    self._reset_session()
+                    self._reset_session(session_gen)
                     if not self.session:
                         raise error
                     continue
@@ -929,6 +1038,9 @@ class CvpClient():
                     established to a CVP node.  Destroy the class and
                     re-instantiate.
         '''
+        if self.cache is not None:
+            return self.cache.get(
+                url, lambda: self._make_request('GET', url, timeout))
         return self._make_request('GET', url, timeout)
 
     def post(self, url, data=None, files=None, timeout=30):
@@ -969,7 +1081,12 @@ class CvpClient():
                     established to a CVP node.  Destroy the class and
                     re-instantiate.
         '''
-        return self._make_request('POST', url, timeout, data=data, files=files)
+        try:
+            return self._make_request('POST', url, timeout, data=data,
+                                      files=files)
+        finally:
+            if self.cache is not None and not self.cache.read_only(url):
+                self.cache.invalidate(url)
 
     def delete(self, url, data=None, timeout=30):
         ''' Make a DELETE request to CVP.  If the request call raises an error
@@ -1007,7 +1124,126 @@ class CvpClient():
                     established to a CVP node.  Destroy the class and
                     re-instantiate.
         '''
-        return self._make_request('DELETE', url, timeout, data=data)
+        try:
+            return self._make_request('DELETE', url, timeout, data=data)
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(url)
+
+    def stream(self, url, data=None, timeout=30):
+        ''' Make a streamed request to a Resource API GetAll endpoint and
+            yield the results as they are decoded instead of reading the
+            whole response first.
+
+            Args:
+                url (str): Portion of request URL that comes after the host.
+                    Ex: /api/resources/inventory/v1/Device/all
+                data (dict): Optional request body, e.g. a partialEqFilter.
+                    A POST request is made if provided, otherwise a GET.
+                timeout (int): Number of seconds the client will wait between
+                    bytes sent from the server.  Default value is 30 seconds.
+
+            Yields:
+                result (dict): The result of each entry with the 'time' and
+                    'value' keys.
+
+            Raises:
+                CvpApiError: A CvpApiError is raised if the stream returns an
+                    error.
+        '''
+        req_type = 'GET' if data is None else 'POST'
+        response = self._make_request(req_type, url, timeout, data=data,
+                                      stream=True)
+        if response is None:
+            return
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                entry = json.loads(line)
+                if 'error' in entry:
+                    msg = f"{req_type}: {url} : Stream Error: {entry['error']}"
+                    self.log.error(msg)
+                    raise CvpApiError(msg)
+                yield entry.get('result', entry)
+        finally:
+            response.close()
+
+    def subscribe(self, url, data=None, timeout=300, max_reconnects=5):
+        ''' Make a streamed request to a Resource API Subscribe endpoint and
+            yield the events as they arrive. If the stream breaks the request
+            is sent again, to another CVP node if the current one fails. The
+            new stream replays the current state, so after a reconnect any
+            event that is not newer than the last event seen for the same
+            resource key is skipped and the subscription resumes where it
+            stopped. Events of the first stream are never skipped.
+
+            Args:
+                url (str): Portion of request URL that comes after the host.
+                    Ex: /api/resources/changecontrol/v1/ChangeControl/subscribe
+                data (dict): Optional request body, e.g. a partialEqFilter.
+                    A POST request is made if provided, otherwise a GET.
+                timeout (int): Number of seconds the client will wait between
+                    bytes sent from the server.  Default value is 300 seconds.
+                max_reconnects (int): Maximum number of consecutive
+                    reconnect attempts without receiving an event before the
+                    last error is raised. Default is 5.
+
+            Yields:
+                event (dict): The result of each event with the 'type' key
+                    set to one of INITIAL, UPDATED, DELETED or
+                    INITIAL_SYNC_COMPLETE, the 'time' key and the 'value' key.
+
+            Raises:
+                CvpApiError: A CvpApiError is raised if the stream returns an
+                    error.
+                ConnectionError: A ConnectionError is raised if the stream
+                    could not be reestablished after max_reconnects attempts.
+        '''
+        req_type = 'GET' if data is None else 'POST'
+        last_times = {}
+        replaying = False
+        reconnects = 0
+        while True:
+            response = self._make_request(req_type, url, timeout, data=data,
+                                          stream=True)
+            if response is None:
+                return
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if 'error' in event:
+                        msg = f"{req_type}: {url} : Stream Error:" \
+                              f" {event['error']}"
+                        self.log.error(msg)
+                        raise CvpApiError(msg)
+                    result = event.get('result', event)
+                    event_time = rfc3339_key(result.get('time'))
+                    if event_time is not None:
+                        key = _event_key(result)
+                        last_time = last_times.get(key)
+                        if replaying and last_time is not None and \
+                                event_time <= last_time:
+                            continue
+                        if last_time is None or event_time > last_time:
+                            last_times[key] = event_time
+                    reconnects = 0
+                    yield result
+                return
+            except (ChunkedEncodingError, ConnectionError, ReadTimeout,
+                    Timeout) as error:
+                reconnects += 1
+                self.log.debug('Subscription to %s broke: %s', url, error)
+                if reconnects > max_reconnects:
+                    raise error
+                replaying = True
+                self._create_session(all_nodes=True)
+                if not self.session:
+                    raise error
+            finally:
+                response.close()
 
     def _finditem(self, obj, key):
         """ Find a key in a a nested list/dict.
@@ -1038,6 +1274,16 @@ class CvpClient():
         return item
 
 
+def _event_key(result):
+    ''' Return a hashable identifier of the resource a Subscribe event is
+        about, or None for events without a resource key.
+    '''
+    value = result.get('value')
+    if not isinstance(value, dict) or 'key' not in value:
+        return None
+    return json.dumps(value['key'], sort_keys=True)
+
+
 def json_decoder(data):
     ''' Check for ...
     '''
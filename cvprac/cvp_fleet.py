@@ -0,0 +1,240 @@
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+''' Fan-out manager for many CVP clusters and CVaaS tenants
+
+A CvpFleet holds one connected CvpClient per cluster, each with its own
+credentials and session or token.  The clients are logged in concurrently
+and a callable can be run against every cluster concurrently, so a fleet
+wide report takes as long as the slowest cluster instead of the sum of all
+of them.  Every result is tagged with its cluster name and a cluster that
+fails or does not finish within its timeout does not affect the others.
+
+Example:
+    >>> fleet = CvpFleet({
+    ...     'dc1': {'nodes': ['cvp1.dc1'], 'username': 'cvpadmin',
+    ...             'password': 'secret'},
+    ...     'tenant1': {'nodes': ['www.arista.io'], 'username': '',
+    ...                 'password': '', 'is_cvaas': True,
+    ...                 'api_token': 'token'}})
+    >>> fleet.connect(timeout=30)
+    >>> results = fleet.run(lambda clnt: len(clnt.api.get_inventory()),
+    ...                     timeout={'dc1': 60, 'tenant1': 120})
+    >>> results['dc1']
+    {'value': 312, 'error': None, 'duration': 4.2}
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from cvprac.cvp_client import CvpClient
+
+
+class CvpFleet():
+    ''' Manages a pool of CvpClient objects for many clusters.
+
+        Attributes:
+            clusters (dict): Per cluster name the keyword arguments for
+                CvpClient.connect.
+            clients (dict): Per cluster name the connected CvpClient.
+            errors (dict): Per cluster name the error of the last failed
+                connect.
+    '''
+
+    def __init__(self, clusters, max_workers=None, client_factory=None):
+        ''' Initialize the fleet.
+
+            Args:
+                clusters (dict): Per cluster name the keyword arguments for
+                    CvpClient.connect, e.g. nodes, username, password,
+                    api_token, is_cvaas and request_timeout.
+                max_workers (int): Maximum number of clusters handled
+                    concurrently. Default is None for all clusters at once.
+                client_factory (callable): Called with the cluster name to
+                    create the client of a cluster, e.g. to set a logger per
+                    cluster. Default is None to create a default CvpClient.
+        '''
+        self.clusters = dict(clusters)
+        self.max_workers = max_workers or max(len(self.clusters), 1)
+        self.client_factory = client_factory or (lambda name: CvpClient())
+        self.clients = {}
+        self.errors = {}
+
+    # Seconds between checks for clusters whose worker started while
+    # waiting for other clusters
+    START_POLL_INTERVAL = 0.05
+
+    def _fan_out(self, func, names, timeout, on_late=None):
+        ''' Call func with every cluster name concurrently. The timeout of
+            a cluster starts when its worker starts, so clusters queued
+            behind max_workers others are not timed out before they run.
+            If on_late is given it is called with the cluster name and the
+            value of every call that succeeds after its timeout.
+
+            Returns:
+                results (dict): Per cluster name the 'value', 'error' and
+                    'duration' in seconds.
+        '''
+        if not isinstance(timeout, dict):
+            timeout = dict.fromkeys(names, timeout)
+        started = {}
+        results = {}
+
+        def call(name):
+            call_start = time.time()
+            started[name] = call_start
+            try:
+                return func(name), None, time.time() - call_start
+            except Exception as error:  # pylint: disable=broad-except
+                return None, error, time.time() - call_start
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            pending = {executor.submit(call, name): name for name in names}
+            while pending:
+                now = time.time()
+                deadlines = {future: started[name] + timeout[name]
+                             for future, name in pending.items()
+                             if timeout.get(name) is not None and
+                             name in started}
+                for future, deadline in deadlines.items():
+                    if deadline <= now and not future.done():
+                        name = pending.pop(future)
+                        if on_late is not None:
+                            future.add_done_callback(
+                                lambda late, name=name: self._late_result(
+                                    late, name, on_late))
+                        results[name] = {
+                            'value': None, 'duration': now - started[name],
+                            'error': TimeoutError(
+                                f"{name} did not finish within"
+                                f" {timeout[name]} seconds")}
+                if not pending:
+                    break
+                wait_time = None
+                if deadlines:
+                    wait_time = max(0, min(deadlines.values()) - now)
+                if any(timeout.get(name) is not None and name not in started
+                       for name in pending.values()):
+                    # A queued cluster can start when a timed out one
+                    # finishes in the background, which wait() does not see
+                    wait_time = self.START_POLL_INTERVAL if wait_time is None \
+                        else min(wait_time, self.START_POLL_INTERVAL)
+                done, _ = wait(list(pending), timeout=wait_time,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    value, error, duration = future.result()
+                    results[name] = {'value': value, 'error': error,
+                                     'duration': duration}
+        finally:
+            # Requests that timed out cannot be interrupted. Their threads
+            # finish in the background.
+            executor.shutdown(wait=False)
+        return results
+
+    @staticmethod
+    def _late_result(future, name, on_late):
+        ''' Pass the value of a call that finished after its timeout to
+            on_late.
+        '''
+        value, error, _ = future.result()
+        if error is None:
+            on_late(name, value)
+
+    def connect(self, timeout=None):
+        ''' Log in to every cluster concurrently.
+
+            Args:
+                timeout (int|dict): Maximum number of seconds to wait for
+                    all clusters or per cluster name. Default is None for
+                    no limit.
+
+            Returns:
+                results (dict): Per cluster name the 'value' (the
+                    CvpClient or None), 'error' and 'duration' in seconds.
+                    A login that times out is logged out when it finishes
+                    in the background so its session is not left open.
+        '''
+        def login(name):
+            client = self.client_factory(name)
+            client.connect(**self.clusters[name])
+            return client
+
+        def abandon(_, client):
+            client.logout()
+
+        results = self._fan_out(login, list(self.clusters), timeout,
+                                on_late=abandon)
+        for name, result in results.items():
+            if result['error'] is None:
+                self.clients[name] = result['value']
+                self.errors.pop(name, None)
+            else:
+                self.clients.pop(name, None)
+                self.errors[name] = result['error']
+        return results
+
+    def run(self, func, timeout=None, clusters=None):
+        ''' Run func with the client of every connected cluster
+            concurrently.
+
+            Args:
+                func (callable): Called with the CvpClient of a cluster.
+                timeout (int|dict): Maximum number of seconds to wait for
+                    all clusters or per cluster name. Default is None for
+                    no limit.
+                clusters (list): Names of the clusters to run on. Default
+                    is None for all clusters.
+
+            Returns:
+                results (dict): Per cluster name the 'value' returned by
+                    func, the 'error' it raised and the 'duration' in
+                    seconds. Clusters that are not connected are reported
+                    with their connect error.
+        '''
+        if clusters is None:
+            clusters = list(self.clusters)
+        connected = [name for name in clusters if name in self.clients]
+        results = self._fan_out(lambda name: func(self.clients[name]),
+                                connected, timeout)
+        for name in clusters:
+            if name not in results:
+                results[name] = {'value': None, 'duration': 0.0,
+                                 'error': self.errors.get(name) or
+                                 KeyError(f"{name} is not connected")}
+        return results
+
+    def logout(self):
+        ''' Log out of every connected cluster concurrently.
+        '''
+        self._fan_out(lambda name: self.clients[name].logout(),
+                      list(self.clients), None)
+        self.clients = {}
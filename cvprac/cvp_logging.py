@@ -0,0 +1,91 @@
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+''' Logging helpers for cvprac
+
+cvprac passes its log arguments to the logger unformatted, so a message is
+only built when a handler will emit it.  Request and response payloads are
+wrapped in a LogPayload, which renders them lazily and caps their size at
+LOG_PAYLOAD_LIMIT characters.  Set LOG_PAYLOAD_LIMIT to 0 or None to log
+payloads in full.
+'''
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_PAYLOAD_LIMIT = 2048
+
+
+class LogPayload():
+    ''' A log argument that renders a payload only when the message is
+        emitted, truncated to limit characters.
+    '''
+    __slots__ = ('payload', 'limit')
+
+    def __init__(self, payload, limit=None):
+        ''' Initialize the payload.
+
+            Args:
+                payload (obj): The payload, e.g. a request body or a
+                    configuration string.
+                limit (int): Maximum number of characters to render.
+                    Default is None to use LOG_PAYLOAD_LIMIT.
+        '''
+        self.payload = payload
+        self.limit = limit
+
+    def __str__(self):
+        text = self.payload if isinstance(self.payload, str) \
+            else str(self.payload)
+        limit = LOG_PAYLOAD_LIMIT if self.limit is None else self.limit
+        if limit and len(text) > limit:
+            return f"{text[:limit]}... ({len(text) - limit} more characters)"
+        return text
+
+    __repr__ = __str__
+
+
+def queue_handlers(handlers):
+    ''' Move handlers behind a queue so logging calls do not block on
+        syslog or file I/O. The records are written by a background
+        QueueListener thread.
+
+        Args:
+            handlers (list): The handlers that do the I/O.
+
+        Returns:
+            (handler, listener): The QueueHandler to add to the logger and
+                the started QueueListener. Call listener.stop() to flush the
+                queue before exiting.
+    '''
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return QueueHandler(log_queue), listener
@@ -0,0 +1,235 @@
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+''' Compact record types for CVP devices and configlets
+
+get_inventory and search_topology return one dict per device and add a
+dozen legacy alias keys to each of them.  The records in this module store
+every field once in __slots__ and expose the alias names as read-only views
+of the field they duplicate, which makes large inventories several times
+smaller.  Records support the dict style access used with the legacy output
+(record['fqdn'], record.get('key'), 'mlagEnabled' in record) as well as
+attribute access, and to_dict() returns the legacy dict.
+
+Example:
+    >>> devices = clnt.api.get_inventory(as_records=True)
+    >>> devices[0].fqdn, devices[0]['parentContainerId']
+    ('leaf1.example.com', 'container_1')
+'''
+from operator import attrgetter
+
+_MISSING = object()
+
+
+class Record():
+    ''' Base class of the slotted records.
+
+        Subclasses list their fields in FIELDS, the legacy alias names of
+        fields in ALIASES and keys with a fixed value in CONSTANTS. Fields
+        that are not in the source dict are not set and keys that are not
+        known fields are kept in a per record dict.  Records built with
+        exact=True hide the aliases and constants the source dict did not
+        have, using a set shared by all records with the same keys.
+    '''
+    FIELDS = ()
+    ALIASES = {}
+    CONSTANTS = {}
+    _HIDDEN_SETS = {}
+    __slots__ = ('_extra', '_hidden')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+        for alias, field in cls.ALIASES.items():
+            setattr(cls, alias, property(attrgetter(field),
+                                         doc=f"Read-only alias of {field}"))
+
+    def __init__(self, **fields):
+        self._extra = None
+        self._hidden = None
+        for name, value in fields.items():
+            self[name] = value
+
+    @classmethod
+    def from_dict(cls, data, exact=False, **fields):
+        ''' Build a record from a dict returned by the CVP API.
+
+            Args:
+                data (dict): The API dict. Alias keys are stored in the
+                    field they duplicate.
+                exact (bool): Have exactly the keys of data, i.e. hide the
+                    aliases and constants that are not in data. Default is
+                    False to always provide all of them.
+                fields: Additional or overriding fields.
+
+            Returns:
+                record (obj): The record.
+        '''
+        record = cls()
+        aliases = []
+        for name, value in data.items():
+            if name in cls.ALIASES:
+                aliases.append((name, value))
+            else:
+                record[name] = value
+        for name, value in fields.items():
+            record[name] = value
+        if not exact:
+            for name, value in aliases:
+                field = cls.ALIASES[name]
+                if getattr(record, field, _MISSING) is _MISSING:
+                    object.__setattr__(record, field, value)
+            return record
+        hidden = {name for name in cls.CONSTANTS if name not in data}
+        hidden.update(name for name in cls.ALIASES if name not in data)
+        for name, value in aliases:
+            # An alias is only a view of its field if both have the same
+            # value, otherwise it is kept as a separate key
+            if getattr(record, cls.ALIASES[name], _MISSING) != value:
+                hidden.add(name)
+                record[name] = value
+        if hidden:
+            hidden = frozenset(hidden)
+            record._hidden = cls._HIDDEN_SETS.setdefault(hidden, hidden)
+        return record
+
+    def _lookup(self, name):
+        if name in self._FIELD_SET:
+            return getattr(self, name, _MISSING)
+        hidden = self._hidden is not None and name in self._hidden
+        field = self.ALIASES.get(name)
+        if field is not None and not hidden:
+            return getattr(self, field, _MISSING)
+        if self._extra is not None and name in self._extra:
+            return self._extra[name]
+        if hidden:
+            return _MISSING
+        return self.CONSTANTS.get(name, _MISSING)
+
+    def __getitem__(self, name):
+        value = self._lookup(name)
+        if value is _MISSING:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        if name in self.ALIASES and \
+                (self._hidden is None or name not in self._hidden):
+            raise TypeError(f"{name} is a read-only alias of"
+                            f" {self.ALIASES[name]}")
+        if name in self._FIELD_SET:
+            object.__setattr__(self, name, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[name] = value
+
+    def __contains__(self, name):
+        return self._lookup(name) is not _MISSING
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}"
+                           for name in self.FIELDS
+                           if getattr(self, name, _MISSING) is not _MISSING)
+        return f"{type(self).__name__}({fields})"
+
+    def get(self, name, default=None):
+        ''' Returns the value of a field, alias or extra key or default.
+        '''
+        value = self._lookup(name)
+        return default if value is _MISSING else value
+
+    def keys(self):
+        ''' Returns the names of all set fields, their aliases, the
+            constants and the extra keys.
+        '''
+        hidden = self._hidden or ()
+        names = [name for name in self.FIELDS
+                 if getattr(self, name, _MISSING) is not _MISSING]
+        present = set(names)
+        names.extend(alias for alias, field in self.ALIASES.items()
+                     if field in present and alias not in hidden)
+        names.extend(name for name in self.CONSTANTS
+                     if name not in hidden and
+                     (self._extra is None or name not in self._extra))
+        if self._extra is not None:
+            names.extend(self._extra)
+        return names
+
+    def to_dict(self):
+        ''' Returns the record as the legacy dict including the alias keys.
+            Records are not dict subclasses, so they are not drop-in
+            replacements where a real dict is required, e.g. json.dumps
+            needs to_dict() first.
+        '''
+        return {name: self[name] for name in self.keys()}
+
+
+class DeviceRecord(Record):
+    ''' A device as returned by get_inventory and search_topology.
+    '''
+    FIELDS = ('systemMacAddress', 'hostname', 'fqdn', 'serialNumber',
+              'ipAddress', 'modelName', 'version', 'internalVersion',
+              'internalBuild', 'hardwareRevision', 'domainName', 'status',
+              'complianceCode', 'complianceIndication', 'ztpMode',
+              'mlagEnabled', 'danzEnabled', 'parentContainerKey',
+              'containerName', 'bootupTimestamp', 'streamingStatus',
+              'deviceType', 'taskIdList', 'tempAction')
+    ALIASES = {'key': 'systemMacAddress',
+               'deviceInfo': 'status',
+               'deviceStatus': 'status',
+               'isMLAGEnabled': 'mlagEnabled',
+               'isDANZEnabled': 'danzEnabled',
+               'parentContainerId': 'parentContainerKey',
+               'bootupTimeStamp': 'bootupTimestamp',
+               'internalBuildId': 'internalBuild'}
+    CONSTANTS = {'memTotal': 0, 'memFree': 0, 'sslConfigAvailable': False,
+                 'sslEnabledByCVP': False, 'lastSyncUp': 0,
+                 'type': 'netelement', 'dcaKey': None}
+    __slots__ = FIELDS
+
+
+class ConfigletRecord(Record):
+    ''' A configlet as returned by get_configlets.
+    '''
+    FIELDS = ('key', 'name', 'config', 'reconciled', 'user', 'note',
+              'containerCount', 'netElementCount',
+              'dateTimeInLongFormat', 'isDefault', 'isAutoBuilder', 'type',
+              'editable', 'sslConfig', 'visible', 'isDraft',
+              'typeStudioConfiglet', 'factoryId', 'id')
+    __slots__ = FIELDS
@@ -0,0 +1,285 @@
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+''' Query layer for the CVP Resource APIs
+
+A Resource wraps one /api/resources/<service>/<version>/<Model> path and
+builds the GetOne, GetAll, GetSome and SetSome requests for it.  Filters are
+sent as partialEqFilter clauses so the server does the filtering, time and
+time range queries are expressed with datetimes and the batch calls are
+split into chunks that are sent concurrently.
+
+Example:
+    >>> tags = clnt.api.resource('tag/v2/Tag')
+    >>> tags.get_all(eq_filters({'key.elementType': 'ELEMENT_TYPE_DEVICE',
+    ...                          'key.label': ['role', 'pod']}))
+    >>> tags.get_one({'workspaceId': '', 'elementType': 'ELEMENT_TYPE_DEVICE',
+    ...               'label': 'role', 'value': 'spine'})
+    >>> clnt.api.resource('tag/v2/TagConfig').set_some(values)
+'''
+from copy import deepcopy
+from datetime import timezone
+from urllib.parse import urlencode
+
+from cvprac.cvp_logging import LogPayload
+
+
+def format_utc_time(value):
+    ''' Format a datetime as an RFC3339 UTC timestamp. Naive datetimes are
+        assumed to be UTC and strings are returned unchanged.
+    '''
+    if isinstance(value, str):
+        return value
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def eq_filters(criteria):
+    ''' Build the partialEqFilter clauses that match every combination of
+        the criteria values. Clauses of a partialEqFilter are OR'ed and the
+        fields of a clause are AND'ed.
+
+        Args:
+            criteria (dict): Field to value or list of values. Nested fields
+                are given as dotted names or as tuples of names. Fields with
+                a None value are ignored.
+                Ex: {'key.deviceId': ['SN1', 'SN2'],
+                     'streamingStatus': 'STREAMING_STATUS_ACTIVE'}
+
+        Returns:
+            filters (list): The clauses or an empty list for no filter.
+                Ex: [{'key': {'deviceId': 'SN1'},
+                      'streamingStatus': 'STREAMING_STATUS_ACTIVE'},
+                     {'key': {'deviceId': 'SN2'},
+                      'streamingStatus': 'STREAMING_STATUS_ACTIVE'}]
+    '''
+    filters = [{}]
+    for path, values in criteria.items():
+        if values is None:
+            continue
+        if isinstance(path, str):
+            path = path.split('.')
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        combined = []
+        for flt in filters:
+            for value in values:
+                clause = deepcopy(flt)
+                node = clause
+                for name in path[:-1]:
+                    node = node.setdefault(name, {})
+                node[path[-1]] = value
+                combined.append(clause)
+        filters = combined
+    return [] if filters == [{}] else filters
+
+
+def _query_params(key, prefix='key'):
+    ''' Flatten a nested key into dotted query parameters.
+    '''
+    params = []
+    for name, value in key.items():
+        if isinstance(value, dict):
+            params.extend(_query_params(value, f"{prefix}.{name}"))
+        else:
+            params.append((f"{prefix}.{name}", value))
+    return params
+
+
+class Resource():
+    ''' A Resource API model. Instances are created by CvpApi.resource().
+        Every request returns None on CVP versions older than 2021.2.0.
+    '''
+    # pylint: disable=protected-access
+
+    def __init__(self, api, path):
+        ''' Initialize the resource.
+
+            Args:
+                api (obj): The CvpApi object used for the requests.
+                path (str): The path of the model below /api/resources.
+                    Ex: tag/v2/Tag
+        '''
+        self.api = api
+        self.url = f"/api/resources/{path.strip('/')}"
+
+    def _supported(self):
+        msg = 'Resource APIs are supported from 2021.2.0 or newer.'
+        # For on-prem check the version as it is only supported from 2021.2.0+
+        return self.api.cvp_version_compare('>=', 6.0, msg)
+
+    def get_one(self, key, time=None):
+        ''' Get a single resource with GetOne.
+
+            Args:
+                key (dict): The key of the resource.
+                time (datetime|str): Get the resource as it was at this
+                    time. Default is None for the current state.
+
+            Returns:
+                result (dict): A dict with the 'value' and 'time' keys.
+        '''
+        if not self._supported():
+            return None
+        params = _query_params(key)
+        if time is not None:
+            params.append(('time', format_utc_time(time)))
+        url = f"{self.url}?{urlencode(params)}"
+        self.api.log.debug("v6 %s", url)
+        return self.api.clnt.get(url, timeout=self.api.request_timeout)
+
+    def _get_all_request(self, filters, start, end):
+        payload = {}
+        if filters:
+            payload['partialEqFilter'] = filters
+        if start is not None or end is not None:
+            payload['time'] = {}
+            if start is not None:
+                payload['time']['start'] = format_utc_time(start)
+            if end is not None:
+                payload['time']['end'] = format_utc_time(end)
+        self.api.log.debug("v6 %s/all %s", self.url, LogPayload(payload))
+        return payload or None
+
+    def get_all(self, filters=None, start=None, end=None):
+        ''' Get all resources that match any of the filters with GetAll.
+
+            Args:
+                filters (list): partialEqFilter clauses, see eq_filters.
+                    Default is None for all resources.
+                start (datetime|str): Start of the time range. With a start
+                    the states of the resources during the range are
+                    returned. Default is None.
+                end (datetime|str): End of the time range. Default is None.
+
+            Returns:
+                results (list): The result dicts with the 'value' and
+                    'time' keys.
+        '''
+        if not self._supported():
+            return None
+        payload = self._get_all_request(filters, start, end)
+        url = f"{self.url}/all"
+        if payload is None:
+            resp = self.api.clnt.get(url, timeout=self.api.request_timeout)
+        else:
+            resp = self.api.clnt.post(url, data=payload,
+                                      timeout=self.api.request_timeout)
+        return [entry.get('result', entry)
+                for entry in (resp or {}).get('data', [])]
+
+    def iter_all(self, filters=None, start=None, end=None):
+        ''' Same as get_all but the results are yielded as they are
+            decoded from the response stream.
+
+            Yields:
+                result (dict): A dict with the 'value' and 'time' keys.
+        '''
+        if not self._supported():
+            return
+        payload = self._get_all_request(filters, start, end)
+        yield from self.api.clnt.stream(f"{self.url}/all", data=payload,
+                                        timeout=self.api.request_timeout)
+
+    def get_some(self, keys, chunk_size=100, max_workers=4):
+        ''' Get many resources by key. Not every resource has a GetSome
+            endpoint, so the keys are split into chunks that are requested
+            concurrently as GetAll requests with one partialEqFilter clause
+            per key. A key without a resource is not reported.
+
+            Args:
+                keys (list): The keys of the resources.
+                chunk_size (int): Number of keys per request. Default is 100.
+                max_workers (int): Maximum number of concurrent requests.
+                    Default is 4.
+
+            Returns:
+                response (dict): A dict with the result dicts of the
+                    resources found, in chunk order, under 'results' and a
+                    list of dicts with the 'key' and 'error' of every key
+                    whose request failed under 'failed'.
+        '''
+        if not self._supported():
+            return None
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+        chunks = [keys[idx:idx + chunk_size]
+                  for idx in range(0, len(keys), chunk_size)]
+        results = [[] for _ in chunks]
+        response = {'results': [], 'failed': []}
+        for index, resp, error in self.api._run_concurrently(
+                lambda index: self.get_all(
+                    [{'key': key} for key in chunks[index]]),
+                range(len(chunks)), max_workers):
+            if error is not None:
+                response['failed'].extend({'key': key, 'error': str(error)}
+                                          for key in chunks[index])
+                continue
+            results[index] = resp
+        response['results'] = [result for chunk in results
+                               for result in chunk]
+        return response
+
+    def set(self, value):
+        ''' Set a single config resource with Set.
+
+            Args:
+                value (dict): The resource value including its 'key'.
+
+            Returns:
+                response (dict): A dict with the 'value' and 'time' keys.
+        '''
+        if not self._supported():
+            return None
+        self.api.log.debug("v6 %s %s", self.url, LogPayload(value))
+        return self.api.clnt.post(self.url, data=value,
+                                  timeout=self.api.request_timeout)
+
+    def set_some(self, values, chunk_size=500, max_workers=4):
+        ''' Set many config resources with SetSome in concurrent chunks.
+
+            Args:
+                values (list): The resource values including their 'key'.
+                chunk_size (int): Number of values per request.
+                    Default is 500.
+                max_workers (int): Maximum number of concurrent requests.
+                    Default is 4.
+
+            Returns:
+                response (dict): A dict with the list of keys that were set
+                    under 'succeeded' and a list of dicts with the 'key' and
+                    'error' of every value that was not set under 'failed'.
+        '''
+        if not self._supported():
+            return None
+        return self.api._resource_set_some(self.url, values, chunk_size,
+                                           max_workers)
@@ -0,0 +1,270 @@
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+''' Local index of CVP tag assignments
+
+The TagIndex answers tag queries such as "which devices carry role=spine" or
+"which tags does this interface carry" without scanning the Resource API
+responses again.  The mainline assignments are indexed once and the edits of
+a workspace are kept as an overlay, so the index shows the tags as they will
+be once the workspace is submitted.  The index can be kept up to date with
+the events of a Resource API subscription.
+
+Example:
+    >>> index = clnt.api.tag_index(workspace_id='ws1')
+    >>> index.elements('role', 'spine')
+    {('SN1', ''), ('SN2', '')}
+    >>> index.tags('SN1', 'Ethernet1')
+    {'lldp': {'on'}}
+    >>> for event in clnt.api.resource_subscribe(
+    ...         'tag/v2/TagAssignmentConfig',
+    ...         [{'key': {'workspaceId': 'ws1'}}]):
+    ...     index.update(event)
+'''
+
+
+class _TagLayer():
+    ''' A two way index of tag assignments.
+    '''
+
+    def __init__(self):
+        self.by_label = {}
+        self.by_element = {}
+
+    def add(self, label, value, element):
+        ''' Add an assignment.
+        '''
+        self.by_label.setdefault(label, {}).setdefault(value, set()).add(
+            element)
+        self.by_element.setdefault(element, {}).setdefault(label, set()).add(
+            value)
+
+    def discard(self, label, value, element):
+        ''' Remove an assignment if present and drop empty entries.
+        '''
+        elements = self.by_label.get(label, {}).get(value)
+        if elements is None or element not in elements:
+            return
+        elements.discard(element)
+        if not elements:
+            del self.by_label[label][value]
+            if not self.by_label[label]:
+                del self.by_label[label]
+        values = self.by_element[element][label]
+        values.discard(value)
+        if not values:
+            del self.by_element[element][label]
+            if not self.by_element[element]:
+                del self.by_element[element]
+
+    def elements(self, label, value):
+        ''' Returns the set of elements with the tag.
+        '''
+        return self.by_label.get(label, {}).get(value, set())
+
+    def values(self, label):
+        ''' Returns the dict of value to elements for a label.
+        '''
+        return self.by_label.get(label, {})
+
+    def tags(self, element):
+        ''' Returns the dict of label to values for an element.
+        '''
+        return self.by_element.get(element, {})
+
+
+class TagIndex():
+    ''' Index of tag assignments with an optional workspace overlay.
+
+        Elements are (device_id, interface_id) tuples with an empty
+        interface_id for device tags.
+
+        Attributes:
+            workspace_id (str): The workspace whose edits are overlaid or
+                None for mainline only.
+    '''
+
+    def __init__(self, assignments=(), edits=(), workspace_id=None):
+        ''' Initialize the index.
+
+            Args:
+                assignments (iterable): Mainline TagAssignment resource
+                    values or Resource API results that contain them.
+                edits (iterable): TagAssignmentConfig resource values or
+                    results of the workspace.
+                workspace_id (str): The ID of the workspace of the edits.
+                    Default is None.
+        '''
+        self.workspace_id = workspace_id
+        self._mainline = _TagLayer()
+        self._added = _TagLayer()
+        self._removed = _TagLayer()
+        for assignment in assignments:
+            self.update(assignment)
+        for edit in edits:
+            self.update(edit)
+
+    @classmethod
+    def from_api(cls, api, workspace_id=None,
+                 element_type='ELEMENT_TYPE_UNSPECIFIED'):
+        ''' Build the index with one request for the mainline assignments
+            and, if a workspace is given, one request for its edits.
+
+            Args:
+                api (obj): A CvpApi object.
+                workspace_id (str): Optional workspace ID whose tag
+                    assignment edits are overlaid. Default is None.
+                element_type (str): ELEMENT_TYPE_DEVICE,
+                    ELEMENT_TYPE_INTERFACE or ELEMENT_TYPE_UNSPECIFIED for
+                    both. Default is ELEMENT_TYPE_UNSPECIFIED.
+
+            Returns:
+                index (obj): A TagIndex.
+        '''
+        assignments = api.get_all_tag_assignments(element_type) or {}
+        edits = {}
+        if workspace_id:
+            edits = api.get_tag_assignment_edits(workspace_id) or {}
+        return cls(assignments.get('data', []), edits.get('data', []),
+                   workspace_id)
+
+    def update(self, event):
+        ''' Apply a TagAssignment or TagAssignmentConfig resource value,
+            Resource API result or subscription event. Mainline assignments
+            have an empty workspaceId. Edits of other workspaces are ignored.
+            A DELETED event removes a mainline assignment or discards a
+            workspace edit.
+
+            Args:
+                event (dict): The resource value, or a dict with the
+                    'value' and optional 'type' keys, optionally wrapped in
+                    a 'result' key.
+        '''
+        event = event.get('result', event)
+        value = event.get('value', event)
+        key = value['key']
+        label = key['label']
+        tag_value = key['value']
+        element = (key.get('deviceId', ''), key.get('interfaceId', ''))
+        deleted = event.get('type') == 'DELETED'
+        workspace_id = key.get('workspaceId', '')
+        if not workspace_id:
+            if deleted:
+                self._mainline.discard(label, tag_value, element)
+            else:
+                self._mainline.add(label, tag_value, element)
+            return
+        if workspace_id != self.workspace_id:
+            return
+        self._added.discard(label, tag_value, element)
+        self._removed.discard(label, tag_value, element)
+        if deleted:
+            return
+        if value.get('remove'):
+            self._removed.add(label, tag_value, element)
+        else:
+            self._added.add(label, tag_value, element)
+
+    def elements(self, label, value=None):
+        ''' Returns the elements carrying a tag.
+
+            Args:
+                label (str): The tag label.
+                value (str): The tag value or None for any value.
+
+            Returns:
+                elements (set): A set of (device_id, interface_id) tuples.
+        '''
+        if value is not None:
+            return (self._mainline.elements(label, value) |
+                    self._added.elements(label, value)) - \
+                self._removed.elements(label, value)
+        elements = set()
+        for tag_value in self.values(label):
+            elements |= self.elements(label, tag_value)
+        return elements
+
+    def devices(self, label, value=None):
+        ''' Returns the IDs of the devices carrying a device tag.
+
+            Args:
+                label (str): The tag label.
+                value (str): The tag value or None for any value.
+
+            Returns:
+                devices (set): A set of device IDs.
+        '''
+        return {device_id for device_id, interface_id
+                in self.elements(label, value) if not interface_id}
+
+    def values(self, label):
+        ''' Returns the values of a label that are assigned to at least one
+            element.
+
+            Args:
+                label (str): The tag label.
+
+            Returns:
+                values (set): A set of tag values.
+        '''
+        values = set(self._mainline.values(label)) | \
+            set(self._added.values(label))
+        return {tag_value for tag_value in values
+                if self.elements(label, tag_value)}
+
+    def labels(self):
+        ''' Returns the labels that are assigned to at least one element.
+        '''
+        labels = set(self._mainline.by_label) | set(self._added.by_label)
+        return {label for label in labels if self.values(label)}
+
+    def tags(self, device_id, interface_id=''):
+        ''' Returns the tags of an element.
+
+            Args:
+                device_id (str): The device serial number.
+                interface_id (str): The interface name or an empty string
+                    for the device tags. Default is ''.
+
+            Returns:
+                tags (dict): A dict of label to the set of values.
+        '''
+        element = (device_id, interface_id)
+        tags = {}
+        for layer in (self._mainline, self._added):
+            for label, values in layer.tags(element).items():
+                tags.setdefault(label, set()).update(values)
+        for label, values in self._removed.tags(element).items():
+            if label in tags:
+                tags[label] -= values
+                if not tags[label]:
+                    del tags[label]
+        return tags
@@ -0,0 +1,263 @@
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+''' In-memory model of the CVP provisioning topology
+
+The TopologyGraph holds the container tree, the devices, the configlets
+mapped to containers and devices and the image bundles applied to them.  It
+is built from a few bulk requests and resolves ancestor paths, subtree
+membership, the effective configlet order and the effective image bundle of
+a device locally in O(depth).
+
+Example:
+    >>> graph = clnt.api.topology_graph()
+    >>> graph.ancestors('00:1c:73:00:00:01')
+    ['root', 'container_1', 'container_7']
+    >>> graph.effective_configlets('00:1c:73:00:00:01', names=True)
+    ['base', 'dc1-leafs', 'leaf1-intf']
+    >>> graph.effective_image_bundle('00:1c:73:00:00:01')
+    {'key': 'imagebundle_1', 'name': 'EOS-4.28.3M'}
+'''
+
+
+class TopologyGraph():
+    ''' Container and device tree with configlet and image bundle mappings.
+
+        Attributes:
+            containers (dict): Container key to a dict with the 'name',
+                'parent' key and the 'containers' and 'devices' child keys.
+            devices (dict): Device key (system MAC address) to the device
+                dict from the topology with the 'parent' container key added.
+            configlets (dict): Configlet key to configlet name.
+    '''
+
+    def __init__(self, topology, configlet_mappers=(), configlets=(),
+                 container_bundles=None, device_bundles=None):
+        ''' Initialize the graph.
+
+            Args:
+                topology (dict): The 'topology' dict of a filter_topology
+                    response.
+                configlet_mappers (list): The 'configletMappers' list of a
+                    get_configlets_and_mappers response.
+                configlets (list): The 'configlets' list of a
+                    get_configlets_and_mappers response.
+                container_bundles (dict): Optional container key to the
+                    image bundle dict applied to the container.
+                device_bundles (dict): Optional device key to the image
+                    bundle dict applied directly to the device.
+        '''
+        self.containers = {}
+        self.devices = {}
+        self.configlets = {configlet['key']: configlet['name']
+                           for configlet in configlets}
+        self.container_bundles = container_bundles or {}
+        self.device_bundles = device_bundles or {}
+        self._mapped = {}
+        pending = [(topology, None)]
+        while pending:
+            node, parent = pending.pop()
+            key = node['key']
+            self.containers[key] = {'name': node.get('name'),
+                                    'parent': parent,
+                                    'containers': [], 'devices': []}
+            if parent is not None:
+                self.containers[parent]['containers'].append(key)
+            for device in node.get('childNetElementList', []):
+                device = dict(device, parent=key)
+                self.devices[device['key']] = device
+                self.containers[key]['devices'].append(device['key'])
+            for child in node.get('childContainerList', []):
+                pending.append((child, key))
+        ordered = sorted(configlet_mappers,
+                         key=lambda mapper: mapper.get('order', 0))
+        for mapper in ordered:
+            configlet_ids = self._mapped.setdefault(mapper['objectId'], [])
+            if mapper['configletId'] not in configlet_ids:
+                configlet_ids.append(mapper['configletId'])
+
+    @classmethod
+    def from_api(cls, api, images=True, max_workers=8):
+        ''' Build the graph with one topology request and one configlet
+            mapper request. If images is True the image bundles of the
+            containers are fetched concurrently, one request per container,
+            and the image bundles of the devices with one request for the
+            bundle list and one applied devices request per bundle.
+
+            Args:
+                api (obj): A CvpApi object.
+                images (bool): Fetch the container and device image
+                    bundles. Default is True.
+                max_workers (int): Maximum number of concurrent image bundle
+                    requests. Default is 8.
+
+            Returns:
+                graph (obj): A TopologyGraph.
+        '''
+        topology = api.filter_topology()['topology']
+        mappers = api.get_configlets_and_mappers()['data']
+        graph = cls(topology, mappers.get('configletMappers', []),
+                    mappers.get('configlets', []))
+        if images:
+            # pylint: disable=protected-access
+            for key, resp, error in api._run_concurrently(
+                    api.get_image_bundle_by_container_id, graph.containers,
+                    max_workers):
+                if error is not None:
+                    api.log.debug('Failed to get image bundle of %s: %s',
+                                  key, error)
+                    continue
+                bundles = resp.get('imageBundleList', []) if resp else []
+                if bundles:
+                    graph.container_bundles[key] = bundles[0]
+            graph._fill_device_bundles(api, max_workers)
+        return graph
+
+    def _fill_device_bundles(self, api, max_workers):
+        ''' Fill device_bundles from the applied devices of every image
+            bundle. Must run after container_bundles is filled.
+        '''
+        bundles = api.get_image_bundles().get('data', [])
+        bundles = [bundle for bundle in bundles
+                   if bundle.get('appliedDevicesCount', 1)]
+        applied = {}
+        # pylint: disable=protected-access
+        for bundle, resp, error in api._run_concurrently(
+                lambda bundle: api.get_image_bundle_applied_devices(
+                    bundle['key']), bundles, max_workers):
+            if error is not None:
+                api.log.debug('Failed to get devices of image bundle %s: %s',
+                              bundle.get('name'), error)
+                continue
+            for device in (resp or {}).get('data', []):
+                key = device.get('systemMacAddress') or device.get('key')
+                if key in self.devices:
+                    applied.setdefault(key, []).append(bundle)
+        for key, candidates in applied.items():
+            # A device may also be listed for the bundle it inherits from
+            # its container, the other bundle is the one applied directly.
+            inherited = self.effective_image_bundle(key) or {}
+            direct = [bundle for bundle in candidates
+                      if bundle['key'] != inherited.get('key')]
+            self.device_bundles[key] = (direct or candidates)[0]
+
+    def parent(self, key):
+        ''' Returns the parent container key of a container or device or
+            None for the root container.
+        '''
+        node = self.devices.get(key) or self.containers[key]
+        return node['parent']
+
+    def ancestors(self, key):
+        ''' Returns the container keys from the root down to the parent of
+            a container or device.
+        '''
+        path = []
+        parent = self.parent(key)
+        while parent is not None:
+            path.append(parent)
+            parent = self.containers[parent]['parent']
+        path.reverse()
+        return path
+
+    def in_subtree(self, key, container_key):
+        ''' Returns True if the container or device is below the container.
+        '''
+        parent = self.parent(key)
+        while parent is not None:
+            if parent == container_key:
+                return True
+            parent = self.containers[parent]['parent']
+        return False
+
+    def subtree_devices(self, container_key):
+        ''' Returns the keys of all devices below a container.
+        '''
+        devices = []
+        pending = [container_key]
+        while pending:
+            container = self.containers[pending.pop()]
+            devices.extend(container['devices'])
+            pending.extend(container['containers'])
+        return devices
+
+    def container_by_name(self, name):
+        ''' Returns the key of the container with the name or None.
+        '''
+        for key, container in self.containers.items():
+            if container['name'] == name:
+                return key
+        return None
+
+    def mapped_configlets(self, key):
+        ''' Returns the configlet keys mapped directly to a container or
+            device in order.
+        '''
+        return list(self._mapped.get(key, []))
+
+    def effective_configlets(self, key, names=False):
+        ''' Returns the configlets a device receives: the configlets of
+            every container from the root down followed by the configlets
+            of the device itself. A configlet mapped more than once is
+            listed at its first position.
+
+            Args:
+                key (str): The device key.
+                names (bool): Return configlet names instead of keys.
+                    Default is False.
+
+            Returns:
+                configlets (list): The configlet keys or names in order.
+        '''
+        effective = []
+        seen = set()
+        for node in self.ancestors(key) + [key]:
+            for configlet_id in self._mapped.get(node, []):
+                if configlet_id not in seen:
+                    seen.add(configlet_id)
+                    effective.append(configlet_id)
+        if names:
+            return [self.configlets.get(configlet_id, configlet_id)
+                    for configlet_id in effective]
+        return effective
+
+    def effective_image_bundle(self, key):
+        ''' Returns the image bundle applied to a device directly or else
+            the one of its closest ancestor container, or None.
+        '''
+        if key in self.device_bundles:
+            return self.device_bundles[key]
+        parent = self.parent(key)
+        while parent is not None:
+            if parent in self.container_bundles:
+                return self.container_bundles[parent]
+            parent = self.containers[parent]['parent']
+        return None
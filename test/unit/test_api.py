@@ -33,10 +33,21 @@
 
 """ Unit tests for the CvpAPI class
 """
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import time
 import unittest
+import zipfile
+from datetime import datetime, timedelta
 from itertools import cycle
+from unittest.mock import Mock
+from requests.exceptions import Timeout
 from cvprac.cvp_client import CvpClient
-from cvprac.cvp_api import CvpApi, sanitize_warnings
+from cvprac.cvp_api import CvpApi, sanitize_warnings, decode_compliance_code
+from cvprac.cvp_client_errors import CvpApiError, CvpRequestError
 
 
 class TestAPI(unittest.TestCase):
@@ -127,3 +138,946 @@ class TestAPI(unittest.TestCase):
         }
         # The result should not change
         self.assertEqual(sanitize_warnings(test_input), test_input)
+
+    def _mock_topology_posts(self):
+        """Mock clnt.post to record temp actions and return save results"""
+        posts = []
+
+        def post(url, data=None, timeout=30):
+            posts.append((url, data))
+            if 'saveTopology' in url:
+                return {'data': {'status': 'success', 'taskIds': ['1', '2']}}
+            return {'data': 'success'}
+        self.clnt.post = Mock(side_effect=post)
+        return posts
+
+    def test_topology_batch(self):
+        """Test temp actions are batched into chunks and a single save"""
+        posts = self._mock_topology_posts()
+        image = {'name': 'EOS', 'key': 'imagebundle_1'}
+        with self.api.topology_batch(chunk_size=2) as batch:
+            for idx in range(3):
+                dev = {'key': f"mac{idx}", 'fqdn': f"leaf{idx}"}
+                self.assertIsNone(
+                    self.api.apply_image_to_device(image, dev))
+            self.assertEqual(posts, [])
+            self.assertEqual(len(batch), 3)
+        urls = [url for url, _ in posts]
+        self.assertEqual(len(urls), 3)
+        self.assertIn('addTempAction', urls[0])
+        self.assertIn('addTempAction', urls[1])
+        self.assertIn('saveTopology', urls[2])
+        self.assertEqual(len(posts[0][1]['data']), 2)
+        self.assertEqual(len(posts[1][1]['data']), 1)
+        self.assertEqual(batch.task_ids, ['1', '2'])
+        self.assertIsNone(self.api._topology_batch)
+
+    def test_topology_batch_exception_discards(self):
+        """Test nothing is posted when the batch block raises"""
+        posts = self._mock_topology_posts()
+        image = {'name': 'EOS', 'key': 'imagebundle_1'}
+        with self.assertRaises(RuntimeError):
+            with self.api.topology_batch():
+                self.api.apply_image_to_device(
+                    image, {'key': 'mac0', 'fqdn': 'leaf0'})
+                raise RuntimeError('abort')
+        self.assertEqual(posts, [])
+        self.assertIsNone(self.api._topology_batch)
+
+    def test_topology_batch_per_thread(self):
+        """Test other threads are not captured by an open batch"""
+        posts = self._mock_topology_posts()
+        image = {'name': 'EOS', 'key': 'imagebundle_1'}
+        with self.api.topology_batch() as batch:
+            worker = threading.Thread(
+                target=self.api.apply_image_to_device,
+                args=(image, {'key': 'mac9', 'fqdn': 'leaf9'}))
+            worker.start()
+            worker.join()
+            self.assertEqual(len(batch), 0)
+            self.assertEqual(len(posts), 2)
+            self.assertIsNotNone(self.api._topology_batch)
+
+    def test_topology_batch_data_exists(self):
+        """Test chunk is retried per action when data already exists"""
+        posts = []
+
+        def post(url, data=None, timeout=30):
+            posts.append((url, data))
+            if 'addTempAction' in url and (len(data['data']) > 1 or
+                                           data['data'][0]['nodeId'] == 'mac0'):
+                raise CvpApiError('Data already exists')
+            return {'data': {'status': 'success', 'taskIds': []}}
+        self.clnt.post = Mock(side_effect=post)
+        with self.api.topology_batch():
+            for idx in range(2):
+                self.api.reset_device('app', {'key': f"mac{idx}",
+                                              'fqdn': f"leaf{idx}",
+                                              'parentContainerId': 'c1'})
+        # One failed chunk, two individual retries and the save
+        self.assertEqual(len(posts), 4)
+        self.assertIn('saveTopology', posts[-1][0])
+
+    def test_run_concurrently(self):
+        """Test concurrent helper returns every item with result or error"""
+        def func(item):
+            if item == 3:
+                raise CvpApiError('bad item')
+            return item * 2
+        results = {item: (result, error) for item, result, error in
+                   self.api._run_concurrently(func, iter(range(20)), 3)}
+        self.assertEqual(len(results), 20)
+        self.assertEqual(results[5], (10, None))
+        self.assertIsNone(results[3][0])
+        self.assertIsInstance(results[3][1], CvpApiError)
+
+    def test_validate_configlets_for_devices(self):
+        """Test fleet validation aggregates counts and errors"""
+        def validate(mac, keys, page_type='viewConfig'):
+            if mac == 'mac2':
+                raise CvpApiError('validation failed')
+            return {'mismatch': 1, 'reconcile': 0, 'new': len(keys),
+                    'total': 10, 'warnings': ['warn a at line 1', 'b',
+                                              'c at line 2'],
+                    'errors': [{'configletLineNo': 6, 'configletId': 'c1',
+                                'error': '% Invalid input'}]}
+        self.api.validate_configlets_for_device = Mock(side_effect=validate)
+        report = self.api.validate_configlets_for_devices(
+            {'mac0': ['c1'], 'mac1': ['c1', 'c2'], 'mac2': ['c1']})
+        self.assertEqual(report['total'], 3)
+        self.assertEqual(report['failed'], 1)
+        self.assertIn('mac2', report['failures'])
+        self.assertEqual(report['counts']['mismatch'], 2)
+        self.assertEqual(report['counts']['new'], 3)
+        self.assertEqual(report['counts']['warnings'], 4)
+        self.assertEqual(report['errors']['c1']['6']['count'], 2)
+        self.assertEqual(report['devices']['mac1']['warnings'],
+                         ['warn a at line 1', 'b, c at line 2'])
+
+    def test_validate_configlets_for_devices_report_file(self):
+        """Test fleet validation streams device results to a file"""
+        self.api.validate_configlets_for_device = Mock(
+            return_value={'mismatch': 0, 'reconcile': 0, 'new': 0})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'report.jsonl')
+            report = self.api.validate_configlets_for_devices(
+                ((f"mac{idx}", ['c1']) for idx in range(5)),
+                report_file=path)
+            with open(path, encoding='utf-8') as report_fh:
+                lines = [json.loads(line) for line in report_fh]
+        self.assertNotIn('devices', report)
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[0]['mismatch'], 0)
+
+    def test_export_device_configurations(self):
+        """Test configs are written to a directory and unchanged skipped"""
+        self.clnt.apiversion = 8.0
+        devices = [{'fqdn': f"leaf{idx}", 'systemMacAddress': f"mac{idx}"}
+                   for idx in range(3)]
+        configs = {'mac0': 'hostname leaf0', 'mac1': 'hostname leaf1'}
+
+        def get_config(mac):
+            if mac not in configs:
+                raise CvpApiError('no config')
+            return configs[mac]
+        self.api.get_device_configuration = Mock(side_effect=get_config)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            hash_file = os.path.join(tmpdir, 'hashes.json')
+            out_dir = os.path.join(tmpdir, 'configs')
+            resp = self.api.export_device_configurations(
+                out_dir, devices=devices, hash_file=hash_file)
+            self.assertEqual(resp['written'], 2)
+            self.assertIn('leaf2', resp['failed'])
+            with open(os.path.join(out_dir, 'leaf1.cfg'),
+                      encoding='utf-8') as cfg_fh:
+                self.assertEqual(cfg_fh.read(), 'hostname leaf1')
+            configs['mac1'] = 'hostname leaf1-new'
+            resp = self.api.export_device_configurations(
+                out_dir, devices=devices, hash_file=hash_file)
+            self.assertEqual(resp['written'], 1)
+            self.assertEqual(resp['unchanged'], 1)
+
+    def test_export_device_configurations_archive(self):
+        """Test configs at a timestamp are written to a tar archive"""
+        self.clnt.apiversion = 8.0
+        self.clnt.post = Mock(return_value=[{'config': 'hostname leaf0'}])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'configs.tar.gz')
+            resp = self.api.export_device_configurations(
+                path, devices=[{'fqdn': 'leaf0', 'serialNumber': 'SN0'}],
+                archive='tar.gz', timestamp='2021-11-19T15:04:05.0Z')
+            with tarfile.open(path) as tar_fh:
+                content = tar_fh.extractfile('leaf0.cfg').read()
+        self.assertEqual(resp['written'], 1)
+        self.assertEqual(content, b'hostname leaf0')
+        data = self.clnt.post.call_args[1]['data']
+        self.assertEqual(data['request']['device_id'], 'SN0')
+        with self.assertRaises(ValueError):
+            self.api.export_device_configurations(path, devices=[],
+                                                  archive='rar')
+
+    def test_export_device_configurations_archive_rerun(self):
+        """Test a second archive run still contains every config"""
+        self.clnt.apiversion = 8.0
+        devices = [{'fqdn': f"leaf{idx}", 'systemMacAddress': f"mac{idx}"}
+                   for idx in range(2)]
+        configs = {'mac0': 'hostname leaf0', 'mac1': 'hostname leaf1'}
+        self.api.get_device_configuration = Mock(side_effect=configs.get)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            hash_file = os.path.join(tmpdir, 'hashes.json')
+            path = os.path.join(tmpdir, 'configs.zip')
+            self.api.export_device_configurations(
+                path, devices=devices, archive='zip', hash_file=hash_file)
+            configs['mac1'] = 'hostname leaf1-new'
+            resp = self.api.export_device_configurations(
+                path, devices=devices, archive='zip', hash_file=hash_file)
+            with zipfile.ZipFile(path) as zip_fh:
+                names = sorted(zip_fh.namelist())
+                content = zip_fh.read('leaf1.cfg')
+            with open(hash_file, encoding='utf-8') as hash_fh:
+                hashes = json.load(hash_fh)
+        self.assertEqual(resp['written'], 2)
+        self.assertEqual(resp['unchanged'], 0)
+        self.assertEqual(names, ['leaf0.cfg', 'leaf1.cfg'])
+        self.assertEqual(content, b'hostname leaf1-new')
+        self.assertEqual(len(hashes), 2)
+
+    def test_wait_for_tasks(self):
+        """Test tasks that left Pending are fetched by ID and classified"""
+        polls = iter([[{'workOrderId': '1'}, {'workOrderId': '2'}],
+                      [{'workOrderId': '2'}], []])
+        tasks = {'1': iter(['Active', 'Completed']),
+                 '2': iter(['Failed']), '3': iter(['Cancelled'])}
+        self.api.get_tasks_by_status = Mock(side_effect=lambda status: next(
+            polls))
+
+        def by_id(task_id):
+            return {'workOrderId': task_id,
+                    'workOrderUserDefinedStatus': next(tasks[task_id])}
+        self.api.get_task_by_id = Mock(side_effect=by_id)
+        seen = []
+        resp = self.api.wait_for_tasks([1, 2, 3], interval=0,
+                                       callback=seen.append)
+        self.assertEqual(resp['completed'], {'1'})
+        self.assertEqual(resp['failed'], {'2'})
+        self.assertEqual(resp['cancelled'], {'3'})
+        self.assertEqual(resp['pending'], set())
+        self.assertEqual(set(resp['seen_after']), {'1', '2', '3'})
+        self.assertEqual(len(seen), 3)
+        # One Pending listing per cycle and only tasks no longer pending
+        # are fetched by ID: 3 first, then 1 twice and 2 once
+        self.assertEqual(self.api.get_tasks_by_status.call_count, 3)
+        self.assertEqual(
+            sorted(call[0][0] for call in
+                   self.api.get_task_by_id.call_args_list),
+            ['1', '1', '2', '3'])
+        self.api.get_tasks_by_status.assert_called_with('Pending')
+
+    def test_wait_for_tasks_timeout(self):
+        """Test tasks still pending at the timeout are returned"""
+        self.api.get_tasks_by_status = Mock(
+            return_value=[{'workOrderId': '1'}])
+        resp = self.api.wait_for_tasks(['1'], timeout=0)
+        self.assertEqual(resp['pending'], {'1'})
+        self.assertEqual(self.api.get_tasks_by_status.call_count, 1)
+
+    def test_resource_subscribe(self):
+        """Test resource subscription URL and filter"""
+        self.clnt.apiversion = 8.0
+        self.clnt.subscribe = Mock(return_value=iter([]))
+        self.api.resource_subscribe('changecontrol/v1/ChangeControl',
+                                    partial_eq_filter=[{'key': {'id': 'c'}}])
+        self.clnt.subscribe.assert_called_once_with(
+            '/api/resources/changecontrol/v1/ChangeControl/subscribe',
+            data={'partialEqFilter': [{'key': {'id': 'c'}}]}, timeout=300,
+            max_reconnects=5)
+
+    def test_iter_audit_logs(self):
+        """Test audit logs follow the lastRetrievedAudit cursor"""
+        pages = [{'data': [{'id': 1}, {'id': 2}]},
+                 {'data': [{'id': 3}, {'id': 4}]},
+                 {'data': [{'id': 5}]}]
+        self.clnt.post = Mock(side_effect=pages)
+        entries = list(self.api.iter_audit_logs('cc1', 'st1', page_size=2,
+                                                start_time=10))
+        self.assertEqual([entry['id'] for entry in entries], [1, 2, 3, 4, 5])
+        calls = [call[1]['data'] for call in self.clnt.post.call_args_list]
+        self.assertEqual(calls[0]['lastRetrievedAudit'], {})
+        self.assertEqual(calls[1]['lastRetrievedAudit'], {'id': 2})
+        self.assertEqual(calls[2]['lastRetrievedAudit'], {'id': 4})
+        self.assertEqual(calls[2]['startTime'], 10)
+        self.assertEqual(calls[2]['tags'], {'stageId': 'st1'})
+
+    def test_export_audit_logs(self):
+        """Test audit logs are exported to one file per target"""
+        def get_logs(cc_id, *args):
+            if cc_id == 'bad':
+                raise CvpApiError('not found')
+            return {'data': [{'cc': cc_id}]}
+        self.api.get_audit_logs_by_id = Mock(side_effect=get_logs)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            resp = self.api.export_audit_logs(
+                ['cc1', ('cc2', 'st1'), 'bad', ('cc2', 'st1'), ('cc1', None)],
+                tmpdir)
+            with open(os.path.join(tmpdir, 'cc2_st1.jsonl'),
+                      encoding='utf-8') as log_fh:
+                lines = [json.loads(line) for line in log_fh]
+        self.assertEqual(resp['written'], {'cc1.jsonl': 1,
+                                           'cc2_st1.jsonl': 1})
+        self.assertIn('bad.jsonl', resp['failed'])
+        self.assertEqual(lines, [{'cc': 'cc2'}])
+        # Repeated targets are exported once
+        self.assertEqual(self.api.get_audit_logs_by_id.call_count, 3)
+
+    def test_get_logs_by_ids(self):
+        """Test task logs are fetched once per change control stage"""
+        self.clnt.apiversion = 8.0
+        self.api.get_tasks = Mock(return_value={'data': [
+            {'workOrderId': '1', 'ccIdV2': 'cc1', 'stageId': 's1'},
+            {'workOrderId': '2', 'ccIdV2': 'cc1', 'stageId': 's1'},
+            {'workOrderId': '3', 'ccIdV2': 'cc1', 'stageId': 's2'},
+            {'workOrderId': '4', 'ccIdV2': ''},
+            {'workOrderId': '5', 'ccIdV2': 'cc9', 'stageId': 's1'}]})
+        self.api.get_audit_logs_by_id = Mock(
+            side_effect=lambda cc_id, stage_id, *args: {
+                'data': [{'stage': stage_id}]})
+        self.clnt.get = Mock(return_value={'data': [{'task': '4'}]})
+        logs = self.api.get_logs_by_ids([1, 2, 3, 4, 6])
+        self.assertEqual(logs['1'], [{'stage': 's1'}])
+        self.assertEqual(logs['2'], [{'stage': 's1'}])
+        self.assertEqual(logs['3'], [{'stage': 's2'}])
+        self.assertEqual(logs['4'], [{'task': '4'}])
+        self.assertIsNone(logs['6'])
+        self.assertNotIn('5', logs)
+        self.assertEqual(self.api.get_tasks.call_count, 1)
+        self.assertEqual(self.api.get_audit_logs_by_id.call_count, 2)
+
+    def test_plan_change_control_stages(self):
+        """Test stage planning respects the group and wave limits"""
+        tasks = [(str(idx), f"pair{idx // 2}") for idx in range(6)]
+        tasks += [(str(idx), 'pod') for idx in range(6, 9)] + ['9']
+        stages = self.api.plan_change_control_stages(tasks, max_parallel=4)
+        values = stages['values']
+        waves = [row['values'][0] for row in values['root']['rows']['values']]
+        # 10 tasks with 4 per wave and 3 tasks in 'pod' need 3 waves
+        self.assertEqual(len(waves), 3)
+        groups = dict(tasks[:-1])
+        scheduled = []
+        for wave in waves:
+            members = values[wave]['rows']['values'][0]['values']
+            self.assertLessEqual(len(members), 4)
+            ids = [values[m]['action']['args']['values']['TaskID']
+                   for m in members]
+            wave_groups = [groups[i] for i in ids if i in groups]
+            self.assertEqual(len(wave_groups), len(set(wave_groups)))
+            scheduled.extend(ids)
+        self.assertEqual(sorted(scheduled, key=int),
+                         [str(idx) for idx in range(10)])
+        self.api.validate_change_control_stages(stages)
+        with self.assertRaises(ValueError):
+            self.api.plan_change_control_stages(tasks, max_parallel=0)
+        stages = self.api.plan_change_control_stages([1, 2, ('3', 'pod')])
+        self.assertEqual(
+            stages['values']['wave1']['rows']['values'][0]['values'],
+            ['task-1', 'task-2', 'task-3'])
+        self.assertEqual(
+            stages['values']['task-1']['action']['args']['values'],
+            {'TaskID': '1'})
+
+    def test_validate_change_control_stages(self):
+        """Test local stage validation errors"""
+        def action(task_id):
+            return {'action': {'args': {'values': {'TaskID': task_id}}}}
+        cycle_stages = {'values': {
+            'root': {'rows': {'values': [{'values': ['a']}]}},
+            'a': {'rows': {'values': [{'values': ['root']}]}}}}
+        dangling = {'values': {
+            'root': {'rows': {'values': [{'values': ['a', 'b']}]}},
+            'a': action('1')}}
+        duplicate = {'values': {
+            'root': {'rows': {'values': [{'values': ['a', 'b']}]}},
+            'a': action('1'), 'b': action('1')}}
+        orphan = {'values': {
+            'root': {'rows': {'values': [{'values': ['a']}]}},
+            'a': action('1'), 'b': action('2')}}
+        for stages in (cycle_stages, dangling, duplicate, orphan,
+                       {'values': {}}):
+            with self.assertRaises(CvpRequestError):
+                self.api.validate_change_control_stages(stages)
+
+    def test_change_control_create_planned(self):
+        """Test planned change control is submitted in one request"""
+        self.clnt.apiversion = 8.0
+        self.clnt.post = Mock(return_value={'value': {}})
+        self.api.change_control_create_planned(
+            'cc1', 'upgrade', [('1', 'a'), ('2', 'a'), '3'], notes='n')
+        self.assertEqual(self.clnt.post.call_count, 1)
+        payload = self.clnt.post.call_args[1]['data']
+        self.assertEqual(payload['key'], {'id': 'cc1'})
+        self.assertEqual(payload['change']['notes'], 'n')
+        rows = payload['change']['stages']['values']['root']['rows']
+        self.assertEqual(len(rows['values']), 2)
+
+    def test_plan_upgrade_waves(self):
+        """Test upgrade waves respect MLAG and pod limits"""
+        devices = [f"SN{idx}" for idx in range(8)]
+        mlag = {dev: f"mlag{idx // 2}" for idx, dev in enumerate(devices)}
+        pods = {dev: f"pod{idx // 4}" for idx, dev in enumerate(devices)}
+        waves = self.api.plan_upgrade_waves(
+            devices, [(mlag, 1), (pods.get, 2)])
+        # 4 devices per pod with 2 per pod per wave need 2 waves
+        self.assertEqual(len(waves), 2)
+        self.assertEqual(sorted(sum(waves, [])), devices)
+        for wave in waves:
+            self.assertEqual(len({mlag[dev] for dev in wave}), len(wave))
+            self.assertLessEqual(
+                max(sum(pods[dev] == pod for dev in wave)
+                    for pod in ('pod0', 'pod1')), 2)
+        self.assertEqual(len(self.api.plan_upgrade_waves(
+            devices, [(mlag, 1)], max_parallel=3)), 3)
+        with self.assertRaises(ValueError):
+            self.api.plan_upgrade_waves(devices, [(mlag, 0)])
+
+    def test_upgrade_devices(self):
+        """Test upgrade applies images once and stages MLAG health checks"""
+        self.clnt.apiversion = 8.0
+        devices = [{'serialNumber': f"SN{idx}", 'systemMacAddress': f"mac{idx}",
+                    'key': f"mac{idx}", 'fqdn': f"leaf{idx}",
+                    'mlag': f"mlag{idx // 2}" if idx < 4 else None}
+                   for idx in range(5)]
+        posts = []
+
+        def post(url, data=None, timeout=30):
+            posts.append((url, data))
+            if 'saveTopology' in url:
+                return {'data': {'status': 'success',
+                                 'taskIds': ['10', '11', '12', '13']}}
+            return {'data': 'success'}
+        self.clnt.post = Mock(side_effect=post)
+        self.api.get_tasks_by_status = Mock(return_value=[
+            {'workOrderId': f"1{idx}",
+             'workOrderDetails': {'netElementId': f"mac{idx}"}}
+            for idx in range(4)] + [
+            {'workOrderId': '99', 'workOrderDetails': {'netElementId': 'x'}}])
+        resp = self.api.upgrade_devices(
+            {'name': 'EOS-4.30', 'key': 'bundle1'}, devices, cc_id='cc1',
+            mlag_domain='mlag')
+        urls = [url for url, _ in posts]
+        self.assertEqual(sum('saveTopology' in url for url in urls), 1)
+        self.assertEqual(resp['skipped'], ['SN4'])
+        self.assertEqual(resp['tasks']['SN3'], '13')
+        self.assertEqual(len(resp['waves']), 2)
+        for wave in resp['waves']:
+            self.assertEqual(len({int(dev[2:]) // 2 for dev in wave}),
+                             len(wave))
+        payload = posts[-1][1]
+        values = payload['change']['stages']['values']
+        rows = values['upgrade-SN0']['rows']['values']
+        self.assertEqual([row['values'][0] for row in rows],
+                         ['pre-check-SN0', 'task-10', 'post-check-SN0'])
+        self.assertEqual(values['pre-check-SN0']['action'],
+                         {'args': {'values': {'DeviceID': 'SN0'}},
+                          'name': 'mlaghealthcheck', 'timeout': 0})
+        self.assertIsNone(resp['monitor'])
+        with self.assertRaises(CvpRequestError):
+            self.api.upgrade_devices({'name': 'EOS'}, devices, start=True)
+
+    def test_change_control_monitor(self):
+        """Test monitor reports transitions and progress from one request"""
+        def cc_value(cc_id, status, stage_status, cc_time):
+            return {'result': {'time': cc_time, 'value': {
+                'key': {'id': cc_id}, 'status': status,
+                'change': {'name': cc_id, 'stages': {'values': {
+                    's1': {'name': 'stage 1', 'status': stage_status}}}}}}}
+        running = 'CHANGE_CONTROL_STATUS_RUNNING'
+        polls = [
+            {'data': [cc_value('cc1', running, 'STAGE_STATUS_RUNNING', 't1'),
+                      cc_value('cc2', running, 'STAGE_STATUS_RUNNING', 't1'),
+                      cc_value('other', running, None, 't1')]},
+            {'data': [cc_value('cc1', 'CHANGE_CONTROL_STATUS_COMPLETED',
+                               'STAGE_STATUS_COMPLETED', 't2'),
+                      cc_value('cc2', running, 'STAGE_STATUS_RUNNING', 't1')]},
+            {'data': [cc_value('cc2', running, 'STAGE_STATUS_RUNNING', 't3')
+                      ]}]
+        polls[2]['data'][0]['result']['value']['error'] = 'failed'
+        self.clnt.apiversion = 8.0
+        self.clnt.post = Mock(side_effect=polls)
+        monitor = self.api.change_control_monitor(['cc1', 'cc2'])
+        transitions = list(monitor.watch(interval=0))
+        self.assertEqual(self.clnt.post.call_count, 3)
+        self.assertEqual(self.clnt.post.call_args_list[0][0][0],
+                         '/api/resources/changecontrol/v1/ChangeControl/all')
+        # Finished Change Controls are no longer requested
+        self.assertEqual(
+            self.clnt.post.call_args_list[2][1]['data']['partialEqFilter'],
+            [{'key': {'id': 'cc2'}}])
+        stage_done = [trn for trn in transitions
+                      if trn['stage_id'] == 's1' and trn['cc_id'] == 'cc1'
+                      and trn['status'] == 'STAGE_STATUS_COMPLETED']
+        self.assertEqual(len(stage_done), 1)
+        self.assertEqual(stage_done[0]['previous'], 'STAGE_STATUS_RUNNING')
+        self.assertIsNotNone(stage_done[0]['duration'])
+        self.assertEqual(transitions[-1]['error'], 'failed')
+        progress = monitor.progress()
+        self.assertEqual(progress['completed'], 1)
+        self.assertEqual(progress['failed'], 1)
+        self.assertEqual(progress['percent'], 50.0)
+
+    def test_change_control_monitor_subscribe(self):
+        """Test monitor follows a subscription until all are finished"""
+        events = (event for event in [
+            {'type': 'INITIAL', 'value': {
+                'key': {'id': 'cc1'},
+                'status': 'CHANGE_CONTROL_STATUS_RUNNING'}},
+            {'type': 'UPDATED', 'value': {
+                'key': {'id': 'cc1'},
+                'status': 'CHANGE_CONTROL_STATUS_COMPLETED'}},
+            {'type': 'UPDATED', 'value': {'key': {'id': 'cc1'}}}])
+        self.api.resource_subscribe = Mock(return_value=events)
+        monitor = self.api.change_control_monitor(['cc1'])
+        transitions = list(monitor.watch(subscribe=True))
+        self.assertEqual([trn['status'] for trn in transitions],
+                         ['CHANGE_CONTROL_STATUS_RUNNING',
+                          'CHANGE_CONTROL_STATUS_COMPLETED'])
+        self.assertTrue(monitor.finished())
+        filters = self.api.resource_subscribe.call_args[1]
+        self.assertEqual(filters['partial_eq_filter'], [{'key': {'id': 'cc1'}}])
+
+    def test_change_control_monitor_subscribe_fallback(self):
+        """Test monitor polls when subscriptions are unsupported or quiet"""
+        completed = {'data': [{'result': {'time': 't1', 'value': {
+            'key': {'id': 'cc1'},
+            'status': 'CHANGE_CONTROL_STATUS_COMPLETED'}}}]}
+        self.clnt.apiversion = 8.0
+        self.clnt.post = Mock(return_value=completed)
+        self.api.resource_subscribe = Mock(return_value=None)
+        monitor = self.api.change_control_monitor(['cc1'])
+        transitions = list(monitor.watch(subscribe=True))
+        self.assertEqual(transitions[-1]['status'],
+                         'CHANGE_CONTROL_STATUS_COMPLETED')
+
+        def quiet_stream():
+            yield {'type': 'INITIAL', 'value': {
+                'key': {'id': 'cc1'},
+                'status': 'CHANGE_CONTROL_STATUS_RUNNING'}}
+            raise Timeout('read timed out')
+        self.api.resource_subscribe = Mock(return_value=quiet_stream())
+        self.clnt.post = Mock(return_value={'data': []})
+        monitor = self.api.change_control_monitor(['cc1'])
+        start = time.time()
+        transitions = list(monitor.watch(interval=0.01, max_interval=0.01,
+                                         timeout=0.1, subscribe=True))
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(len(transitions), 1)
+        self.assertFalse(monitor.finished())
+        kwargs = self.api.resource_subscribe.call_args[1]
+        self.assertEqual(kwargs['max_reconnects'], 0)
+        self.assertLessEqual(kwargs['timeout'], 1)
+
+    def test_tag_assignment_config_bulk(self):
+        """Test tag assignments are sent in concurrent chunks"""
+        self.clnt.apiversion = 8.0
+
+        def set_some(url, data=None, timeout=30):
+            keys = [value['key'] for value in data['values']]
+            if keys[0]['deviceId'] == 'SN4':
+                raise CvpApiError('chunk failed')
+            results = [{'key': key} for key in keys]
+            results[-1]['error'] = 'invalid interface'
+            return {'data': results}
+        self.clnt.post = Mock(side_effect=set_some)
+        assignments = [('rack', 'r1', f"SN{idx}", 'Ethernet1')
+                       for idx in range(5)]
+        assignments[0] = {'label': 'rack', 'value': 'r1', 'device_id': 'SN0',
+                          'interface_id': 'Ethernet1'}
+        resp = self.api.tag_assignment_config_bulk(
+            'ELEMENT_TYPE_INTERFACE', 'ws1', assignments, chunk_size=2)
+        self.assertEqual(self.clnt.post.call_count, 3)
+        url = self.clnt.post.call_args[0][0]
+        self.assertEqual(url, '/api/resources/tag/v2/TagAssignmentConfig/some')
+        self.assertEqual(sorted(key['deviceId'] for key in resp['succeeded']),
+                         ['SN0', 'SN2'])
+        self.assertEqual(sorted((fail['key']['deviceId'], fail['error'])
+                                for fail in resp['failed']),
+                         [('SN1', 'invalid interface'),
+                          ('SN3', 'invalid interface'),
+                          ('SN4', 'chunk failed')])
+
+    def test_tag_config_bulk(self):
+        """Test tag creation with a single object response"""
+        self.clnt.apiversion = 8.0
+        self.clnt.post = Mock(return_value={'key': {'label': 'a'}})
+        resp = self.api.tag_config_bulk('ELEMENT_TYPE_DEVICE', 'ws1',
+                                        [('a', '1')])
+        payload = self.clnt.post.call_args[1]['data']
+        self.assertEqual(payload['values'][0]['key']['value'], '1')
+        self.assertEqual(resp, {'succeeded': [{'label': 'a'}], 'failed': []})
+
+    def test_workspace_pipeline(self):
+        """Test a workspace is created, tagged, built and submitted"""
+        self.clnt.apiversion = 8.0
+        self.api.workspace_config = Mock()
+        self.api.tag_assignment_config_bulk = Mock(
+            return_value={'succeeded': [], 'failed': []})
+        builds = [CvpApiError('resource not found'),
+                  {'value': {'state': 'BUILD_STATE_IN_PROGRESS'}},
+                  {'value': {'state': 'BUILD_STATE_SUCCESS', 'buildResults': {
+                      'values': {'SN1': {
+                          'state': 'BUILD_STATE_SUCCESS',
+                          'configValidationResult': {
+                              'summary': {},
+                              'warnings': {'values': [{'id': 1}]}}}}}}}]
+        self.api.workspace_build_status = Mock(side_effect=builds)
+
+        def get_workspace(workspace_id):
+            request_id = self.api.workspace_config.call_args[1]['request_id']
+            return {'value': {'ccIds': {'values': ['cc1']}, 'responses': {
+                'values': {request_id: {
+                    'status': 'RESPONSE_STATUS_SUCCESS'}}}}}
+        self.api.get_workspace = Mock(side_effect=get_workspace)
+        resp = self.api.workspace_pipeline(
+            'ws1', 'ws1', tag_assignments=[
+                ('ELEMENT_TYPE_DEVICE', 'role', 'spine', 'SN1', '')],
+            interval=0)
+        self.assertEqual(resp['state'], 'submitted')
+        self.assertEqual(resp['build']['devices']['SN1']['warnings'],
+                         [{'id': 1}])
+        self.assertEqual(resp['submit']['cc_ids'], ['cc1'])
+        self.api.tag_assignment_config_bulk.assert_called_once_with(
+            'ELEMENT_TYPE_DEVICE', 'ws1', [('role', 'spine', 'SN1', '')])
+        requests = [call[1].get('request') for call in
+                    self.api.workspace_config.call_args_list]
+        self.assertEqual(requests, [None, 'REQUEST_START_BUILD',
+                                    'REQUEST_SUBMIT'])
+
+    def test_workspace_pipelines(self):
+        """Test workspace pipelines run concurrently with failures"""
+        self.clnt.apiversion = 8.0
+        self.api.workspace_config = Mock()
+        self.api.tag_config_bulk = Mock(return_value={
+            'succeeded': [], 'failed': [{'key': {}, 'error': 'bad'}]})
+        events = ({'value': {'state': state}} for state in
+                  ('BUILD_STATE_IN_PROGRESS', 'BUILD_STATE_FAIL'))
+        self.api.resource_subscribe = Mock(return_value=events)
+        resp = self.api.workspace_pipelines([
+            {'workspace_id': 'ws1', 'display_name': 'ws1',
+             'subscribe': True},
+            {'workspace_id': 'ws2', 'display_name': 'ws2',
+             'tags': [('ELEMENT_TYPE_DEVICE', 'role', 'spine')]}])
+        self.assertEqual(resp['ws1']['state'], 'build_failed')
+        self.assertEqual(resp['ws2']['state'], 'error')
+        self.assertIn('1 tag edits failed', resp['ws2']['error'])
+
+    def test_workspace_build_quiet_subscription(self):
+        """Test a build subscription that never emits falls back to polling"""
+        self.clnt.apiversion = 8.0
+
+        def events():
+            raise Timeout('read timed out')
+            yield  # pylint: disable=unreachable
+        self.api.resource_subscribe = Mock(return_value=events())
+        self.api.workspace_build_status = Mock(
+            return_value={'value': {'state': 'BUILD_STATE_SUCCESS'}})
+        value, finished = self.api._wait_for_workspace_build(
+            'ws1', 'b1', 60, 0, 5, True)
+        self.assertTrue(finished)
+        self.assertEqual(value['state'], 'BUILD_STATE_SUCCESS')
+        kwargs = self.api.resource_subscribe.call_args[1]
+        self.assertEqual(kwargs['max_reconnects'], 0)
+        self.assertLessEqual(kwargs['timeout'], 5)
+        self.api.workspace_build_status.assert_called_once_with('ws1', 'b1')
+
+    def test_svc_account_tokens_cleanup(self):
+        """Test tokens are selected by predicate and deleted concurrently"""
+        self.clnt.apiversion = 12.0
+
+        def token(token_id, valid_until, last_used, created_by, user):
+            return {'result': {'value': {
+                'key': {'id': token_id}, 'user': user,
+                'validUntil': valid_until, 'lastUsed': last_used,
+                'createdBy': created_by}}}
+        tokens = [token('t1', '2020-01-01T00:00:00Z', None, 'ci', 'svc1'),
+                  token('t2', '2020-01-01T00:00:00Z',
+                        '2019-06-01T00:00:00.123Z', 'admin', 'svc1'),
+                  token('t3', '2999-01-01T00:00:00Z', None, 'ci', 'svc2'),
+                  token('t4', '2020-01-01T00:00:00Z', None, 'ci', 'svc2')]
+        self.api.svc_account_token_get_all = Mock(return_value=tokens)
+
+        def delete(token_id):
+            if token_id == 't4':
+                raise CvpApiError('delete failed')
+            return [{'key': {'id': token_id}}]
+        self.api.svc_account_token_delete = Mock(side_effect=delete)
+        resp = self.api.svc_account_tokens_cleanup(expired=True,
+                                                   created_by='ci',
+                                                   dry_run=True)
+        self.assertEqual(sorted(resp), ['t1', 't4'])
+        self.assertEqual(resp['t1']['status'], 'dry_run')
+        self.api.svc_account_token_delete.assert_not_called()
+        resp = self.api.svc_account_tokens_cleanup(
+            unused_since=datetime(2019, 7, 1),
+            predicate=lambda tok: tok['user'] == 'svc1')
+        self.assertEqual(sorted(resp), ['t1', 't2'])
+        self.assertEqual(resp['t2']['status'], 'deleted')
+        resp = self.api.svc_account_tokens_cleanup(expired=True,
+                                                   user='svc2')
+        self.assertEqual(resp['t4']['status'], 'failed')
+        self.assertEqual(resp['t4']['error'], 'delete failed')
+        # The existing method still raises the first delete error
+        with self.assertRaises(CvpApiError):
+            self.api.svc_account_delete_expired_tokens()
+        self.api.svc_account_token_delete = Mock()
+        deleted = self.api.svc_account_delete_expired_tokens()
+        self.assertEqual(deleted, [tokens[0], tokens[1], tokens[3]])
+        with self.assertRaises(ValueError):
+            self.api.svc_account_tokens_cleanup()
+
+    def test_aaa_sync(self):
+        """Test AAA sync loads state once and applies only the diff"""
+        self.clnt.apiversion = 12.0
+        self.clnt.authdata = {'userId': 'alice'}
+        self.api.get_roles = Mock(return_value={'roles': [
+            {'key': 'network-admin', 'name': 'network-admin'},
+            {'key': 'role_1', 'name': 'ops'}]})
+        self.api.get_users = Mock(return_value={
+            'roles': {'alice': ['network-admin'], 'bob': ['ops'],
+                      'old': ['ops'], 'cvpadmin': ['network-admin']},
+            'users': [
+                {'userId': uid, 'firstName': 'f', 'lastName': 'l',
+                 'email': 'e', 'userStatus': 'Enabled', 'userType': 'Local'}
+                for uid in ('alice', 'bob', 'old', 'cvpadmin')] + [
+                {'userId': 'remote', 'firstName': 'f', 'lastName': 'l',
+                 'email': 'e', 'userStatus': 'Enabled',
+                 'userType': 'TACACS'}]})
+        self.api.svc_account_get_all = Mock(return_value=[
+            {'result': {'value': {'key': {'name': 'ci'},
+                                  'description': 'ci',
+                                  'status': 'ACCOUNT_STATUS_ENABLED',
+                                  'groups': {'values': ['role_1']}}}},
+            {'result': {'value': {'key': {'name': 'ci2'},
+                                  'description': 'ci',
+                                  'status': 'ACCOUNT_STATUS_ENABLED',
+                                  'groups': {'values': ['role_1']}}}}])
+        self.clnt.post = Mock(return_value={'data': 'success'})
+        self.clnt.delete = Mock(return_value={})
+
+        def user(name, role):
+            return {'username': name, 'role': role, 'status': 'Enabled',
+                    'first_name': 'f', 'last_name': 'l', 'email': 'e',
+                    'user_type': 'Local'}
+        users = [user('alice', 'network-admin'), user('bob', 'role_1'),
+                 user('carol', 'ops')]
+        users[0]['email'] = 'new'
+        accounts = [{'username': 'ci', 'description': 'ci',
+                     'roles': ['ops'], 'status': 1},
+                    {'username': 'ci3', 'description': 'ci',
+                     'roles': ['ops'], 'status': 1}]
+        resp = self.api.aaa_sync(users, accounts, delete=True, dry_run=True)
+        self.assertEqual(resp['users'], {'add': ['carol'],
+                                         'update': ['alice'],
+                                         'delete': ['old']})
+        self.assertEqual(resp['service_accounts'], {'add': ['ci3'],
+                                                    'update': [],
+                                                    'delete': ['ci2']})
+        self.clnt.post.assert_not_called()
+        resp = self.api.aaa_sync(users, accounts, delete=True)
+        self.assertEqual(resp['failed'], [])
+        urls = sorted(call[0][0] for call in self.clnt.post.call_args_list)
+        self.assertEqual(urls, [
+            '/api/resources/serviceaccount/v1/AccountConfig',
+            '/user/addUser.do', '/user/deleteUsers.do',
+            '/user/updateUser.do?userId=alice'])
+        self.clnt.delete.assert_called_once_with(
+            '/api/resources/serviceaccount/v1/AccountConfig?key.name=ci2')
+        # Roles are loaded once per sync and reused for service accounts
+        self.assertEqual(self.api.get_roles.call_count, 2)
+        # Updates without a password leave the password unchanged
+        update = [call[1]['data'] for call in self.clnt.post.call_args_list
+                  if 'updateUser' in call[0][0]][0]
+        self.assertNotIn('password', update['user'])
+        # Built-in accounts are only deleted when no longer protected
+        resp = self.api.aaa_sync(users, None, delete=True, dry_run=True,
+                                 protected=frozenset())
+        self.assertEqual(resp['users']['delete'], ['old', 'cvpadmin'])
+        # An unknown role fails only its own service account
+        self.clnt.post.reset_mock()
+        accounts.append({'username': 'ci4', 'description': 'ci',
+                         'roles': ['missing'], 'status': 1})
+        resp = self.api.aaa_sync(None, accounts, dry_run=True)
+        self.assertEqual(resp['service_accounts']['add'], ['ci3', 'ci4'])
+        resp = self.api.aaa_sync(None, accounts)
+        self.assertEqual([(entry['name'], entry['action'])
+                          for entry in resp['failed']], [('ci4', 'add')])
+        self.assertIn('missing', resp['failed'][0]['error'])
+        payload = self.clnt.post.call_args[1]['data']
+        self.assertEqual(payload['key'], {'name': 'ci3'})
+        self.assertEqual(payload['groups'], {'values': ['role_1']})
+
+    def test_device_decommissioning_bulk(self):
+        """Test bulk decommissioning is tracked with one status request"""
+        self.clnt.apiversion = 8.0
+        self.api.get_inventory = Mock(return_value=[
+            {'serialNumber': 'SN1'}, {'serialNumber': 'SN2'},
+            {'serialNumber': 'SN3'}])
+
+        def post(url, data=None, timeout=30):
+            if data['device_id'] == 'SN3':
+                raise CvpApiError('rejected')
+            return {'value': {'key': data['key']}}
+        self.clnt.post = Mock(side_effect=post)
+        statuses = iter(['DECOMMISSIONING_STATUS_IN_PROGRESS',
+                         'DECOMMISSIONING_STATUS_SUCCESS'])
+
+        def status_get_all():
+            status = next(statuses)
+            requests = {call[1]['data']['device_id']:
+                        call[1]['data']['key']['request_id']
+                        for call in self.clnt.post.call_args_list}
+            return {'data': [
+                {'result': {'value': {'key': {'requestId': requests['SN1']},
+                                      'status': status}}},
+                {'result': {'value': {
+                    'key': {'requestId': requests['SN2']},
+                    'status': 'DECOMMISSIONING_STATUS_FAILURE',
+                    'statusMessage': 'device still streaming'}}},
+                {'result': {'value': {'key': {'requestId': 'other'},
+                                      'status': 'x'}}}]}
+        self.api.device_decommissioning_status_get_all = Mock(
+            side_effect=status_get_all)
+        resp = self.api.device_decommissioning_bulk(
+            ['SN1', 'SN2', 'SN1', 'SN3', 'SN4'], interval=0)
+        self.assertEqual(self.api.get_inventory.call_count, 1)
+        # The duplicate SN1 is submitted once
+        self.assertEqual(self.clnt.post.call_count, 3)
+        self.assertEqual(
+            self.api.device_decommissioning_status_get_all.call_count, 2)
+        self.assertEqual(resp['SN1']['status'],
+                         'DECOMMISSIONING_STATUS_SUCCESS')
+        self.assertIsNotNone(resp['SN1']['duration'])
+        self.assertEqual(resp['SN2']['message'], 'device still streaming')
+        self.assertEqual(resp['SN3']['status'], 'SUBMIT_FAILED')
+        self.assertEqual(resp['SN4']['status'], 'NOT_FOUND')
+
+    def test_decode_compliance_code(self):
+        """Test compliance codes are decoded to flags"""
+        compliance = decode_compliance_code('0013')
+        self.assertFalse(compliance['in_sync'])
+        self.assertTrue(compliance['config'])
+        self.assertTrue(compliance['device_time'])
+        self.assertFalse(compliance['extensions'])
+        self.assertTrue(decode_compliance_code('0000')['in_sync'])
+        self.assertTrue(decode_compliance_code('0005')['unreachable'])
+        unknown = decode_compliance_code('0099')
+        self.assertFalse(unknown['in_sync'])
+        self.assertIn('Unknown', unknown['description'])
+
+    def test_compliance_sweep(self):
+        """Test paged compliance sweep with rechecks of stale devices"""
+        codes = ['0000', '0001', '0005', '0019', '0002']
+        devices = [{'systemMacAddress': f"mac{idx}", 'fqdn': f"dev{idx}",
+                    'complianceCode': code}
+                   for idx, code in enumerate(codes)]
+        self.clnt.get = Mock(side_effect=[
+            {'netElementList': devices[:2], 'total': 5},
+            {'netElementList': devices[2:4], 'total': 5},
+            {'netElementList': devices[4:], 'total': 5}])
+        self.api.get_container_by_name = Mock(
+            return_value={'key': 'container_1', 'name': 'DC1'})
+
+        def check(node_key, node_type):
+            if node_key == 'mac4':
+                raise CvpApiError('failed')
+            return {'complianceCode': '0000'}
+        self.api.check_compliance = Mock(side_effect=check)
+        resp = self.api.compliance_sweep('DC1', page_size=2, recheck=True)
+        self.assertEqual(self.clnt.get.call_count, 3)
+        self.assertIn('nodeId=container_1', self.clnt.get.call_args[0][0])
+        self.assertIn('startIndex=4&endIndex=6', self.clnt.get.call_args[0][0])
+        self.assertEqual(resp['rechecked'], 3)
+        self.assertIn('mac4', resp['recheck_failed'])
+        self.assertTrue(resp['devices']['mac1']['compliance']['in_sync'])
+        self.assertEqual(resp['summary']['total'], 5)
+        self.assertEqual(resp['summary']['in_sync'], 3)
+        self.assertEqual(resp['summary']['unreachable'], 1)
+        self.assertEqual(resp['summary']['image'], 1)
+
+    def test_iter_inventory(self):
+        """Test inventory records are projected and filtered server side"""
+        self.clnt.apiversion = 8.0
+        self.clnt.stream = Mock(return_value=iter([
+            {'value': {'key': {'deviceId': 'SN1'}, 'hostname': 'leaf1',
+                       'modelName': 'DCS-7050', 'softwareVersion': '4.30.1F',
+                       'streamingStatus': 'STREAMING_STATUS_ACTIVE'}},
+            {'value': {'key': {'deviceId': 'SN2'}, 'hostname': 'leaf2'}}]))
+        records = list(self.api.iter_inventory(
+            fields=('serialNumber', 'hostname', 'softwareVersion'),
+            model_names=['DCS-7050', 'DCS-7280'],
+            streaming_status='STREAMING_STATUS_ACTIVE'))
+        self.assertEqual([tuple(rec) for rec in records],
+                         [('SN1', 'leaf1', '4.30.1F'), ('SN2', 'leaf2', None)])
+        self.assertEqual(records[0].hostname, 'leaf1')
+        self.assertEqual(self.clnt.stream.call_args[0][0],
+                         '/api/resources/inventory/v1/Device/all')
+        self.assertEqual(
+            self.clnt.stream.call_args[1]['data']['partialEqFilter'],
+            [{'modelName': 'DCS-7050',
+              'streamingStatus': 'STREAMING_STATUS_ACTIVE'},
+             {'modelName': 'DCS-7280',
+              'streamingStatus': 'STREAMING_STATUS_ACTIVE'}])
+        with self.assertRaises(ValueError):
+            list(self.api.iter_inventory(fields=('bogus',)))
+
+    def test_get_events(self):
+        """Test event filters and time bounds are sent to the server"""
+        self.clnt.apiversion = 8.0
+        self.clnt.post = Mock(return_value={'data': [
+            {'result': {'value': {'key': {'timestamp': 't1'}}}}]})
+        events = self.api.get_events(
+            datetime(2023, 1, 1), '2023-01-02T00:00:00Z',
+            severity=['EVENT_SEVERITY_ERROR', 'EVENT_SEVERITY_CRITICAL'],
+            event_type='LOW_MEMORY')
+        self.assertEqual(events, [{'key': {'timestamp': 't1'}}])
+        payload = self.clnt.post.call_args[1]['data']
+        self.assertEqual(payload['time'],
+                         {'start': '2023-01-01T00:00:00.000000Z',
+                          'end': '2023-01-02T00:00:00Z'})
+        self.assertEqual(payload['partialEqFilter'], [
+            {'severity': 'EVENT_SEVERITY_ERROR', 'eventType': 'LOW_MEMORY'},
+            {'severity': 'EVENT_SEVERITY_CRITICAL',
+             'eventType': 'LOW_MEMORY'}])
+
+    def test_iter_events(self):
+        """Test windowed events are merged in order across splits"""
+        self.clnt.apiversion = 8.0
+        start = datetime(2023, 1, 1)
+        stamps = [start + timedelta(seconds=10 * idx) for idx in range(361)]
+        timed_out = []
+
+        def post(url, data=None, timeout=30):
+            w_start = datetime.strptime(data['time']['start'],
+                                        '%Y-%m-%dT%H:%M:%S.%fZ')
+            w_end = datetime.strptime(data['time']['end'],
+                                      '%Y-%m-%dT%H:%M:%S.%fZ')
+            if w_start == start and not timed_out:
+                timed_out.append(w_end)
+                raise Timeout('read timeout')
+            # Keep the worker busy so later windows are still queued when
+            # the first results arrive
+            time.sleep(0.005)
+            # Return the events out of order with inclusive bounds
+            return {'data': [
+                {'result': {'value': {'key': {'timestamp': stamp.strftime(
+                    '%Y-%m-%dT%H:%M:%SZ')}}}}
+                for stamp in reversed(stamps) if w_start <= stamp <= w_end]}
+        self.clnt.post = Mock(side_effect=post)
+        events = list(self.api.iter_events(
+            start, start + timedelta(hours=1), windows=4, target_events=50,
+            max_workers=1))
+        self.assertEqual([event['key']['timestamp'] for event in events],
+                         [stamp.strftime('%Y-%m-%dT%H:%M:%SZ')
+                          for stamp in stamps])
+        # 4 windows, 2 halves of the timed out window and the dense queued
+        # windows split further
+        self.assertGreater(self.clnt.post.call_count, 6)
+        with self.assertRaises(ValueError):
+            list(self.api.iter_events(start, start, windows=0))
@@ -0,0 +1,168 @@
+# pylint: disable=wrong-import-position,line-too-long
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+""" Unit tests for the ResponseCache class
+"""
+import unittest
+from unittest.mock import Mock, patch
+from cvprac import cvp_cache
+from cvprac.cvp_cache import ResponseCache, resource_family
+from cvprac.cvp_client import CvpClient
+
+
+class TestResponseCache(unittest.TestCase):
+    """ Unit test cases for ResponseCache
+    """
+
+    def test_resource_family(self):
+        """ Test URLs are mapped to their resource family
+        """
+        self.assertEqual(resource_family('/configlet/getConfigletByName.do'
+                                         '?name=a/b'), 'configlet')
+        self.assertEqual(resource_family('/api/resources/tag/v2/Tag/all'),
+                         'resources/tag')
+        self.assertEqual(
+            resource_family('/api/v3/services/ccapi.ChangeControl/Update'),
+            'services/ccapi')
+
+    def test_ttl_and_copies(self):
+        """ Test entries expire after their TTL and hits return copies
+        """
+        cache = ResponseCache(rules=[(r'^/image/', 10)])
+        fetch = Mock(side_effect=lambda: {'data': [1]})
+        with patch.object(cvp_cache.time, 'monotonic', return_value=100):
+            first = cache.get('/image/getImageBundles.do', fetch)
+            first['data'].append(2)
+            self.assertEqual(cache.get('/image/getImageBundles.do', fetch),
+                             {'data': [1]})
+            # URLs without a rule are never cached
+            cache.get('/task/getTasks.do', fetch)
+            cache.get('/task/getTasks.do', fetch)
+        with patch.object(cvp_cache.time, 'monotonic', return_value=111):
+            cache.get('/image/getImageBundles.do', fetch)
+        self.assertEqual(fetch.call_count, 4)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2,
+                                         'evictions': 0, 'invalidations': 0,
+                                         'entries': 1})
+
+    def test_lru_eviction(self):
+        """ Test the least recently used entry is evicted
+        """
+        cache = ResponseCache(rules=[('.', 60)], max_entries=2)
+        for url in ('/a/1', '/a/2', '/a/1', '/a/3'):
+            cache.get(url, lambda: url)
+        self.assertEqual(cache.evictions, 1)
+        fetch = Mock(return_value='new')
+        self.assertEqual(cache.get('/a/1', fetch), '/a/1')
+        self.assertEqual(cache.get('/a/2', fetch), 'new')
+        with self.assertRaises(ValueError):
+            ResponseCache(max_entries=0)
+
+    def test_invalidate_during_fetch(self):
+        """ Test a response fetched while its family is invalidated is
+            returned but not cached
+        """
+        cache = ResponseCache(rules=[('.', 60)])
+
+        def fetch_with_write():
+            # A concurrent POST finishes while the GET is in flight
+            cache.invalidate('/provisioning/v2/saveTopology.do')
+            return 'stale'
+        self.assertEqual(cache.get('/inventory/containers', fetch_with_write),
+                         'stale')
+        self.assertEqual(len(cache), 0)
+
+        def fetch_with_clear():
+            cache.clear()
+            return 'stale'
+        cache.get('/image/getImageBundles.do', fetch_with_clear)
+        self.assertEqual(len(cache), 0)
+        # Writes to unrelated families do not prevent caching
+        cache.get('/image/getImageBundles.do',
+                  lambda: cache.invalidate('/user/addUser.do') or 'fresh')
+        self.assertEqual(cache.get('/image/getImageBundles.do', Mock()),
+                         'fresh')
+
+    def test_read_only_posts(self):
+        """ Test read-only POST requests do not invalidate the cache
+        """
+        cache = ResponseCache()
+        for url in ('/api/resources/inventory/v1/Device/all',
+                    '/api/v3/services/arista.serviceaccount.v1.TokenService'
+                    '/GetAll',
+                    '/provisioning/v2/validateAndCompareConfiglets.do',
+                    '/provisioning/checkCompliance.do'):
+            self.assertTrue(cache.read_only(url), url)
+        for url in ('/provisioning/v2/saveTopology.do',
+                    '/api/resources/tag/v2/TagConfig',
+                    '/api/resources/tag/v2/TagConfig/some'):
+            self.assertFalse(cache.read_only(url), url)
+        clnt = CvpClient()
+        clnt.apiversion = 8.0
+        clnt._make_request = Mock(side_effect=lambda req_type, url, timeout,
+                                  **kwargs: {'data': [url]})
+        clnt.enable_cache()
+        clnt.api.get_image_bundles()
+        clnt.post('/provisioning/checkCompliance.do', data={})
+        clnt.post('/api/resources/inventory/v1/Device/all', data={})
+        clnt.api.get_image_bundles()
+        self.assertEqual(clnt.cache.stats()['hits'], 1)
+        self.assertEqual(clnt.cache.invalidations, 0)
+
+    def test_client_cache(self):
+        """ Test repeated reads are served from the cache and writes
+            invalidate the related families
+        """
+        clnt = CvpClient()
+        clnt.apiversion = 8.0
+        clnt._make_request = Mock(side_effect=lambda req_type, url, timeout,
+                                  **kwargs: {'data': [url]})
+        cache = clnt.enable_cache()
+        clnt.api.get_image_bundles()
+        clnt.api.get_image_bundles()
+        clnt.api.get_roles()
+        self.assertEqual(clnt._make_request.call_count, 2)
+        clnt.post('/provisioning/v2/saveTopology.do', data={'data': []})
+        clnt.api.get_image_bundles()
+        clnt.api.get_roles()
+        self.assertEqual(clnt._make_request.call_count, 4)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.invalidations, 1)
+        clnt.disable_cache()
+        clnt.api.get_roles()
+        self.assertEqual(clnt._make_request.call_count, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
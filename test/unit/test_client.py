@@ -34,10 +34,12 @@
 ''' Unit tests for the CvpClient class
 '''
 import json
+import threading
 import unittest
 from itertools import cycle
 from unittest.mock import Mock
-from requests.exceptions import HTTPError, ReadTimeout, JSONDecodeError
+from requests.exceptions import HTTPError, ReadTimeout, JSONDecodeError, \
+    ChunkedEncodingError
 from cvprac.cvp_client import CvpClient
 from cvprac.cvp_client_errors import CvpApiError, CvpSessionLogOutError
 
@@ -200,6 +202,25 @@ class TestClient(unittest.TestCase):
         self.assertEqual(self.clnt.url_prefix, url)
         self.assertEqual(self.clnt.error_msg, error)
 
+    def test_reset_session_once_per_generation(self):
+        """ Test concurrent workers that saw the same expired session only
+            log in again once.
+        """
+        self.clnt._login = Mock()
+        session_gen = self.clnt._session_gen
+        workers = [threading.Thread(target=self.clnt._reset_session,
+                                    args=(session_gen,))
+                   for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.clnt._login.call_count, 1)
+        self.assertEqual(self.clnt._session_gen, session_gen + 1)
+        self.clnt._reset_session = Mock()
+        self.clnt._create_session(session_gen=session_gen)
+        self.clnt._reset_session.assert_not_called()
+
     def test_make_request_good(self):
         """ Test request does not raise exception and returns json.
         """
@@ -220,6 +241,22 @@ class TestClient(unittest.TestCase):
         request_return_value.json.assert_called_once_with()
         self.assertEqual(self.clnt.last_used_node, '1.1.1.1')
 
+    def test_send_request_stream_logged_out(self):
+        """ Test a streamed request checks an HTML response and logs in
+            again instead of returning the login page as the stream.
+        """
+        login_page = Mock(ok=True, headers={'Content-Type': 'text/html'},
+                          text='<html>LOG OUT MESSAGE</html>')
+        good = Mock(ok=True, headers={'Content-Type': 'application/json'})
+        self.clnt.session = Mock()
+        self.clnt.session.get.side_effect = [login_page, good]
+        self.clnt._reset_session = Mock(return_value=None)
+        self.clnt.NUM_RETRY_REQUESTS = 2
+        self.clnt.connect_timeout = 2
+        resp = self.clnt._send_request('GET', 'url', 2, stream=True)
+        self.assertIs(resp, good)
+        self.clnt._reset_session.assert_called_once_with(0)
+
     def test_make_request_no_response(self):
         """ Test handling of response being empty.
         """
@@ -600,6 +637,108 @@ class TestClient(unittest.TestCase):
         value = self.clnt._finditem(testobj, 'nestobjkey2')
         self.assertEqual(value, 'nestobjval2')
 
+    def test_stream(self):
+        """ Test stream yields GetAll results and raises stream errors.
+        """
+        response = Mock()
+        response.iter_lines.return_value = iter([
+            json.dumps({'result': {'value': {'a': 1}}}).encode(), b'',
+            json.dumps({'result': {'value': {'a': 2}}}).encode(),
+            json.dumps({'error': {'code': 5}}).encode()])
+        self.clnt._make_request = Mock(return_value=response)
+        results = self.clnt.stream('/api/resources/x/v1/X/all')
+        self.assertEqual(next(results), {'value': {'a': 1}})
+        self.assertEqual(next(results), {'value': {'a': 2}})
+        with self.assertRaises(CvpApiError):
+            next(results)
+        self.assertEqual(self.clnt._make_request.call_args[0][0], 'GET')
+        response.close.assert_called_once_with()
+
+    def test_subscribe_resume(self):
+        """ Test subscribe yields events and skips already seen events
+            after reconnecting.
+        """
+        def event(ev_type, ev_time, key):
+            return json.dumps({'result': {'type': ev_type, 'time': ev_time,
+                                          'value': {'key': key}}}).encode()
+
+        def broken_stream():
+            yield event('INITIAL', '2022-01-01T00:00:00.1Z', 'a')
+            yield b''
+            yield event('UPDATED', '2022-01-01T00:00:01Z', 'a')
+            raise ChunkedEncodingError('connection broken')
+
+        first = Mock()
+        first.iter_lines.return_value = broken_stream()
+        second = Mock()
+        second.iter_lines.return_value = iter([
+            event('INITIAL', '2022-01-01T00:00:00.100Z', 'a'),
+            event('UPDATED', '2022-01-01T00:00:01Z', 'a'),
+            event('DELETED', '2022-01-01T00:00:01.5Z', 'a')])
+        self.clnt.session = Mock()
+        self.clnt._make_request = Mock(side_effect=[first, second])
+        self.clnt._create_session = Mock()
+        events = list(self.clnt.subscribe('/api/resources/x/v1/X/subscribe',
+                                          data={'partialEqFilter': []}))
+        self.assertEqual([evt['type'] for evt in events],
+                         ['INITIAL', 'UPDATED', 'DELETED'])
+        self.clnt._create_session.assert_called_once_with(all_nodes=True)
+        self.assertEqual(self.clnt._make_request.call_args[0][0], 'POST')
+        self.assertTrue(self.clnt._make_request.call_args[1]['stream'])
+        first.close.assert_called_once_with()
+        second.close.assert_called_once_with()
+
+    def test_subscribe_resume_per_key(self):
+        """ Test subscribe keeps unordered INITIAL events and events with
+            equal times, and only skips replayed events per resource key.
+        """
+        def event(ev_type, second, key):
+            return json.dumps({'result': {
+                'type': ev_type, 'time': f"2022-01-01T00:00:0{second}Z",
+                'value': {'key': {'id': key}}}}).encode()
+
+        def broken_stream():
+            yield event('INITIAL', 2, 'a')
+            yield event('INITIAL', 1, 'b')
+            yield event('INITIAL', 3, 'c')
+            yield event('UPDATED', 3, 'd')
+            raise ChunkedEncodingError('connection broken')
+
+        first = Mock()
+        first.iter_lines.return_value = broken_stream()
+        second = Mock()
+        second.iter_lines.return_value = iter([
+            event('INITIAL', 3, 'd'),
+            event('INITIAL', 1, 'b'),
+            event('INITIAL', 2, 'a'),
+            event('INITIAL', 3, 'c'),
+            event('INITIAL', 2, 'e'),
+            event('UPDATED', 5, 'b')])
+        self.clnt.session = Mock()
+        self.clnt._make_request = Mock(side_effect=[first, second])
+        self.clnt._create_session = Mock()
+        events = list(self.clnt.subscribe('url'))
+        self.assertEqual([evt['value']['key']['id'] for evt in events],
+                         ['a', 'b', 'c', 'd', 'e', 'b'])
+        self.assertEqual(events[-1]['type'], 'UPDATED')
+
+    def test_subscribe_error(self):
+        """ Test subscribe raises stream errors and gives up after the
+            maximum number of reconnects.
+        """
+        response = Mock()
+        response.iter_lines.return_value = iter(
+            [json.dumps({'error': {'code': 5}}).encode()])
+        self.clnt._make_request = Mock(return_value=response)
+        with self.assertRaises(CvpApiError):
+            list(self.clnt.subscribe('url'))
+        response.iter_lines.side_effect = ReadTimeout('Timeout')
+        self.clnt.session = Mock()
+        self.clnt._create_session = Mock()
+        with self.assertRaises(ReadTimeout):
+            list(self.clnt.subscribe('url', max_reconnects=2))
+        self.assertEqual(self.clnt._create_session.call_count, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
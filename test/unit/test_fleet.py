@@ -0,0 +1,167 @@
+# pylint: disable=wrong-import-position,line-too-long
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+""" Unit tests for the CvpFleet class
+"""
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+from cvprac.cvp_client_errors import CvpLoginError
+from cvprac.cvp_fleet import CvpFleet
+
+
+class TestCvpFleet(unittest.TestCase):
+    """ Unit test cases for CvpFleet
+    """
+
+    def setUp(self):
+        """ Build a fleet with mocked clients
+        """
+        self.clients = {}
+
+        def factory(name):
+            client = Mock()
+            client.name = name
+            if name == 'bad':
+                client.connect.side_effect = CvpLoginError('login failed')
+            self.clients[name] = client
+            return client
+        self.fleet = CvpFleet({name: {'nodes': [name], 'username': 'u',
+                                      'password': 'p'}
+                               for name in ('dc1', 'dc2', 'bad')},
+                              client_factory=factory)
+
+    def test_connect(self):
+        """ Test clusters log in concurrently and failures are kept
+        """
+        results = self.fleet.connect()
+        self.assertEqual(sorted(self.fleet.clients), ['dc1', 'dc2'])
+        self.assertIsInstance(results['bad']['error'], CvpLoginError)
+        self.assertIsInstance(self.fleet.errors['bad'], CvpLoginError)
+        self.clients['dc1'].connect.assert_called_once_with(
+            nodes=['dc1'], username='u', password='p')
+
+    def test_connect_timeout_logout(self):
+        """ Test a login that finishes after its timeout is logged out
+        """
+        release = threading.Event()
+        logged_out = threading.Event()
+        self.fleet.clusters.pop('bad')
+        factory = self.fleet.client_factory
+
+        def slow_factory(name):
+            client = factory(name)
+            if name == 'dc2':
+                client.connect.side_effect = lambda **_: release.wait(5)
+                client.logout.side_effect = logged_out.set
+            return client
+        self.fleet.client_factory = slow_factory
+        results = self.fleet.connect(timeout={'dc1': None, 'dc2': 0.1})
+        self.assertIsInstance(results['dc2']['error'], TimeoutError)
+        self.assertEqual(sorted(self.fleet.clients), ['dc1'])
+        self.clients['dc2'].logout.assert_not_called()
+        release.set()
+        self.assertTrue(logged_out.wait(5))
+        self.clients['dc1'].logout.assert_not_called()
+
+    def test_run_concurrent(self):
+        """ Test the callable runs on every cluster at the same time
+        """
+        self.fleet.connect()
+        barrier = threading.Barrier(2, timeout=5)
+
+        def func(client):
+            # Both clusters must be running for the barrier to release
+            barrier.wait()
+            return client.name.upper()
+        results = self.fleet.run(func)
+        self.assertEqual(results['dc1']['value'], 'DC1')
+        self.assertEqual(results['dc2']['value'], 'DC2')
+        self.assertIsInstance(results['bad']['error'], CvpLoginError)
+
+    def test_run_timeout(self):
+        """ Test a slow cluster times out without delaying the others
+        """
+        self.fleet.connect()
+        release = threading.Event()
+
+        def func(client):
+            if client.name == 'dc2':
+                release.wait(5)
+                return 'late'
+            if client.name == 'dc1':
+                raise ValueError('query failed')
+            return 'ok'
+        start = time.time()
+        results = self.fleet.run(func, timeout={'dc1': None, 'dc2': 0.1},
+                                 clusters=['dc1', 'dc2'])
+        release.set()
+        self.assertLess(time.time() - start, 2)
+        self.assertIsInstance(results['dc1']['error'], ValueError)
+        self.assertIsInstance(results['dc2']['error'], TimeoutError)
+        self.assertEqual(sorted(results), ['dc1', 'dc2'])
+
+    def test_run_timeout_queued(self):
+        """ Test the timeout of a queued cluster starts with its worker
+        """
+        self.fleet.connect()
+        self.fleet.max_workers = 1
+
+        def func(client):
+            time.sleep(0.2)
+            return client.name
+        results = self.fleet.run(func, timeout=0.5, clusters=['dc1', 'dc2'])
+        self.assertEqual(results['dc1']['value'], 'dc1')
+        self.assertEqual(results['dc2']['value'], 'dc2')
+
+        def slow(client):
+            time.sleep(0.3 if client.name == 'dc1' else 0)
+            return client.name
+        results = self.fleet.run(slow, timeout={'dc1': 0.1, 'dc2': 0.1},
+                                 clusters=['dc1', 'dc2'])
+        self.assertIsInstance(results['dc1']['error'], TimeoutError)
+        self.assertEqual(results['dc2']['value'], 'dc2')
+
+    def test_logout(self):
+        """ Test logout closes every connected client
+        """
+        self.fleet.connect()
+        self.fleet.logout()
+        self.clients['dc1'].logout.assert_called_once_with()
+        self.assertEqual(self.fleet.clients, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
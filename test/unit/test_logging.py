@@ -0,0 +1,99 @@
+# pylint: disable=wrong-import-position,line-too-long
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+""" Unit tests for the cvprac logging helpers
+"""
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from cvprac import cvp_logging
+from cvprac.cvp_client import CvpClient
+from cvprac.cvp_logging import LogPayload
+
+
+class Unprintable():
+    """ Payload that counts how often it is rendered """
+    renders = 0
+
+    def __str__(self):
+        Unprintable.renders += 1
+        return 'x' * 5000
+
+
+class TestLogging(unittest.TestCase):
+    """ Unit test cases for the logging helpers
+    """
+
+    def test_log_payload_truncates(self):
+        """ Test payloads are capped at the configured size
+        """
+        self.assertEqual(str(LogPayload('abc')), 'abc')
+        text = str(LogPayload({'config': 'a' * 100}, limit=10))
+        self.assertEqual(text, "{'config':... (104 more characters)")
+        with patch.object(cvp_logging, 'LOG_PAYLOAD_LIMIT', 0):
+            self.assertEqual(len(str(LogPayload('a' * 5000))), 5000)
+
+    def test_log_payload_lazy(self):
+        """ Test payloads are not rendered when DEBUG is disabled
+        """
+        log = logging.getLogger('cvprac.test.lazy')
+        log.setLevel(logging.INFO)
+        Unprintable.renders = 0
+        log.debug('payload %s', LogPayload(Unprintable()))
+        self.assertEqual(Unprintable.renders, 0)
+        with self.assertLogs(log, level='INFO') as logs:
+            log.info('payload %s', LogPayload(Unprintable()))
+        self.assertEqual(Unprintable.renders, 1)
+        self.assertIn('... (2952 more characters)', logs.output[0])
+
+    def test_client_log_queue(self):
+        """ Test file logging through the background queue
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'cvprac.log')
+            clnt = CvpClient(logger='cvprac.test.queue', filename=filename,
+                             log_queue=True)
+            self.assertIsNotNone(clnt.log_listener)
+            clnt.log.info('queued message')
+            clnt.stop_logging()
+            self.assertIsNone(clnt.log_listener)
+            self.assertEqual(clnt.log.handlers, [])
+            with open(filename, encoding='utf-8') as log_file:
+                self.assertIn('queued message', log_file.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
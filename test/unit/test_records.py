@@ -0,0 +1,190 @@
+# pylint: disable=wrong-import-position,line-too-long
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+""" Unit tests and memory benchmark for the slotted record types
+"""
+import copy
+import tracemalloc
+import unittest
+from unittest.mock import Mock
+from cvprac.cvp_client import CvpClient
+from cvprac.cvp_records import ConfigletRecord, DeviceRecord
+
+
+def inventory_device(idx):
+    """ Build a device as returned by /inventory/devices """
+    return {'systemMacAddress': f"50:08:00:00:{idx // 256:02x}:{idx % 256:02x}",
+            'hostname': f"leaf{idx}", 'fqdn': f"leaf{idx}.example.com",
+            'serialNumber': f"SN{idx:06d}", 'ipAddress': f"10.0.{idx // 256}."
+                                                         f"{idx % 256}",
+            'modelName': 'DCS-7050TX3-48C8', 'version': '4.30.1F',
+            'internalVersion': '4.30.1F-3210', 'internalBuild': 'abc123',
+            'hardwareRevision': '11.00', 'domainName': 'example.com',
+            'status': 'Registered', 'complianceCode': '0000',
+            'complianceIndication': '', 'ztpMode': False,
+            'mlagEnabled': idx % 2 == 0, 'danzEnabled': False,
+            'parentContainerKey': f"container_{idx % 10}",
+            'bootupTimestamp': 1700000000.0 + idx,
+            'streamingStatus': 'active', 'deviceType': 'eos'}
+
+
+class TestRecords(unittest.TestCase):
+    """ Unit test cases for the record types
+    """
+
+    def setUp(self):
+        """ Build a client that returns a synthetic inventory
+        """
+        self.clnt = CvpClient()
+        self.clnt.apiversion = 8.0
+        self.devices = [inventory_device(idx) for idx in range(2000)]
+        self.clnt.get = Mock(side_effect=lambda url, timeout=30: copy.deepcopy(
+            self.devices))
+        self.clnt.api.get_containers = Mock(return_value={'data': [
+            {'key': f"container_{idx}", 'name': f"pod{idx}"}
+            for idx in range(10)]})
+
+    def test_device_record_aliases(self):
+        """ Test aliases are read-only views of a single field
+        """
+        record = DeviceRecord.from_dict({'systemMacAddress': 'mac1',
+                                         'isMLAGEnabled': True,
+                                         'deviceStatus': 'Registered',
+                                         'custom': 1})
+        self.assertEqual(record['key'], 'mac1')
+        self.assertTrue(record.mlagEnabled)
+        self.assertEqual(record.deviceInfo, 'Registered')
+        self.assertEqual(record['custom'], 1)
+        self.assertEqual(record['type'], 'netelement')
+        self.assertNotIn('fqdn', record)
+        self.assertIsNone(record.get('fqdn'))
+        with self.assertRaises(AttributeError):
+            record.key = 'mac2'
+        with self.assertRaises(TypeError):
+            record['deviceStatus'] = 'Decommissioned'
+        record['status'] = 'Decommissioned'
+        self.assertEqual(record['deviceStatus'], 'Decommissioned')
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_inventory_records_match_dicts(self):
+        """ Test records expose the same keys and values as the dicts
+        """
+        legacy = self.clnt.api.get_inventory()
+        records = self.clnt.api.get_inventory(as_records=True)
+        self.assertEqual(len(records), len(legacy))
+        self.assertIsInstance(records[0], DeviceRecord)
+        self.assertEqual(records[3].to_dict(), legacy[3])
+        self.assertEqual(records[3], legacy[3])
+        self.assertEqual(records[3]['containerName'], 'pod3')
+
+    def test_search_topology_records(self):
+        """ Test search topology keys of all versions are resolved
+        """
+        self.clnt.get = Mock(return_value={'netElementList': [
+            {'systemMacAddress': 'mac1', 'deviceStatus': 'Registered',
+             'parentContainerId': 'c1', 'isMLAGEnabled': False}]})
+        data = self.clnt.api.search_topology('leaf', as_records=True)
+        device = data['netElementList'][0]
+        self.assertEqual(device['status'], 'Registered')
+        self.assertEqual(device['parentContainerKey'], 'c1')
+        self.assertFalse(device['mlagEnabled'])
+
+    def test_search_topology_records_match_dicts(self):
+        """ Test search topology records equal the legacy dicts of the
+            original and V3 endpoints
+        """
+        entries = [
+            {'systemMacAddress': 'mac1', 'key': 'mac1', 'fqdn': 'leaf1',
+             'deviceStatus': 'Registered', 'deviceInfo': 'Registered',
+             'parentContainerId': 'c1', 'isMLAGEnabled': True,
+             'isDANZEnabled': False, 'bootupTimeStamp': 1.0,
+             'internalBuildId': 'abc'},
+            {'systemMacAddress': 'mac2', 'fqdn': 'leaf2',
+             'deviceStatus': 'Registered', 'parentContainerId': 'c1',
+             'mlagEnabled': False}]
+        for apiversion in (6.0, 8.0):
+            self.clnt.apiversion = apiversion
+            self.clnt.get = Mock(side_effect=lambda url, timeout=30: {
+                'netElementList': copy.deepcopy(entries)})
+            legacy = self.clnt.api.search_topology('leaf')['netElementList']
+            records = self.clnt.api.search_topology(
+                'leaf', as_records=True)['netElementList']
+            for record, device in zip(records, legacy):
+                self.assertIsInstance(record, DeviceRecord)
+                self.assertEqual(record.to_dict(), device)
+                self.assertEqual(record, device)
+            self.assertEqual(records[1]['danzEnabled'], '')
+            self.assertEqual(records[1]['bootupTimestamp'], '')
+            self.assertEqual(records[1]['internalBuild'], '')
+            self.assertNotIn('memTotal', records[1])
+            self.assertNotIn('key', records[1])
+            self.assertNotIn('isDANZEnabled', records[1])
+            self.assertEqual(records[0]['key'], 'mac1')
+            # Records with the same keys share one set of hidden keys
+            self.assertIs(records[0]._hidden,
+                          DeviceRecord.from_dict(legacy[0], exact=True)._hidden)
+
+    def test_configlet_records(self):
+        """ Test configlets are returned as records on request
+        """
+        self.clnt.get = Mock(return_value={'data': [
+            {'key': 'c1', 'name': 'base', 'config': 'hostname x'}],
+            'total': 1})
+        data = self.clnt.api.get_configlets(as_records=True)
+        self.assertIsInstance(data['data'][0], ConfigletRecord)
+        self.assertEqual(data['data'][0]['config'], 'hostname x')
+        self.assertEqual(data['total'], 1)
+
+    def test_memory_benchmark(self):
+        """ Benchmark the memory of records against the legacy dicts
+        """
+        def measure(as_records):
+            tracemalloc.start()
+            try:
+                result = self.clnt.api.get_inventory(as_records=as_records)
+                # Only the result references the decoded response once
+                # get_inventory returns, so the traced memory still held is
+                # the memory of the result
+                current, _ = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            return result, current
+        _, dict_bytes = measure(False)
+        _, record_bytes = measure(True)
+        # Values are shared, the saving comes from the per device dicts
+        self.assertLess(record_bytes, dict_bytes / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
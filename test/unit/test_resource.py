@@ -0,0 +1,148 @@
+# pylint: disable=wrong-import-position,line-too-long
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+""" Unit tests for the Resource query layer
+"""
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
+from urllib.parse import unquote
+from cvprac.cvp_client import CvpClient
+from cvprac.cvp_client_errors import CvpApiError
+from cvprac.cvp_resource import Resource, eq_filters, format_utc_time
+
+
+class TestResource(unittest.TestCase):
+    """ Unit test cases for Resource
+    """
+
+    def setUp(self):
+        """ Build a Resource on a client with mocked requests
+        """
+        self.clnt = CvpClient()
+        self.clnt.apiversion = 8.0
+        self.clnt.get = Mock(return_value={'data': []})
+        self.clnt.post = Mock(return_value={'data': []})
+        self.resource = self.clnt.api.resource('/tag/v2/Tag/')
+
+    def test_eq_filters(self):
+        """ Test filter clauses are expanded to every combination
+        """
+        self.assertEqual(eq_filters({'a': None}), [])
+        self.assertEqual(
+            eq_filters({'key.label': ['role', 'pod'], ('key', 'value'): 'x',
+                        'elementType': 'ELEMENT_TYPE_DEVICE'}),
+            [{'key': {'label': 'role', 'value': 'x'},
+              'elementType': 'ELEMENT_TYPE_DEVICE'},
+             {'key': {'label': 'pod', 'value': 'x'},
+              'elementType': 'ELEMENT_TYPE_DEVICE'}])
+
+    def test_format_utc_time(self):
+        """ Test datetimes are formatted as RFC3339 UTC timestamps
+        """
+        cet = timezone(timedelta(hours=1))
+        self.assertEqual(format_utc_time(datetime(2023, 1, 1, 1, tzinfo=cet)),
+                         '2023-01-01T00:00:00.000000Z')
+        self.assertEqual(format_utc_time('2023-01-01T00:00:00Z'),
+                         '2023-01-01T00:00:00Z')
+
+    def test_get_one(self):
+        """ Test the key and time are sent as query parameters
+        """
+        self.assertIsInstance(self.resource, Resource)
+        self.resource.get_one({'label': 'role', 'nested': {'id': 'a b'}},
+                              time=datetime(2023, 1, 1))
+        url = unquote(self.clnt.get.call_args[0][0])
+        self.assertEqual(url, '/api/resources/tag/v2/Tag?key.label=role'
+                         '&key.nested.id=a+b&time=2023-01-01T00:00:00.000000Z')
+
+    def test_get_all(self):
+        """ Test GetAll uses GET without filters and POST with filters
+        """
+        self.clnt.post.return_value = {'data': [{'result': {'value': 1}}]}
+        self.assertEqual(self.resource.get_all(), [])
+        self.clnt.get.assert_called_once()
+        results = self.resource.get_all([{'key': {'label': 'role'}}],
+                                        start='t1', end='t2')
+        self.assertEqual(results, [{'value': 1}])
+        self.assertEqual(self.clnt.post.call_args[0][0],
+                         '/api/resources/tag/v2/Tag/all')
+        self.assertEqual(self.clnt.post.call_args[1]['data'],
+                         {'partialEqFilter': [{'key': {'label': 'role'}}],
+                          'time': {'start': 't1', 'end': 't2'}})
+
+    def test_get_some(self):
+        """ Test keys are fetched in concurrent chunks in order
+        """
+        def post(url, data=None, timeout=30):
+            return {'data': [{'result': {'value': {'key': clause['key']}}}
+                             for clause in data['partialEqFilter']]}
+        self.clnt.post = Mock(side_effect=post)
+        keys = [{'id': str(idx)} for idx in range(7)]
+        resp = self.resource.get_some(keys, chunk_size=3)
+        self.assertEqual(self.clnt.post.call_count, 3)
+        self.assertEqual([res['value']['key'] for res in resp['results']],
+                         keys)
+        self.assertEqual(resp['failed'], [])
+
+        def partial(url, data=None, timeout=30):
+            if data['partialEqFilter'][0]['key'] == keys[3]:
+                raise CvpApiError('failed')
+            return post(url, data)
+        self.clnt.post = Mock(side_effect=partial)
+        resp = self.resource.get_some(keys, chunk_size=3)
+        # The chunks that succeeded are kept
+        self.assertEqual([res['value']['key'] for res in resp['results']],
+                         keys[:3] + keys[6:])
+        self.assertEqual(resp['failed'],
+                         [{'key': key, 'error': 'failed'}
+                          for key in keys[3:6]])
+        with self.assertRaises(ValueError):
+            self.resource.get_some(keys, chunk_size=0)
+
+    def test_set_some(self):
+        """ Test SetSome is chunked and not sent on old versions
+        """
+        self.clnt.post.side_effect = lambda url, data=None, timeout=30: {
+            'data': [{'key': value['key']} for value in data['values']]}
+        values = [{'key': {'id': str(idx)}} for idx in range(5)]
+        resp = self.resource.set_some(values, chunk_size=2)
+        self.assertEqual(self.clnt.post.call_count, 3)
+        self.assertEqual(len(resp['succeeded']), 5)
+        self.clnt.apiversion = 5.0
+        self.assertIsNone(self.resource.set_some(values))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# pylint: disable=wrong-import-position,line-too-long
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+""" Unit tests for the TagIndex class
+"""
+import unittest
+from unittest.mock import Mock
+from cvprac.cvp_tags import TagIndex
+
+
+def assignment(label, value, device_id, interface_id='', workspace_id='',
+               remove=None, ev_type='INITIAL'):
+    """ Build a Resource API tag assignment result """
+    value_dict = {'key': {'workspaceId': workspace_id, 'label': label,
+                          'value': value, 'deviceId': device_id,
+                          'interfaceId': interface_id}}
+    if remove is not None:
+        value_dict['remove'] = remove
+    return {'result': {'value': value_dict, 'type': ev_type}}
+
+
+class TestTagIndex(unittest.TestCase):
+    """ Unit test cases for TagIndex
+    """
+
+    def setUp(self):
+        """ Build an index with mainline assignments and workspace edits
+        """
+        mainline = [assignment('role', 'spine', 'SN1'),
+                    assignment('role', 'spine', 'SN2'),
+                    assignment('role', 'leaf', 'SN3'),
+                    assignment('lldp', 'on', 'SN1', 'Ethernet1')]
+        edits = [assignment('role', 'spine', 'SN2', workspace_id='ws1',
+                            remove=True),
+                 assignment('role', 'spine', 'SN4', workspace_id='ws1',
+                            remove=False),
+                 assignment('role', 'leaf', 'SN5', workspace_id='ws2',
+                            remove=False)]
+        self.index = TagIndex(mainline, edits, workspace_id='ws1')
+
+    def test_queries(self):
+        """ Test lookups with the workspace overlay applied
+        """
+        self.assertEqual(self.index.devices('role', 'spine'), {'SN1', 'SN4'})
+        self.assertEqual(self.index.devices('role'), {'SN1', 'SN3', 'SN4'})
+        self.assertEqual(self.index.elements('lldp'), {('SN1', 'Ethernet1')})
+        self.assertEqual(self.index.devices('lldp'), set())
+        self.assertEqual(self.index.values('role'), {'spine', 'leaf'})
+        self.assertEqual(self.index.labels(), {'role', 'lldp'})
+        self.assertEqual(self.index.tags('SN2'), {})
+        self.assertEqual(self.index.tags('SN1'), {'role': {'spine'}})
+        self.assertEqual(self.index.tags('SN1', 'Ethernet1'),
+                         {'lldp': {'on'}})
+
+    def test_update(self):
+        """ Test incremental updates from subscription events
+        """
+        # Discarding the workspace edit restores the mainline assignment
+        self.index.update(assignment('role', 'spine', 'SN2',
+                                     workspace_id='ws1', ev_type='DELETED'))
+        self.assertIn('SN2', self.index.devices('role', 'spine'))
+        self.index.update(assignment('role', 'leaf', 'SN3',
+                                     ev_type='DELETED'))
+        self.assertEqual(self.index.values('role'), {'spine'})
+        self.assertNotIn('leaf', self.index.values('role'))
+        self.index.update(assignment('role', 'spine', 'SN1',
+                                     workspace_id='ws1', remove=True,
+                                     ev_type='UPDATED'))
+        self.assertEqual(self.index.devices('role'), {'SN2', 'SN4'})
+
+    def test_from_api(self):
+        """ Test the index is built from one request per layer
+        """
+        api = Mock()
+        api.get_all_tag_assignments.return_value = {
+            'data': [assignment('role', 'spine', 'SN1')]}
+        api.get_tag_assignment_edits.return_value = {
+            'data': [assignment('role', 'spine', 'SN1', workspace_id='ws1',
+                                remove=True)]}
+        index = TagIndex.from_api(api)
+        self.assertEqual(index.devices('role'), {'SN1'})
+        api.get_tag_assignment_edits.assert_not_called()
+        index = TagIndex.from_api(api, workspace_id='ws1')
+        self.assertEqual(index.devices('role'), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+# pylint: disable=wrong-import-position,line-too-long
+#
+# Copyright (c) 2024, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# 'AS IS' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+""" Unit tests for the TopologyGraph class
+"""
+import unittest
+from unittest.mock import Mock
+from cvprac.cvp_topology import TopologyGraph
+
+
+TOPOLOGY = {
+    'key': 'root', 'name': 'Tenant', 'childNetElementList': [],
+    'childContainerList': [
+        {'key': 'c_dc1', 'name': 'DC1', 'childNetElementList': [],
+         'childContainerList': [
+             {'key': 'c_leafs', 'name': 'Leafs', 'childContainerList': [],
+              'childNetElementList': [
+                  {'key': 'mac1', 'fqdn': 'leaf1'},
+                  {'key': 'mac2', 'fqdn': 'leaf2'}]},
+             {'key': 'c_spines', 'name': 'Spines', 'childContainerList': [],
+              'childNetElementList': [{'key': 'mac3', 'fqdn': 'spine1'}]}]}]}
+
+MAPPERS = [
+    {'objectId': 'mac1', 'configletId': 'cfg_leaf1', 'order': 1},
+    {'objectId': 'c_leafs', 'configletId': 'cfg_leafs', 'order': 2},
+    {'objectId': 'c_leafs', 'configletId': 'cfg_aaa', 'order': 1},
+    {'objectId': 'root', 'configletId': 'cfg_base', 'order': 1},
+    {'objectId': 'mac1', 'configletId': 'cfg_base', 'order': 0}]
+
+CONFIGLETS = [{'key': 'cfg_base', 'name': 'base'},
+              {'key': 'cfg_aaa', 'name': 'aaa'},
+              {'key': 'cfg_leafs', 'name': 'leafs'},
+              {'key': 'cfg_leaf1', 'name': 'leaf1'}]
+
+
+class TestTopologyGraph(unittest.TestCase):
+    """ Unit test cases for TopologyGraph
+    """
+
+    def setUp(self):
+        """ Build a graph from static data
+        """
+        self.graph = TopologyGraph(
+            TOPOLOGY, MAPPERS, CONFIGLETS,
+            container_bundles={'c_dc1': {'name': 'EOS-4.28'}},
+            device_bundles={'mac3': {'name': 'EOS-4.30'}})
+
+    def test_tree(self):
+        """ Test ancestor paths and subtree membership
+        """
+        self.assertEqual(self.graph.ancestors('mac1'),
+                         ['root', 'c_dc1', 'c_leafs'])
+        self.assertEqual(self.graph.ancestors('root'), [])
+        self.assertEqual(self.graph.parent('c_spines'), 'c_dc1')
+        self.assertTrue(self.graph.in_subtree('mac3', 'c_dc1'))
+        self.assertFalse(self.graph.in_subtree('mac3', 'c_leafs'))
+        self.assertEqual(sorted(self.graph.subtree_devices('c_dc1')),
+                         ['mac1', 'mac2', 'mac3'])
+        self.assertEqual(self.graph.container_by_name('Spines'), 'c_spines')
+        self.assertIsNone(self.graph.container_by_name('missing'))
+
+    def test_effective_configlets(self):
+        """ Test inherited configlet order
+        """
+        self.assertEqual(self.graph.effective_configlets('mac1', names=True),
+                         ['base', 'aaa', 'leafs', 'leaf1'])
+        self.assertEqual(self.graph.effective_configlets('mac2'),
+                         ['cfg_base', 'cfg_aaa', 'cfg_leafs'])
+        self.assertEqual(self.graph.mapped_configlets('mac1'),
+                         ['cfg_base', 'cfg_leaf1'])
+
+    def test_effective_image_bundle(self):
+        """ Test image bundle inheritance
+        """
+        self.assertEqual(self.graph.effective_image_bundle('mac1'),
+                         {'name': 'EOS-4.28'})
+        self.assertEqual(self.graph.effective_image_bundle('mac3'),
+                         {'name': 'EOS-4.30'})
+        graph = TopologyGraph(TOPOLOGY)
+        self.assertIsNone(graph.effective_image_bundle('mac1'))
+
+    def test_from_api(self):
+        """ Test the graph is built from bulk requests
+        """
+        api = Mock()
+        api.filter_topology.return_value = {'topology': TOPOLOGY}
+        api.get_configlets_and_mappers.return_value = {
+            'data': {'configletMappers': MAPPERS, 'configlets': CONFIGLETS}}
+        eos_429 = {'key': 'b429', 'name': 'EOS-4.29'}
+        eos_431 = {'key': 'b431', 'name': 'EOS-4.31'}
+        api.get_image_bundles.return_value = {'data': [
+            eos_429, eos_431,
+            {'key': 'b430', 'name': 'EOS-4.30', 'appliedDevicesCount': 0}]}
+        api._run_concurrently.side_effect = [
+            iter([('c_leafs', {'imageBundleList': [eos_429]}, None),
+                  ('c_dc1', {'imageBundleList': []}, None),
+                  ('c_spines', None, Exception('failed'))]),
+            iter([(eos_429, {'data': [{'systemMacAddress': 'mac1'},
+                                      {'systemMacAddress': 'mac2'}]}, None),
+                  (eos_431, {'data': [{'systemMacAddress': 'mac1'},
+                                      {'systemMacAddress': 'gone'}]},
+                   None)])]
+        graph = TopologyGraph.from_api(api)
+        self.assertEqual(graph.effective_image_bundle('mac2'), eos_429)
+        # The bundle applied to the device overrides the container bundle
+        self.assertEqual(graph.effective_image_bundle('mac1'), eos_431)
+        self.assertIsNone(graph.effective_image_bundle('mac3'))
+        self.assertEqual(sorted(graph.device_bundles), ['mac1', 'mac2'])
+        bundles = api._run_concurrently.call_args_list[1][0][1]
+        self.assertEqual(bundles, [eos_429, eos_431])
+        self.assertEqual(api.filter_topology.call_count, 1)
+        self.assertEqual(api.get_image_bundles.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()